@@ -1,20 +1,15 @@
-import json
-import os
 from datetime import datetime, timedelta
- 
-AGENDA_FILE = "agenda.json"
+from almacenamiento import cargar_json, guardar_json
+# Mismo archivo (y mismo motor JSON/SQLite) que usa la aplicación
+from config import AGENDA_FILE, configurar_almacenamiento
  
 DIAS = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES"]
  
 def cargar_agenda():
-    if not os.path.exists(AGENDA_FILE):
-        return {}
-    with open(AGENDA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return cargar_json(AGENDA_FILE) or {}
  
 def guardar_agenda(agenda):
-    with open(AGENDA_FILE, "w", encoding="utf-8") as f:
-        json.dump(agenda, f, indent=2, ensure_ascii=False)
+    guardar_json(AGENDA_FILE, agenda)
  
 def input_horarios(dia):
     print(f"\nIngrese los horarios para {dia} separados por coma (ej: 14:05, 14:10, ...), o deje vacío para ninguno:")
@@ -76,4 +71,5 @@ def menu():
             print("Opción inválida.")
  
 if __name__ == "__main__":
+    configurar_almacenamiento()
     menu()
\ No newline at end of file
@@ -0,0 +1,1767 @@
+"""Lectura y escritura de los datasets del consultorio.
+
+    cargar_json / guardar_json         dataset completo (copia de la cache)
+    leer_json                          dataset de la cache, sin copiar (no modificar)
+    buscar / buscar_uno / cargar_rango consultas por igualdad y por rango de fechas
+    obtener / modificar / eliminar     un registro por su clave (usar_clave)
+    agregar / siguiente_id             altas sin cargar el dataset
+    derivado / derivados / indice      objetos armados sobre la cache
+    bloqueo / transaccion              bloqueo entre procesos de uno o más datasets
+    compactar / archivar               mantenimiento (journal, meses viejos)
+
+Cada dataset se configura con usar_journal, usar_particiones, usar_snapshots,
+usar_indices, usar_sqlite, etc. (ver config.py); cada sección de este módulo
+explica su formato en disco.
+"""
+import gzip
+import json
+import lzma
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin flock, solo se serializan las escrituras de los hilos del proceso
+    fcntl = None
+
+
+# Tamaño mínimo del journal antes de compactarlo en el JSON, y proporción
+# respecto del JSON a partir de la cual se compacta
+JOURNAL_MIN_BYTES = 256 * 1024
+JOURNAL_PROPORCION = 0.5
+
+# Los JSON se escriben compactos (sin indentar): ocupan la mitad y se leen y
+# escriben más rápido. El formato legible queda para las descargas (exportar_json)
+JSON_COMPACTO = True
+
+# Segundos que espera el primer request de un grupo antes del fsync del
+# journal, para que los que llegan en ese lapso compartan el mismo fsync
+VENTANA_COMMIT = 0.020
+
+# Meses archivados que quedan descomprimidos en la cache a la vez: los usados
+# más recientemente. Los demás se leen cuando se consultan y se descartan
+ARCHIVO_EN_CACHE = 2
+
+_journaled = set()
+
+# Datasets partidos por mes: clave -> campo de fecha; y partición -> dataset
+_particiones = {}
+_padres = {}
+
+# Motor SQLite activo (o None si se usan los archivos JSON) y tabla de cada archivo
+_motor = None
+_tablas = {}
+
+
+def _clave(path):
+    return os.path.abspath(path)
+
+
+def usar_sqlite(ruta_db, tablas):
+    """Pasa los archivos indicados ({path: tabla}) a la base SQLite ruta_db.
+
+    Si la base es nueva, cada tabla se importa del JSON correspondiente.
+    """
+    global _motor
+    from almacenamiento_sqlite import MotorSQLite
+
+    _tablas.clear()
+    _tablas.update({_clave(path): tabla for path, tabla in tablas.items()})
+    paths = {tabla: path for path, tabla in tablas.items()}
+
+    def importar(tabla):
+        path = paths.get(tabla)
+        return leer_archivos(path) if path else None
+
+    _motor = MotorSQLite(ruta_db, importar=importar)
+    invalidar_cache()
+
+
+def _tabla(path):
+    if _motor is None:
+        return None
+    return _tablas.get(_clave(path))
+
+
+def usar_journal(*paths):
+    """Registra archivos cuyas escrituras van al journal en lugar de reescribirse"""
+    for path in paths:
+        _journaled.add(_clave(path))
+
+
+def _usa_journal(path):
+    return _clave(path) in _journaled and _tabla(path) is None and not _particionado(path)
+
+
+def _ruta_journal(path):
+    return path + ".journal"
+
+
+# ===================== Bloqueos ======================
+
+_bloqueos = threading.local()
+_locks_hilos = {}
+
+
+def _ruta_lock(path):
+    return path + ".lock"
+
+
+def _tomados():
+    """Bloqueos que tiene el hilo actual: clave -> exclusivo"""
+    tomados = getattr(_bloqueos, "tomados", None)
+    if tomados is None:
+        tomados = _bloqueos.tomados = {}
+    return tomados
+
+
+@contextmanager
+def _bloqueo_archivo(path, exclusivo):
+    if fcntl is None:
+        if not exclusivo:
+            yield
+            return
+        with _cache_lock:
+            lock = _locks_hilos.setdefault(_clave(path), threading.Lock())
+        with lock:
+            yield
+        return
+
+    fd = os.open(_ruta_lock(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        yield
+    finally:
+        # Cerrar el descriptor libera el flock
+        os.close(fd)
+
+
+@contextmanager
+def bloqueo(path, exclusivo=True):
+    """Bloqueo de un dataset entre procesos. Reentrante dentro del mismo hilo.
+
+    Las particiones usan el bloqueo del dataset al que pertenecen.
+    """
+    path = _padres.get(_clave(path), path)
+    clave = _clave(path)
+    tomados = _tomados()
+    if clave in tomados:
+        if exclusivo and not tomados[clave]:
+            raise RuntimeError(f"{path}: no se puede pasar de bloqueo compartido a exclusivo")
+        yield
+        return
+
+    tomados[clave] = exclusivo
+    try:
+        with _bloqueo_archivo(path, exclusivo):
+            try:
+                yield
+            finally:
+                if exclusivo:
+                    # Toda escritura se hace con el bloqueo exclusivo tomado
+                    _nueva_version(clave)
+    finally:
+        del tomados[clave]
+        if not tomados:
+            # Ya sin bloqueos: esperar a que lo escrito quede en disco
+            _confirmar_pendientes()
+
+
+@contextmanager
+def transaccion(*paths):
+    """Bloqueo exclusivo de uno o más datasets durante un leer-modificar-guardar.
+
+    Los archivos se bloquean siempre en el mismo orden para que dos
+    transacciones sobre los mismos datasets no se traben entre sí.
+    """
+    with ExitStack() as pila:
+        for path in sorted(set(paths), key=_clave):
+            pila.enter_context(bloqueo(path))
+        yield
+
+
+# ===================== Cache de datos ======================
+
+class _Entrada:
+    """Datos parseados de un archivo junto con la firma con la que se leyeron.
+
+    indices guarda los índices armados sobre estos datos, por ejemplo
+    ("registros", campos) -> {valores: registros}; se descartan junto con ellos
+    cuando cambia el archivo.
+    """
+
+    __slots__ = ("firma", "datos", "indices")
+
+    def __init__(self, firma, datos):
+        self.firma = firma
+        self.datos = datos
+        self.indices = {}
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _firma_archivo(path):
+    """Identifica la versión en disco de un archivo: (mtime, tamaño, inodo)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _firma(path):
+    tabla = _tabla(path)
+    if tabla is not None:
+        return ("sqlite", _motor.version(tabla))
+    if _particionado(path):
+        return tuple((parte, _firma(parte)) for parte in _partes(path).values())
+    if _usa_journal(path):
+        return (_firma_archivo(path), _firma_archivo(_ruta_journal(path)))
+    return _firma_archivo(path)
+
+
+# Versión de cada dataset en este proceso: sube al soltar el bloqueo
+# exclusivo, o sea después de cada escritura (o transacción) sobre él
+_versiones = {}
+
+
+def _nueva_version(clave):
+    with _cache_lock:
+        _versiones[clave] = _versiones.get(clave, 0) + 1
+
+
+def version(path):
+    """Valor que cambia cada vez que cambian los datos del dataset.
+
+    Junta el contador de escrituras de este proceso con la firma en disco,
+    que cambia también cuando escribe otro worker. Sirve de clave para
+    guardar resultados calculados sobre el dataset (ver cache_reportes.py):
+    tomarla antes de leer los datos.
+    """
+    return (_versiones.get(_clave(path), 0), _firma(path))
+
+
+def _copiar(datos):
+    """Copia de dos niveles: la lista/dict contenedor y cada registro.
+
+    Alcanza para que las rutas modifiquen campos de los registros (estado,
+    hora, paciente enriquecido, etc.) sin alterar lo que quedó en la cache.
+    """
+    if isinstance(datos, list):
+        return [dict(r) if isinstance(r, dict) else r for r in datos]
+    if isinstance(datos, dict):
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in datos.items()}
+    return datos
+
+
+def _abrir(path, modo="r"):
+    """Abre un JSON, comprimido o no según la extensión"""
+    if path.endswith(".gz"):
+        return gzip.open(path, modo + "t", encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, modo + "t", encoding="utf-8")
+    return open(path, modo, encoding="utf-8")
+
+
+def _leer_archivo(path):
+    if not os.path.exists(path):
+        return []
+    with _abrir(path) as file:
+        if not _usa_snapshot(path):
+            return json.load(file)
+        st = os.fstat(file.fileno())
+        datos = _leer_snapshot(path, st)
+        if datos is None:
+            datos = json.load(file)
+            _escribir_snapshot(path, datos, st)
+        return datos
+
+
+def leer_archivos(path):
+    """Lee el JSON de disco aplicando su journal, sin pasar por la cache"""
+    if _clave(path) in _particiones and os.path.isdir(_dir_particiones(path)):
+        return [r for parte in _historico(path) for r in leer_archivos(parte)]
+    datos = _leer_archivo(path)
+    if _clave(path) in _journaled:
+        _aplicar_operaciones(datos, _leer_journal(path))
+    return datos
+
+
+def _entrada(path):
+    firma = _firma(path)
+    entrada = _cache.get(path)
+    if entrada is not None and entrada.firma == firma:
+        if _es_archivada(path):
+            with _cache_lock:
+                _recordar_archivada(path)
+        return entrada
+
+    tabla = _tabla(path)
+    if tabla is not None:
+        version, datos = _motor.leer(tabla)
+        firma = ("sqlite", version)
+    elif _particionado(path):
+        with bloqueo(path, exclusivo=False):
+            firma = _firma(path)
+            datos = [r for parte in _partes(path).values() for r in leer_json(parte)]
+    else:
+        # JSON y journal se leen juntos, sin una escritura en el medio
+        with bloqueo(path, exclusivo=False):
+            firma = _firma(path)
+            datos = leer_archivos(path)
+
+    entrada = _Entrada(firma, datos)
+    with _cache_lock:
+        _cache[path] = entrada
+        if _es_archivada(path):
+            _recordar_archivada(path)
+    return entrada
+
+
+def leer_json(path):
+    """Devuelve los datos compartidos de la cache (no modificar)"""
+    return _entrada(path).datos
+
+
+def cargar_json(path):
+    """Devuelve una copia de los datos del archivo, lista para modificar"""
+    return _copiar(leer_json(path))
+
+
+def _escribir_archivo(path, data):
+    # Temporal + rename: el archivo se reemplaza de una vez o no se toca
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as file:
+            if JSON_COMPACTO:
+                # dumps de una vez usa el encoder en C (json.dump va por partes, en Python)
+                file.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            else:
+                json.dump(data, file, indent=4, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if _usa_snapshot(path):
+        _escribir_snapshot(path, data, os.stat(path))
+
+
+def usar_json_compacto(compacto=True):
+    """Formato de los JSON en disco: compacto (por defecto) o indentado"""
+    global JSON_COMPACTO
+    JSON_COMPACTO = compacto
+
+
+def exportar_json(path):
+    """Contenido completo del dataset (con lo archivado) como JSON indentado, para descargar"""
+    return json.dumps(leer_completo(path), indent=4, ensure_ascii=False).encode("utf-8")
+
+
+def guardar_json(path, data):
+    with bloqueo(path):
+        if _tabla(path) is not None:
+            _guardar_en_sqlite(path, data)
+            return
+
+        if _particionado(path) and isinstance(data, list):
+            _guardar_particionado(path, data)
+            return
+
+        if _usa_journal(path) and isinstance(data, list):
+            _guardar_con_journal(path, data)
+            return
+
+        firma_previa = _firma(path)
+        _escribir_archivo(path, data)
+
+        # Lo que se acaba de escribir pasa a ser la versión vigente en la cache
+        with _cache_lock:
+            _cache[path] = _nueva_entrada(path, _firma(path), _copiar(data), firma_previa)
+
+
+def _nueva_entrada(path, firma, datos, firma_previa):
+    """Entrada de la cache para lo recién escrito.
+
+    Los derivados de la entrada anterior (ver derivado) pasan a la nueva si la
+    anterior era la versión sobre la que se escribió (firma_previa).
+    """
+    entrada = _Entrada(firma, datos)
+    vieja = _cache.get(path)
+    if vieja is not None and vieja.firma == firma_previa:
+        _trasladar_derivados(vieja, entrada)
+    return entrada
+
+
+def _trasladar_derivados(vieja, nueva):
+    """Pasa los derivados de vieja a nueva, actualizados con los registros que cambiaron"""
+    derivados = {nombre: objeto for nombre, objeto in vieja.indices.items() if nombre[0] == "derivado"}
+    if not derivados or not isinstance(vieja.datos, list) or not isinstance(nueva.datos, list):
+        return
+    inicio, fin = _tramo_distinto(vieja.datos, nueva.datos)
+    quitados = vieja.datos[inicio:len(vieja.datos) - fin]
+    agregados = nueva.datos[inicio:len(nueva.datos) - fin]
+    for nombre, objeto in derivados.items():
+        objeto.actualizar(quitados, agregados)
+        nueva.indices[nombre] = objeto
+
+
+def derivado(path, nombre, construir):
+    """Objeto armado con construir(datos) sobre los datos de la cache.
+
+    Se guarda junto a ellos, como los índices. Al escribir un dataset que es
+    una lista desde este proceso no se rearma: se llama a
+    objeto.actualizar(quitados, agregados) con los registros que cambiaron.
+    Si el dataset no es una lista (la agenda) o el archivo cambió desde otro
+    proceso, se arma de nuevo.
+    """
+    entrada = _entrada(path)
+    objeto = entrada.indices.get(("derivado", nombre))
+    if objeto is None:
+        objeto = construir(entrada.datos)
+        # Dos hilos pueden armarlo a la vez: queda uno, son equivalentes
+        objeto = entrada.indices.setdefault(("derivado", nombre), objeto)
+    return objeto
+
+
+def derivados(path, nombre, construir, desde=None, hasta=None, campo="fecha", archivados=True):
+    """derivado() de cada archivo del dataset que puede tener registros entre desde y hasta.
+
+    En un dataset particionado es uno por mes (archivados incluidos): una
+    consulta de un rango solo arma o usa los de esos meses, y una escritura
+    solo actualiza el de su mes. Sin rango y con archivados=False son solo
+    los meses activos, los mismos datos que cargar_json.
+    """
+    with _lectura(path):
+        if desde is None and not archivados:
+            fuentes = _fuentes(path, {})
+        elif desde is None:
+            fuentes = _historico(path) if _particionado(path) else [path]
+        else:
+            fuentes = _fuentes(path, {}, (campo, desde, hasta))
+        return [derivado(fuente, nombre, construir) for fuente in fuentes]
+
+
+def invalidar_cache(path=None):
+    """Descarta los datos en memoria de un archivo (o de todos)"""
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+            _archivadas_en_cache.clear()
+        else:
+            _cache.pop(path, None)
+            _archivadas_en_cache.pop(path, None)
+
+
+# ===================== Consultas ======================
+#
+# Con SQLite se resuelven con los índices de la base; con los archivos JSON
+# se filtra la lista en memoria. Devuelven copias de los registros.
+
+def _coincide(registro, campos):
+    return isinstance(registro, dict) and all(registro.get(c) == v for c, v in campos.items())
+
+
+def _en_rango(registro, campo, desde, hasta):
+    valor = registro.get(campo) if isinstance(registro, dict) else None
+    return isinstance(valor, str) and desde <= valor <= hasta
+
+
+def buscar(path, **campos):
+    """Registros cuyos campos son iguales a los indicados"""
+    tabla = _tabla(path)
+    if tabla is not None and _motor.consultable(tabla, campos):
+        return _motor.consultar(tabla, campos)
+    with _lectura(path):
+        return [dict(r) for parte in _fuentes(path, campos)
+                for r in _candidatos(parte, campos) if _coincide(r, campos)]
+
+
+def buscar_uno(path, **campos):
+    """Primer registro cuyos campos son iguales a los indicados, o None"""
+    tabla = _tabla(path)
+    if tabla is not None and _motor.consultable(tabla, campos):
+        encontrados = _motor.consultar(tabla, campos)
+        return encontrados[0] if encontrados else None
+    with _lectura(path):
+        return next((dict(r) for parte in _fuentes(path, campos)
+                     for r in _candidatos(parte, campos) if _coincide(r, campos)), None)
+
+
+def iterar_json(path, **campos):
+    """Recorre los registros (que cumplen las igualdades) sin armar una lista.
+
+    Si el dataset está al día en la cache se recorre desde ahí; si no, el
+    archivo se decodifica de a un registro, sin cargarlo entero ni guardarlo en
+    la cache. Los registros son compartidos: no modificarlos.
+    """
+    tabla = _tabla(path)
+    if tabla is not None and _motor.consultable(tabla, campos):
+        yield from _motor.iterar(tabla, campos)
+        return
+
+    entrada = _cache.get(path)
+    if entrada is not None and entrada.firma == _firma(path):
+        registros = entrada.datos
+    elif tabla is not None or _usa_journal(path) or _particionado(path):
+        registros = leer_json(path)
+    else:
+        registros = _iterar_archivo(path)
+    for registro in registros:
+        if _coincide(registro, campos):
+            yield registro
+
+
+def _iterar_archivo(path, tam_bloque=64 * 1024):
+    """Registros de un archivo con una lista JSON, decodificados de a uno"""
+    if not os.path.exists(path):
+        return
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as file:
+        buffer, pos, fin_archivo = "", 0, False
+        en_lista = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer) or not fin_archivo and len(buffer) - pos < tam_bloque:
+                # Mantener al menos un bloque por delante antes de decodificar
+                mas = file.read(tam_bloque)
+                fin_archivo = not mas
+                buffer, pos = buffer[pos:] + mas, 0
+                if not buffer:
+                    raise ValueError(f"{path}: JSON incompleto")
+                continue
+            if not en_lista:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path}: se esperaba una lista JSON")
+                en_lista, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                registro, fin = decoder.raw_decode(buffer, pos)
+                # Completo solo si le sigue "," o "]": si no, puede ser un número cortado
+                siguiente = fin
+                while siguiente < len(buffer) and buffer[siguiente] in " \t\r\n":
+                    siguiente += 1
+                completo = siguiente < len(buffer) and buffer[siguiente] in ",]"
+                if not completo and fin_archivo:
+                    raise ValueError(f"{path}: JSON mal formado")
+            except ValueError:
+                if fin_archivo:
+                    raise
+                completo = False
+            if not completo:
+                # Registro más largo que lo leído: agregar otro bloque
+                mas = file.read(tam_bloque)
+                fin_archivo = not mas
+                buffer, pos = buffer[pos:] + mas, 0
+                continue
+            yield registro
+            pos = fin
+
+
+def cargar_rango(path, desde, hasta, campo="fecha", **campos):
+    """Registros con desde <= campo <= hasta (fechas ISO), más igualdades opcionales"""
+    tabla = _tabla(path)
+    if tabla is not None and _motor.consultable(tabla, [campo, *campos]):
+        return _motor.consultar(tabla, campos, (campo, desde, hasta))
+    with _lectura(path):
+        return [dict(r) for parte in _fuentes(path, campos, (campo, desde, hasta))
+                for r in leer_json(parte)
+                if _en_rango(r, campo, desde, hasta) and _coincide(r, campos)]
+
+
+def cargar_prefijo(path, prefijo, campo="fecha", **campos):
+    """Registros cuyo campo empieza con prefijo (por ejemplo un mes "2025-03")"""
+    return cargar_rango(path, prefijo, prefijo + "\uffff", campo, **campos)
+
+
+# ===================== Índices en memoria ======================
+#
+# Los campos registrados con usar_indices tienen un índice valor -> registros
+# (en el orden del archivo) armado sobre los datos de la cache; un índice
+# puede ser de varios campos, como (medico, fecha, hora). buscar y buscar_uno
+# con igualdades sobre todos los campos de un índice van directo a los
+# registros con esos valores en lugar de recorrer la lista. El índice se arma
+# la primera vez que se usa después de cada escritura, y en un dataset
+# particionado hay uno por mes: una escritura solo obliga a rearmar el del mes
+# que cambió, que ya se copia y compara entero al guardarlo.
+
+_indexados = {}
+
+
+def usar_indices(path, *indices):
+    """Registra índices del dataset para buscar/buscar_uno.
+
+    Cada índice es un campo ("dni") o una tupla de campos ("medico", "fecha", "hora").
+    """
+    registrados = _indexados.setdefault(_clave(path), [])
+    for campos in indices:
+        campos = (campos,) if isinstance(campos, str) else tuple(campos)
+        if campos not in registrados:
+            registrados.append(campos)
+    # Los de más campos primero: son los más selectivos
+    registrados.sort(key=len, reverse=True)
+
+
+def _campos_indexados(path):
+    padre = _padres.get(_clave(path))
+    return _indexados.get(_clave(padre if padre is not None else path), ())
+
+
+def _valor_indexable(valor):
+    return isinstance(valor, (str, int, float))
+
+
+def _indice(path, campos):
+    entrada = _entrada(path)
+    indice = entrada.indices.get(("registros", campos))
+    if indice is None:
+        indice = {}
+        registros = entrada.datos if isinstance(entrada.datos, list) else ()
+        for registro in registros:
+            if not isinstance(registro, dict):
+                continue
+            valores = tuple(registro.get(c) for c in campos)
+            if all(map(_valor_indexable, valores)):
+                indice.setdefault(valores, []).append(registro)
+        # Dos hilos pueden armarlo a la vez: queda cualquiera de los dos, son iguales
+        entrada.indices[("registros", campos)] = indice
+    return indice
+
+
+def _candidatos(path, campos):
+    """Registros del archivo que pueden cumplir las igualdades (compartidos)"""
+    for indexados in _campos_indexados(path):
+        valores = tuple(campos.get(c) for c in indexados)
+        if all(c in campos for c in indexados) and all(map(_valor_indexable, valores)):
+            return _indice(path, indexados).get(valores, ())
+    return leer_json(path)
+
+
+def indice(path, campo):
+    """Índice valor -> primer registro con ese valor en campo, sobre la cache.
+
+    Para cruzar datasets (el paciente de cada turno) en O(1) por registro. Se
+    guarda junto a los datos de la cache y se rearma solo cuando el archivo
+    cambió. Los registros son compartidos: no modificarlos.
+    """
+    entrada = _entrada(path)
+    primeros = entrada.indices.get(("primero", campo))
+    if primeros is None:
+        primeros = {}
+        registros = entrada.datos if isinstance(entrada.datos, list) else ()
+        for registro in registros:
+            valor = registro.get(campo) if isinstance(registro, dict) else None
+            if isinstance(valor, (str, int, float)):
+                primeros.setdefault(valor, registro)
+        entrada.indices[("primero", campo)] = primeros
+    return primeros
+
+
+# ===================== Registros por clave ======================
+#
+# Un dataset con usar_clave (los turnos: dni_paciente, fecha, hora) se puede
+# leer, modificar y borrar de a un registro. La posición del registro sale de
+# un índice clave -> posición sobre la partición del mes, y el cambio va al
+# journal como una sola operación "set" o "del" (el "del" queda como marca de
+# borrado hasta la próxima compactación), sin cargar ni comparar el dataset.
+# La cache de la partición pasa a la lista nueva con sus índices ya
+# corregidos, así el próximo cambio tampoco los rearma. Con SQLite es un
+# SELECT/UPDATE/DELETE por las columnas de la clave (MotorSQLite.cambiar).
+
+_claves = {}
+
+
+def usar_clave(path, *campos):
+    """Campos que identifican a cada registro del dataset (también quedan indexados)"""
+    _claves[_clave(path)] = campos
+    usar_indices(path, campos)
+
+
+def _posiciones(entrada, campos):
+    posiciones = entrada.indices.get(("posicion", campos))
+    if posiciones is None:
+        posiciones = {}
+        for i, registro in enumerate(entrada.datos):
+            if isinstance(registro, dict):
+                posiciones.setdefault(tuple(registro.get(c) for c in campos), i)
+        entrada.indices[("posicion", campos)] = posiciones
+    return posiciones
+
+
+def _ubicar(path, clave):
+    """(archivo, entrada de la cache, posición) del registro con esa clave, o None"""
+    campos = _claves[_clave(path)]
+    if _particionado(path):
+        campo = _particiones[_clave(path)]
+        filtro = dict(zip(campos, clave))
+        if campo in filtro:
+            # Solo los meses activos: lo archivado no se modifica
+            parte = _partes(path).get(_mes(filtro[campo]))
+            archivos = [parte] if parte else []
+        else:
+            archivos = list(_partes(path).values())
+    else:
+        archivos = [path]
+    for archivo in archivos:
+        entrada = _entrada(archivo)
+        if not isinstance(entrada.datos, list):
+            continue
+        i = _posiciones(entrada, campos).get(tuple(clave))
+        if i is not None:
+            return archivo, entrada, i
+    return None
+
+
+def _tabla_por_clave(path):
+    """Tabla SQLite del dataset si sus registros se escriben de a uno en la base, o None"""
+    tabla = _tabla(path)
+    if tabla is not None and _motor.consultable(tabla, _claves.get(_clave(path), ())):
+        return tabla
+    return None
+
+
+def _cambiado_en_sqlite(path, previa, nueva, i, anterior, registro):
+    """Pasa la cache a la versión nueva de la tabla, con el cambio de la posición i.
+
+    Como _trasladar_indices: registro None es una baja, anterior None un alta.
+    Si la cache no estaba en la versión previa se descarta y se relee.
+    """
+    with _cache_lock:
+        entrada = _cache.get(path)
+        if entrada is None or entrada.firma != ("sqlite", previa) or not isinstance(entrada.datos, list):
+            _cache.pop(path, None)
+            return
+        datos = list(entrada.datos)
+        if anterior is None:
+            datos.append(registro)
+        else:
+            # El de la cache: los índices lo reconocen por identidad
+            anterior = datos[i]
+            if registro is None:
+                del datos[i]
+            else:
+                datos[i] = registro
+        nueva_entrada = _cache[path] = _Entrada(("sqlite", nueva), datos)
+    _trasladar_indices(entrada, nueva_entrada, i, anterior, registro)
+
+
+def _cambiar_en_sqlite(path, tabla, clave, cambios):
+    """UPDATE (o DELETE, con cambios None) por clave en la base. Devuelve (anterior, nuevo) o None"""
+    cambiado = _motor.cambiar(tabla, dict(zip(_claves[_clave(path)], clave)), cambios)
+    if cambiado is None:
+        return None
+    previa, nueva, i, anterior, registro = cambiado
+    _cambiado_en_sqlite(path, previa, nueva, i, anterior, registro)
+    return anterior, registro
+
+
+def obtener(path, *clave):
+    """Registro con esa clave (copia), o None"""
+    tabla = _tabla_por_clave(path)
+    if tabla is not None:
+        encontrados = _motor.consultar(tabla, dict(zip(_claves[_clave(path)], clave)))
+        return encontrados[0] if encontrados else None
+    with _lectura(path):
+        ubicado = _ubicar(path, clave)
+        if ubicado is None:
+            return None
+        _, entrada, i = ubicado
+        return dict(entrada.datos[i])
+
+
+def _trasladar_indices(vieja, nueva, i, anterior, registro):
+    """Copia a la entrada nueva los índices de la vieja, corregidos.
+
+    registro reemplaza a anterior en la posición i (registro None: se borró;
+    anterior None: se agregó al final, en i). Los índices que no se pueden
+    corregir sin recorrer se descartan y se rearman cuando se usen.
+    """
+    for nombre, indice in vieja.indices.items():
+        if nombre[0] == "posicion":
+            if registro is None:
+                continue
+            indice = dict(indice)
+            clave_vieja = tuple(anterior.get(c) for c in nombre[1]) if anterior is not None else None
+            clave_nueva = tuple(registro.get(c) for c in nombre[1])
+            if clave_nueva != clave_vieja:
+                if clave_vieja is not None and indice.get(clave_vieja) == i:
+                    del indice[clave_vieja]
+                indice.setdefault(clave_nueva, i)
+        elif nombre[0] == "registros":
+            indice = dict(indice)
+            viejos = tuple(anterior.get(c) for c in nombre[1]) if anterior is not None else None
+            nuevos = tuple(registro.get(c) for c in nombre[1]) if registro is not None else None
+            if viejos == nuevos:
+                if viejos in indice:
+                    indice[viejos] = [registro if r is anterior else r for r in indice[viejos]]
+            else:
+                if viejos in indice:
+                    quedan = [r for r in indice[viejos] if r is not anterior]
+                    if quedan:
+                        indice[viejos] = quedan
+                    else:
+                        del indice[viejos]
+                if nuevos is not None and all(map(_valor_indexable, nuevos)):
+                    indice[nuevos] = indice.get(nuevos, []) + [registro]
+        elif nombre[0] == "primero" and anterior is None:
+            indice = dict(indice)
+            valor = registro.get(nombre[1])
+            if _valor_indexable(valor):
+                indice.setdefault(valor, registro)
+        elif nombre[0] == "derivado":
+            indice.actualizar([anterior] if anterior is not None else [],
+                              [registro] if registro is not None else [])
+        else:
+            continue
+        nueva.indices[nombre] = indice
+
+
+def _cambiar(path, clave, registro_nuevo):
+    """Reemplaza (o borra, con registro_nuevo None) el registro con esa clave.
+
+    Devuelve el registro anterior, o None si no existe.
+    """
+    ubicado = _ubicar(path, clave)
+    if ubicado is None:
+        return None
+    archivo, entrada, i = ubicado
+    anterior = entrada.datos[i]
+
+    mismo_archivo = registro_nuevo is None or not _particionado(path) or \
+        _mes(registro_nuevo.get(_particiones[_clave(path)])) == _mes(anterior.get(_particiones[_clave(path)]))
+    if not (_usa_journal(archivo) and os.path.exists(archivo) and mismo_archivo):
+        # Sin journal o cambio de mes: se guarda el dataset completo
+        datos = cargar_json(path)
+        posicion = next(j for j, r in enumerate(datos) if r == anterior)
+        if registro_nuevo is None:
+            del datos[posicion]
+        else:
+            datos[posicion] = registro_nuevo
+        guardar_json(path, datos)
+        return anterior
+
+    datos = list(entrada.datos)
+    if registro_nuevo is None:
+        del datos[i]
+        operacion = {"op": "del", "i": i}
+    else:
+        registro_nuevo = dict(registro_nuevo)
+        datos[i] = registro_nuevo
+        operacion = {"op": "set", "i": i, "r": registro_nuevo}
+    nueva = _agregar_al_journal(archivo, [operacion], datos)
+    if nueva is not None:
+        _trasladar_indices(entrada, nueva, i, anterior, registro_nuevo)
+    return anterior
+
+
+def modificar(path, clave, cambios):
+    """Actualiza campos del registro con esa clave. Devuelve el registro nuevo o None"""
+    with bloqueo(path):
+        tabla = _tabla_por_clave(path)
+        if tabla is not None:
+            cambiado = _cambiar_en_sqlite(path, tabla, clave, dict(cambios))
+            return dict(cambiado[1]) if cambiado is not None else None
+        ubicado = _ubicar(path, clave)
+        if ubicado is None:
+            return None
+        _, entrada, i = ubicado
+        registro = dict(entrada.datos[i])
+        registro.update(cambios)
+        _cambiar(path, clave, registro)
+        return dict(registro)
+
+
+def eliminar(path, *clave):
+    """Borra el registro con esa clave. Devuelve False si no existe"""
+    with bloqueo(path):
+        tabla = _tabla_por_clave(path)
+        if tabla is not None:
+            return _cambiar_en_sqlite(path, tabla, clave, None) is not None
+        return _cambiar(path, clave, None) is not None
+
+
+# ===================== Altas e identificadores ======================
+#
+# agregar() suma un registro al final del dataset (en un dataset particionado,
+# al de la partición de su mes) como una operación "add" del journal, sin
+# cargar ni comparar la lista: si la cache está al día pasa a la lista nueva
+# con sus índices corregidos; si no, se descarta y la próxima lectura relee.
+# Con SQLite es un INSERT de una fila (MotorSQLite.agregar).
+# Con usar_secuencia el último id asignado queda en "<archivo>.seq" y
+# siguiente_id nunca repite uno, aunque se borren registros.
+
+_secuencias = {}
+
+
+def usar_secuencia(path, campo="id"):
+    """Campo numérico del dataset que se asigna con siguiente_id"""
+    _secuencias[_clave(path)] = campo
+
+
+def _ruta_secuencia(path):
+    return path + ".seq"
+
+
+def siguiente_id(path):
+    """Próximo id del dataset: uno más que el último asignado"""
+    campo = _secuencias[_clave(path)]
+    ruta = _ruta_secuencia(path)
+    with bloqueo(path):
+        try:
+            with open(ruta, "r", encoding="utf-8") as file:
+                ultimo = int(file.read())
+        except (FileNotFoundError, ValueError):
+            # Primera vez: se sigue desde el mayor id existente (incluido lo archivado)
+            ultimo = max((r[campo] for r in leer_completo(path)
+                          if isinstance(r, dict) and isinstance(r.get(campo), int)), default=0)
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            file.write(str(ultimo + 1))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, ruta)
+        return ultimo + 1
+
+
+def agregar(path, registro):
+    """Agrega un registro al final del dataset. Devuelve una copia"""
+    registro = dict(registro)
+    with bloqueo(path):
+        tabla = _tabla(path)
+        if tabla is not None and _motor.consultable(tabla, ()):
+            # INSERT de una fila, sin cargar ni comparar la tabla
+            previa, nueva, i = _motor.agregar(tabla, registro)
+            _cambiado_en_sqlite(path, previa, nueva, i, None, registro)
+            return dict(registro)
+        archivo = path
+        if _particionado(path):
+            archivo = _ruta_particion(path, _mes(registro.get(_particiones[_clave(path)])))
+            if not os.path.exists(archivo):
+                # Primer registro del mes: la partición nace con él
+                _compactar(archivo, [registro])
+                return dict(registro)
+        if not (_usa_journal(archivo) and os.path.exists(archivo)):
+            # Sin journal: se guarda el dataset completo
+            datos = cargar_json(path)
+            datos.append(registro)
+            guardar_json(path, datos)
+            return dict(registro)
+
+        entrada = _cache.get(archivo)
+        if entrada is not None and (entrada.firma != _firma(archivo) or not isinstance(entrada.datos, list)):
+            entrada = None
+        datos = entrada.datos + [registro] if entrada is not None else None
+        nueva = _agregar_al_journal(archivo, [{"op": "add", "r": registro}], datos)
+        if nueva is not None and entrada is not None:
+            _trasladar_indices(entrada, nueva, len(datos) - 1, None, registro)
+        return dict(registro)
+
+
+# ===================== Journal ======================
+#
+# El journal empieza con una cabecera que identifica la versión del JSON
+# sobre la que se aplican sus operaciones: {"base": [tamaño, mtime]}.
+# Cada línea siguiente es una operación posicional sobre la lista:
+#   {"op": "ins", "i": 3, "r": {...}}   inserta el registro en la posición i
+#   {"op": "set", "i": 3, "r": {...}}   reemplaza el registro de la posición i
+#   {"op": "del", "i": 3}               elimina el registro de la posición i
+#   {"op": "add", "r": {...}}           agrega el registro al final (agregar)
+# Si la cabecera no coincide con el JSON actual, el journal ya fue
+# compactado (o el JSON se reemplazó a mano) y se ignora.
+
+def _base_journal(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _leer_journal(path):
+    ruta = _ruta_journal(path)
+    if not os.path.exists(ruta):
+        return []
+
+    with open(ruta, "r", encoding="utf-8") as file:
+        lineas = file.read().split("\n")
+
+    try:
+        cabecera = json.loads(lineas[0])
+    except ValueError:
+        return []
+    if cabecera.get("base") != _base_journal(path):
+        return []
+
+    # Lo que sigue al último "\n" es una línea cortada durante la escritura
+    # (nunca se confirmó): se descarta, y la próxima escritura la recorta
+    operaciones = []
+    for n, linea in enumerate(lineas[1:-1], 2):
+        if not linea:
+            continue
+        try:
+            operaciones.append(json.loads(linea))
+        except ValueError:
+            raise ValueError(f"{ruta}: línea {n} del journal dañada") from None
+    return operaciones
+
+
+def _recortar_journal(ruta, tam):
+    """Recorta el journal hasta su último "\n" (una línea cortada por un corte). Devuelve el tamaño"""
+    with open(ruta, "r+b") as file:
+        fin = tam
+        while fin > 0:
+            inicio = max(0, fin - 4096)
+            file.seek(inicio)
+            bloque = file.read(fin - inicio)
+            if inicio + len(bloque) == tam and bloque.endswith(b"\n"):
+                return tam
+            posicion = bloque.rfind(b"\n")
+            if posicion >= 0:
+                tam = inicio + posicion + 1
+                file.truncate(tam)
+                return tam
+            fin = inicio
+        file.truncate(0)
+        return 0
+
+
+def _aplicar_operaciones(datos, operaciones):
+    for op in operaciones:
+        if op["op"] == "set":
+            datos[op["i"]] = op["r"]
+        elif op["op"] == "ins":
+            datos.insert(op["i"], op["r"])
+        elif op["op"] == "del":
+            del datos[op["i"]]
+        elif op["op"] == "add":
+            datos.append(op["r"])
+
+
+def _tramo_distinto(antes, despues):
+    """Largo del prefijo y del sufijo que las dos listas tienen en común"""
+    n, m = len(antes), len(despues)
+    inicio = 0
+    limite = min(n, m)
+    while inicio < limite and antes[inicio] == despues[inicio]:
+        inicio += 1
+    fin = 0
+    while fin < limite - inicio and antes[n - 1 - fin] == despues[m - 1 - fin]:
+        fin += 1
+    return inicio, fin
+
+
+def _diferencias(antes, despues):
+    """Operaciones posicionales que transforman la lista antes en despues.
+
+    Recorta el prefijo y el sufijo comunes y recorre el tramo del medio
+    borrando, insertando o reemplazando según sobren registros de un lado o
+    del otro. Un alta, una baja o una modificación puntual generan una sola
+    operación.
+    """
+    n, m = len(antes), len(despues)
+    inicio, fin = _tramo_distinto(antes, despues)
+
+    viejos = antes[inicio:n - fin]
+    nuevos = despues[inicio:m - fin]
+    operaciones = []
+    p = q = 0
+    pos = inicio
+    while p < len(viejos) and q < len(nuevos):
+        if viejos[p] == nuevos[q]:
+            p += 1
+            q += 1
+            pos += 1
+        elif len(viejos) - p > len(nuevos) - q:
+            operaciones.append({"op": "del", "i": pos})
+            p += 1
+        elif len(nuevos) - q > len(viejos) - p:
+            operaciones.append({"op": "ins", "i": pos, "r": nuevos[q]})
+            q += 1
+            pos += 1
+        else:
+            operaciones.append({"op": "set", "i": pos, "r": nuevos[q]})
+            p += 1
+            q += 1
+            pos += 1
+    while p < len(viejos):
+        operaciones.append({"op": "del", "i": pos})
+        p += 1
+    while q < len(nuevos):
+        operaciones.append({"op": "ins", "i": pos, "r": nuevos[q]})
+        q += 1
+        pos += 1
+    return operaciones
+
+
+def _guardar_con_journal(path, data):
+    entrada = _entrada(path)
+    operaciones = _diferencias(entrada.datos, data)
+    if not operaciones:
+        return
+    nueva = _agregar_al_journal(path, operaciones, _copiar(data))
+    if nueva is not None:
+        _trasladar_derivados(entrada, nueva)
+
+
+def _agregar_al_journal(path, operaciones, datos_nuevos):
+    """Agrega las operaciones al journal (o compacta si ya creció mucho).
+
+    datos_nuevos es la lista resultante, que pasa tal cual a la cache (None si
+    no se tiene: la cache se descarta). Devuelve la nueva entrada de la cache,
+    o None si hubo que descartarla.
+    """
+    ruta = _ruta_journal(path)
+    firma_previa = _firma(path)
+    tam_journal = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+    tam_json = os.path.getsize(path) if os.path.exists(path) else 0
+    if tam_journal > max(JOURNAL_MIN_BYTES, tam_json * JOURNAL_PROPORCION):
+        if datos_nuevos is None:
+            datos_nuevos = leer_archivos(path)
+            _aplicar_operaciones(datos_nuevos, operaciones)
+        return _compactar(path, datos_nuevos, copiar=False)
+
+    lineas = "".join(
+        json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n"
+        for op in operaciones
+    )
+    if tam_journal:
+        # Sin esto lo nuevo quedaría pegado a una línea cortada y no se leería
+        tam_journal = _recortar_journal(ruta, tam_journal)
+    cabecera = _cabecera_journal(path) if tam_journal else None
+    if cabecera is None or cabecera.get("base") != _base_journal(path):
+        # Journal nuevo (o de una base ya compactada): arranca con cabecera
+        cabecera = {"base": _base_journal(path), "id": os.urandom(8).hex()}
+        modo, lineas = "w", json.dumps(cabecera) + "\n" + lineas
+        tam_journal = 0
+    else:
+        modo = "a"
+
+    datos = lineas.encode("utf-8")
+    with open(ruta, modo + "b") as file:
+        file.write(datos)
+        file.flush()
+        fin = file.tell()
+    # El fsync se hace al soltar el bloqueo, compartido con otros requests
+    _pendientes().append((ruta, cabecera.get("id"), fin))
+
+    with _cache_lock:
+        firma = _firma(path)
+        # Si otro proceso escribió en el medio, la próxima lectura relee todo
+        if datos_nuevos is not None and firma[1] is not None \
+                and firma[1][1] == tam_journal + len(datos) and firma[0] == firma_previa[0]:
+            entrada = _cache[path] = _Entrada(firma, datos_nuevos)
+            return entrada
+        _cache.pop(path, None)
+        return None
+
+
+def _cabecera_journal(path):
+    try:
+        with open(_ruta_journal(path), "r", encoding="utf-8") as file:
+            return json.loads(file.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def _compactar(path, data, copiar=True):
+    _escribir_archivo(path, data)
+    ruta = _ruta_journal(path)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    with _cache_lock:
+        entrada = _cache[path] = _Entrada(_firma(path), _copiar(data) if copiar else data)
+    return entrada
+
+
+def compactar(path):
+    """Deja el archivo JSON completo y al día.
+
+    Vuelca el journal pendiente o, con SQLite o particiones, exporta el
+    dataset completo al archivo.
+    """
+    with bloqueo(path):
+        if _tabla(path) is not None:
+            _escribir_archivo(path, leer_json(path))
+        elif _particionado(path):
+            for parte in _partes(path).values():
+                compactar(parte)
+            _escribir_archivo(path, leer_completo(path))
+        elif _usa_journal(path) and os.path.exists(_ruta_journal(path)):
+            _compactar(path, leer_json(path))
+
+
+# ===================== Snapshots binarios ======================
+#
+# "<archivo>.snap" empieza con una cabecera: marca, versión del formato,
+# tamaño/mtime/inodo del JSON del que se generó y CRC32 del contenido. Sigue el
+# contenido en pickle. Solo se usa si corresponde exactamente al JSON actual y
+# el CRC coincide; si no, se lee el JSON y se vuelve a generar. Es descartable:
+# borrarlo solo hace que la próxima lectura vaya al JSON.
+
+SNAPSHOT_VERSION = 1
+# Por debajo de este tamaño el JSON se lee rápido y no vale la pena
+SNAPSHOT_MIN_BYTES = 64 * 1024
+
+_MARCA_SNAPSHOT = b"CSNP"
+_CABECERA_SNAPSHOT = struct.Struct("<4sHqqqI")
+_snapshots = set()
+
+
+def usar_snapshots(*paths):
+    """Registra archivos que se guardan también como snapshot binario"""
+    for path in paths:
+        _snapshots.add(_clave(path))
+
+
+def _usa_snapshot(path):
+    clave = _clave(path)
+    if path.endswith((".gz", ".xz")):
+        return False
+    if clave in _padres:
+        # Las particiones heredan la configuración de su dataset
+        return _clave(_padres[clave]) in _snapshots
+    return clave in _snapshots and _tabla(path) is None and not _particionado(path)
+
+
+def _ruta_snapshot(path):
+    return path + ".snap"
+
+
+def _compartir_textos(datos, textos):
+    """Copia de los datos donde los textos iguales son el mismo objeto.
+
+    pickle guarda una sola vez cada objeto repetido: médico, estado, fecha,
+    hora, claves, etc. se decodifican una vez y no en cada registro.
+    """
+    if isinstance(datos, str):
+        return textos.setdefault(datos, datos)
+    if isinstance(datos, dict):
+        return {textos.setdefault(k, k): _compartir_textos(v, textos) for k, v in datos.items()}
+    if isinstance(datos, list):
+        return [_compartir_textos(v, textos) for v in datos]
+    return datos
+
+
+def _leer_snapshot(path, st):
+    """Datos del snapshot si corresponde al JSON con stat st, o None"""
+    try:
+        with open(_ruta_snapshot(path), "rb") as file:
+            cabecera = file.read(_CABECERA_SNAPSHOT.size)
+            contenido = file.read()
+    except OSError:
+        return None
+    if len(cabecera) != _CABECERA_SNAPSHOT.size:
+        return None
+    marca, version, tam, mtime, inodo, crc = _CABECERA_SNAPSHOT.unpack(cabecera)
+    if marca != _MARCA_SNAPSHOT or version != SNAPSHOT_VERSION:
+        return None
+    if (tam, mtime, inodo) != (st.st_size, st.st_mtime_ns, st.st_ino) or zlib.crc32(contenido) != crc:
+        return None
+    try:
+        return pickle.loads(contenido)
+    except Exception:
+        return None
+
+
+def _escribir_snapshot(path, datos, st):
+    if st.st_size < SNAPSHOT_MIN_BYTES:
+        return
+    contenido = pickle.dumps(_compartir_textos(datos, {}), protocol=pickle.HIGHEST_PROTOCOL)
+    cabecera = _CABECERA_SNAPSHOT.pack(_MARCA_SNAPSHOT, SNAPSHOT_VERSION, st.st_size,
+                                       st.st_mtime_ns, st.st_ino, zlib.crc32(contenido))
+    ruta = _ruta_snapshot(path)
+    # Puede escribirse desde lecturas con bloqueo compartido: temporal por hilo
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as file:
+            file.write(cabecera)
+            file.write(contenido)
+        os.replace(tmp, ruta)
+    except OSError:
+        # Sin snapshot se sigue leyendo el JSON
+        pass
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ===================== Group commit ======================
+#
+# Las líneas del journal se escriben sin fsync mientras se tiene el bloqueo
+# del dataset; el fsync se hace después de soltarlo, en grupo. Cada request
+# toma el bloqueo "<journal>.sync": el primero espera VENTANA_COMMIT, hace un
+# fsync que cubre todo lo escrito hasta ese momento (por cualquier worker) y
+# anota en ese archivo "<id del journal> <tamaño en disco>". Los que venían
+# detrás encuentran su escritura ya cubierta y vuelven sin otro fsync. Recién
+# entonces la ruta responde, así que un request confirmado está en disco.
+
+def usar_commit_agrupado(ventana_ms):
+    """Ventana del group commit en milisegundos (0: fsync sin esperar)"""
+    global VENTANA_COMMIT
+    VENTANA_COMMIT = ventana_ms / 1000
+
+
+def _pendientes():
+    """Escrituras del hilo que todavía no se confirmaron: (journal, id, fin)"""
+    pendientes = getattr(_bloqueos, "pendientes", None)
+    if pendientes is None:
+        pendientes = _bloqueos.pendientes = []
+    return pendientes
+
+
+def _confirmar_pendientes():
+    pendientes = _pendientes()
+    while pendientes:
+        ruta, id_journal, fin = pendientes.pop(0)
+        _hacer_durable(ruta, id_journal, fin)
+
+
+def _fsync(ruta):
+    try:
+        fd = os.open(ruta, os.O_RDWR)
+    except FileNotFoundError:
+        return None
+    try:
+        tam = os.fstat(fd).st_size
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return tam
+
+
+def _id_journal(ruta):
+    try:
+        with open(ruta, "r", encoding="utf-8") as file:
+            return json.loads(file.readline()).get("id")
+    except (OSError, ValueError):
+        return None
+
+
+def _hacer_durable(ruta, id_journal, fin):
+    """Vuelve cuando el journal ruta está en disco al menos hasta fin"""
+    if fcntl is None or id_journal is None:
+        _fsync(ruta)
+        return
+
+    fd = os.open(ruta + ".sync", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        hecho = os.pread(fd, 64, 0).split()
+        if len(hecho) == 2 and hecho[0].decode() == id_journal and int(hecho[1]) >= fin:
+            return
+        if VENTANA_COMMIT > 0:
+            time.sleep(VENTANA_COMMIT)
+        if _id_journal(ruta) != id_journal:
+            # El journal se compactó: sus líneas ya están en el JSON (con fsync)
+            return
+        tam = _fsync(ruta)
+        if tam is not None:
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, f"{id_journal} {tam}".encode(), 0)
+    finally:
+        os.close(fd)
+
+
+# ===================== Particiones por mes ======================
+#
+# Las particiones de "turnos.json" viven en el directorio "turnos/", una por
+# mes según el campo de fecha ("2026-10.json"), más "sin-fecha.json" para los
+# registros sin una fecha AAAA-MM. Cada partición es un archivo JSON más: tiene
+# su propia cache y su journal, y comparte el bloqueo del dataset. El archivo
+# "turnos.json" queda como exportación completa para /descargar.
+
+SIN_FECHA = "sin-fecha"
+_MES = re.compile(r"\d{4}-\d{2}$")
+_ARCHIVO_PARTICION = re.compile(r"(\d{4}-\d{2}|%s)\.json$" % SIN_FECHA)
+
+
+def usar_particiones(*paths, campo="fecha"):
+    """Guarda los datasets indicados partidos por mes según campo.
+
+    La primera vez se arman las particiones a partir del JSON actual (con su
+    journal aplicado). Llamarla después de usar_sqlite: los datasets que
+    están en SQLite no se parten en disco, solo queda registrado el campo
+    para que la importación lea las particiones que ya existan.
+    """
+    for path in paths:
+        _particiones[_clave(path)] = campo
+        if _tabla(path) is None:
+            _particionar(path)
+
+
+def _particionado(path):
+    return _clave(path) in _particiones and _tabla(path) is None
+
+
+def _dir_particiones(path):
+    return os.path.splitext(path)[0]
+
+
+def _mes(valor):
+    if isinstance(valor, str) and _MES.match(valor[:7]):
+        return valor[:7]
+    return SIN_FECHA
+
+
+def _ruta_particion(path, mes):
+    parte = os.path.join(_dir_particiones(path), mes + ".json")
+    clave = _clave(parte)
+    if clave not in _padres:
+        _padres[clave] = path
+        if _clave(path) in _journaled:
+            _journaled.add(clave)
+    return parte
+
+
+def _partes(path):
+    """Particiones existentes del dataset, ordenadas: mes -> ruta"""
+    try:
+        nombres = os.listdir(_dir_particiones(path))
+    except FileNotFoundError:
+        return {}
+    meses = sorted(m.group(1) for m in map(_ARCHIVO_PARTICION.match, nombres) if m)
+    return {mes: _ruta_particion(path, mes) for mes in meses}
+
+
+def _agrupar(path, datos):
+    campo = _particiones[_clave(path)]
+    grupos = {}
+    for registro in datos:
+        valor = registro.get(campo) if isinstance(registro, dict) else None
+        grupos.setdefault(_mes(valor), []).append(registro)
+    return dict(sorted(grupos.items()))
+
+
+def _fuentes(path, campos, rango=None):
+    """Archivos donde pueden estar los registros buscados.
+
+    Con una igualdad sobre el campo de fecha es una sola partición; con un
+    rango, las de los meses que cubre (más la de registros sin fecha).
+    """
+    if not _particionado(path):
+        return [path]
+    campo = _particiones[_clave(path)]
+    if campo in campos:
+        mes = _mes(campos[campo])
+        return _historico(path, lambda m: m == mes)
+    if rango is not None and rango[0] == campo:
+        desde, hasta = rango[1][:7], rango[2][:7]
+        return _historico(path, lambda m: m == SIN_FECHA or desde <= m <= hasta)
+    # Sin filtro de fecha: solo los meses activos, no el archivo
+    return list(_partes(path).values())
+
+
+def _historico(path, incluir=None):
+    """Particiones archivadas y activas de los meses elegidos, en orden de mes"""
+    fuentes = list(_archivadas(path).items()) + list(_partes(path).items())
+    # sort estable: si un mes tiene archivo y partición activa, primero el archivo
+    fuentes.sort(key=lambda fuente: fuente[0])
+    return [parte for mes, parte in fuentes if incluir is None or incluir(mes)]
+
+
+def leer_completo(path):
+    """Todos los registros del dataset, incluidos los meses archivados"""
+    if not _particionado(path):
+        return leer_json(path)
+    with _lectura(path):
+        return [r for parte in _historico(path) for r in leer_json(parte)]
+
+
+def fuentes_completas(path):
+    """Archivos que forman el dataset completo: [(nombre, firma, ruta)].
+
+    Un dataset particionado son sus meses archivados y activos; los demás, el
+    propio archivo (o su tabla SQLite). leer_fuente(ruta) devuelve los datos de
+    cada uno, y la firma cambia cuando cambian esos datos.
+    """
+    if not _particionado(path):
+        return [(os.path.basename(path), _firma(path), path)]
+    with _lectura(path):
+        return [(os.path.relpath(parte, _dir_particiones(path)), _firma(parte), parte)
+                for parte in _historico(path)]
+
+
+def leer_fuente(ruta):
+    """Datos de un archivo de fuentes_completas, sin guardarlos en la cache.
+
+    Si ya están al día en la cache se devuelven de ahí (compartidos: no
+    modificarlos); si no, se leen de disco y no quedan en memoria. Así un
+    recorrido de todo el dataset (los respaldos) no deja residentes los meses
+    archivados.
+    """
+    entrada = _cache.get(ruta)
+    if _tabla(ruta) is not None or entrada is not None and entrada.firma == _firma(ruta):
+        return leer_json(ruta)
+    with bloqueo(ruta, exclusivo=False):
+        return leer_archivos(ruta)
+
+
+def reemplazar_completo(path, data):
+    """Reemplaza el dataset entero, incluidos los meses archivados.
+
+    A diferencia de guardar_json, lo archivado no se conserva: todo data queda
+    en las particiones activas (por ejemplo al restaurar un respaldo).
+    """
+    with bloqueo(path):
+        if _particionado(path):
+            for archivada in _archivadas(path).values():
+                os.remove(archivada)
+                invalidar_cache(archivada)
+        guardar_json(path, data)
+
+
+@contextmanager
+def _lectura(path):
+    # Una consulta sobre varias particiones las ve todas en la misma versión
+    if _particionado(path):
+        with bloqueo(path, exclusivo=False):
+            yield
+    else:
+        yield
+
+
+def _particionar(path):
+    directorio = _dir_particiones(path)
+    if os.path.isdir(directorio):
+        return
+    with bloqueo(path):
+        if os.path.isdir(directorio):
+            return
+        datos = leer_archivos(path)
+        # Se arma en un directorio temporal y se renombra: otro worker ve todas
+        # las particiones o ninguna
+        tmp = f"{directorio}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for mes, registros in _agrupar(path, datos).items():
+            _escribir_archivo(os.path.join(tmp, mes + ".json"), registros)
+        os.rename(tmp, directorio)
+
+        # El JSON original queda como exportación completa, ya sin journal
+        ruta = _ruta_journal(path)
+        if os.path.exists(ruta):
+            _escribir_archivo(path, datos)
+            os.remove(ruta)
+    invalidar_cache(path)
+
+
+# ===================== Archivo de meses viejos ======================
+#
+# archivar() pasa cada partición anterior al horizonte (con todos sus
+# registros cerrados, si se le indica cómo saberlo) a
+# "<dataset>/archivo/AAAA-MM.json.gz" (o .xz con lzma) y la borra de las
+# activas. Si después se guarda un registro de un mes ya archivado, vuelve a
+# crearse la partición activa de ese mes y las consultas leen las dos; el
+# próximo archivar() las junta.
+
+_ARCHIVO_ARCHIVADO = re.compile(r"(\d{4}-\d{2})\.json\.(gz|xz)$")
+EXTENSIONES_COMPRESION = {"gzip": ".gz", "lzma": ".xz"}
+
+
+def _dir_archivo(path):
+    return os.path.join(_dir_particiones(path), "archivo")
+
+
+def _archivadas(path):
+    """Meses archivados del dataset: mes -> ruta del archivo comprimido"""
+    directorio = _dir_archivo(path)
+    try:
+        nombres = os.listdir(directorio)
+    except FileNotFoundError:
+        return {}
+    archivadas = {}
+    for m in sorted(filter(None, map(_ARCHIVO_ARCHIVADO.match, nombres)), key=lambda m: m.group(0)):
+        ruta = os.path.join(directorio, m.group(0))
+        _padres.setdefault(_clave(ruta), path)
+        archivadas[m.group(1)] = ruta
+    return archivadas
+
+
+# Meses archivados en la cache, del usado hace más tiempo al más reciente
+_archivadas_en_cache = OrderedDict()
+
+
+def usar_cache_archivo(meses):
+    """Cuántos meses archivados quedan en la cache a la vez (0: ninguno).
+
+    Un reporte sobre un rango viejo lee esos meses y arma sus derivados; al
+    pasar el límite se descartan los usados hace más tiempo, así lo archivado
+    no vuelve a quedar entero en la memoria de cada worker.
+    """
+    global ARCHIVO_EN_CACHE
+    ARCHIVO_EN_CACHE = meses
+    with _cache_lock:
+        _descartar_archivadas()
+
+
+def _es_archivada(path):
+    return path.endswith((".gz", ".xz"))
+
+
+def _recordar_archivada(path):
+    # Con _cache_lock tomado
+    _archivadas_en_cache[path] = None
+    _archivadas_en_cache.move_to_end(path)
+    _descartar_archivadas()
+
+
+def _descartar_archivadas():
+    while len(_archivadas_en_cache) > ARCHIVO_EN_CACHE:
+        ruta, _ = _archivadas_en_cache.popitem(last=False)
+        _cache.pop(ruta, None)
+
+
+def archivar(path, hasta, compresion="gzip", cerrado=None):
+    """Pasa al archivo comprimido los meses anteriores a hasta ("AAAA-MM").
+
+    Lo archivado ya no se modifica: con cerrado(registro) -> bool, un mes con
+    algún registro que todavía no está cerrado (un turno sin atender) queda
+    activo entero. Devuelve ({mes: cantidad de registros archivados},
+    {mes: cantidad de registros abiertos} de los meses que quedaron activos).
+    """
+    if not _particionado(path):
+        return {}, {}
+    extension = EXTENSIONES_COMPRESION[compresion]
+    archivados = {}
+    abiertos = {}
+    with bloqueo(path):
+        archivadas = _archivadas(path)
+        for mes, parte in _partes(path).items():
+            if mes == SIN_FECHA or mes >= hasta:
+                continue
+            registros = leer_json(parte)
+            if cerrado is not None:
+                pendientes = sum(1 for r in registros if not cerrado(r))
+                if pendientes:
+                    abiertos[mes] = pendientes
+                    continue
+            destino = archivadas.get(mes) or os.path.join(_dir_archivo(path), mes + ".json" + extension)
+            previos = leer_archivos(destino) if os.path.exists(destino) else []
+            os.makedirs(_dir_archivo(path), exist_ok=True)
+            _escribir_comprimido(destino, previos + registros)
+            # Recién con el archivo en disco se borra la partición activa
+            for ruta in (parte, _ruta_journal(parte), _ruta_snapshot(parte)):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            invalidar_cache(parte)
+            invalidar_cache(destino)
+            archivados[mes] = len(registros)
+    invalidar_cache(path)
+    return archivados, abiertos
+
+
+def buscar_completo(path, **campos):
+    """Como buscar, incluidos los meses archivados.
+
+    Recorre todo el historial (lo archivado con leer_fuente, sin dejarlo en
+    la cache): es para chequeos poco frecuentes, como borrar un paciente.
+    """
+    if not _particionado(path):
+        return buscar(path, **campos)
+    return [dict(r) for _, _, ruta in fuentes_completas(path)
+            for r in leer_fuente(ruta) if isinstance(r, dict) and _coincide(r, campos)]
+
+
+# Dataset -> (firmas de sus meses archivados, {clave: mes}): dónde está cada
+# registro archivado, sin tener esos meses en memoria
+_claves_archivadas = {}
+
+
+def archivado(path, *clave):
+    """Mes archivado donde está el registro con esa clave, o None.
+
+    obtener/modificar/eliminar solo buscan en los meses activos (lo archivado
+    no se modifica); esto distingue un registro archivado de uno que no
+    existe. La primera vez lee los meses archivados sin pasarlos a la cache y
+    guarda solo las claves, hasta que cambie el archivo.
+    """
+    if not _particionado(path):
+        return None
+    campos = _claves[_clave(path)]
+    with _lectura(path):
+        archivadas = _archivadas(path)
+        firmas = tuple((ruta, _firma_archivo(ruta)) for ruta in archivadas.values())
+        guardado = _claves_archivadas.get(_clave(path))
+        if guardado is None or guardado[0] != firmas:
+            meses = {}
+            for mes, ruta in archivadas.items():
+                for registro in leer_fuente(ruta):
+                    if isinstance(registro, dict):
+                        meses.setdefault(tuple(registro.get(c) for c in campos), mes)
+            guardado = _claves_archivadas[_clave(path)] = (firmas, meses)
+        return guardado[1].get(tuple(clave))
+
+
+def _escribir_comprimido(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp" + os.path.splitext(path)[1]
+    try:
+        with _abrir(tmp, "w") as file:
+            file.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+        with open(tmp, "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _guardar_particionado(path, data):
+    partes = _partes(path)
+    grupos = _agrupar(path, data)
+    for mes in sorted(set(partes) | set(grupos)):
+        parte = _ruta_particion(path, mes)
+        registros = grupos.get(mes)
+        if registros is None:
+            # Partición que quedó vacía
+            for ruta in (parte, _ruta_journal(parte), _ruta_snapshot(parte)):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            invalidar_cache(parte)
+        elif mes not in partes:
+            # Partición nueva: se crea el JSON (no alcanza con un journal suelto)
+            _compactar(parte, registros)
+        elif leer_json(parte) != registros:
+            guardar_json(parte, registros)
+
+    datos = [r for registros in grupos.values() for r in registros]
+    with _cache_lock:
+        _cache[path] = _Entrada(_firma(path), _copiar(datos))
+
+
+# ===================== SQLite ======================
+
+class ConflictoDeVersion(RuntimeError):
+    """Otro proceso cambió el dataset mientras se guardaba: no se pisa lo que escribió"""
+
+
+def _guardar_en_sqlite(path, data):
+    tabla = _tabla(path)
+    for _ in range(10):
+        entrada = _entrada(path)
+        version = entrada.firma[1]
+        if isinstance(data, list) and isinstance(entrada.datos, list):
+            operaciones = _diferencias(entrada.datos, data)
+            if not operaciones:
+                return
+            nueva = _motor.aplicar(tabla, version, operaciones)
+        else:
+            nueva = _motor.reemplazar(tabla, data, version)
+        if nueva is not None:
+            with _cache_lock:
+                _cache[path] = _nueva_entrada(path, ("sqlite", nueva), _copiar(data), entrada.firma)
+            return
+    # Cada intento encontró otra versión: alguien escribe sin el bloqueo del dataset
+    raise ConflictoDeVersion(f"{path}: la tabla {tabla} cambió en cada intento de guardar")
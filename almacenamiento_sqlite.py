@@ -0,0 +1,263 @@
+"""Motor SQLite para los datasets del consultorio (ALMACENAMIENTO=sqlite).
+
+Cada dataset vive en una tabla con el registro completo en JSON (columna
+datos), su posición dentro de la lista (orden) y copias de los campos por los
+que se consulta, con índices sobre dni, (medico, fecha, hora) y fecha.
+La tabla versiones lleva un contador por dataset que se incrementa en cada
+escritura y que usa la cache de almacenamiento.py para validar sus datos.
+"""
+import json
+import sqlite3
+import threading
+
+
+# tabla -> campos del registro que se copian a columnas consultables
+TABLAS = {
+    "historias": ("id", "dni", "fecha_consulta"),
+    "usuarios": ("usuario",),
+    "pacientes": ("dni",),
+    "turnos": ("dni_paciente", "medico", "fecha", "hora", "estado"),
+    "agenda": ("clave",),
+    "pagos": ("id", "dni_paciente", "fecha"),
+}
+
+INDICES = [
+    ("pacientes", ("dni",)),
+    ("turnos", ("dni_paciente",)),
+    ("turnos", ("medico", "fecha", "hora")),
+    ("turnos", ("fecha",)),
+    ("pagos", ("fecha",)),
+    ("pagos", ("dni_paciente", "fecha")),
+    ("historias", ("dni",)),
+    ("usuarios", ("usuario",)),
+]
+
+# Datasets que son un dict (clave -> valor) en lugar de una lista de registros
+DICCIONARIOS = {"agenda"}
+
+
+def _valor(v):
+    if v is None or isinstance(v, (str, int, float)):
+        return v
+    return json.dumps(v, ensure_ascii=False)
+
+
+def _fila(tabla, orden, registro, clave=None):
+    if tabla in DICCIONARIOS:
+        columnas = (clave,)
+    else:
+        columnas = tuple(_valor(registro.get(c)) if isinstance(registro, dict) else None
+                         for c in TABLAS[tabla])
+    return (orden, json.dumps(registro, ensure_ascii=False)) + columnas
+
+
+class MotorSQLite:
+    """Acceso a la base SQLite, con una conexión por hilo"""
+
+    def __init__(self, ruta, importar=None):
+        self.ruta = ruta
+        # importar(tabla) devuelve los datos iniciales de una tabla recién creada
+        self.importar = importar
+        self._local = threading.local()
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._inicializar(conn)
+            self._local.conn = conn
+        return conn
+
+    def _inicializar(self, conn):
+        # EXCLUSIVE: si varios workers arrancan juntos, uno solo importa
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS versiones "
+                         "(tabla TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            for tabla, campos in TABLAS.items():
+                columnas = "".join(f", {c}" for c in campos)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {tabla} "
+                             f"(orden INTEGER NOT NULL, datos TEXT NOT NULL{columnas})")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_orden ON {tabla} (orden)")
+            for tabla, campos in INDICES:
+                nombre = f"idx_{tabla}_{'_'.join(campos)}"
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({', '.join(campos)})")
+
+            existentes = {fila[0] for fila in conn.execute("SELECT tabla FROM versiones")}
+            for tabla in TABLAS:
+                if tabla in existentes:
+                    continue
+                conn.execute("INSERT INTO versiones (tabla, version) VALUES (?, 0)", (tabla,))
+                datos = self.importar(tabla) if self.importar else None
+                if datos:
+                    self._insertar_todo(conn, tabla, datos)
+                    conn.execute("UPDATE versiones SET version = 1 WHERE tabla = ?", (tabla,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insertar_todo(self, conn, tabla, datos):
+        campos = TABLAS[tabla]
+        marcas = ", ".join("?" * (2 + len(campos)))
+        sql = f"INSERT INTO {tabla} (orden, datos, {', '.join(campos)}) VALUES ({marcas})"
+        if tabla in DICCIONARIOS:
+            filas = (_fila(tabla, i, v, k) for i, (k, v) in enumerate(datos.items()))
+        else:
+            filas = (_fila(tabla, i, r) for i, r in enumerate(datos))
+        conn.executemany(sql, filas)
+
+    def _version(self, conn, tabla):
+        fila = conn.execute("SELECT version FROM versiones WHERE tabla = ?", (tabla,)).fetchone()
+        return fila[0] if fila else 0
+
+    def version(self, tabla):
+        return self._version(self._conexion(), tabla)
+
+    def leer(self, tabla):
+        """Devuelve (version, datos) leídos dentro de una misma transacción"""
+        conn = self._conexion()
+        conn.execute("BEGIN")
+        try:
+            version = self._version(conn, tabla)
+            if tabla in DICCIONARIOS:
+                filas = conn.execute(f"SELECT clave, datos FROM {tabla} ORDER BY orden")
+                datos = {clave: json.loads(d) for clave, d in filas}
+            else:
+                filas = conn.execute(f"SELECT datos FROM {tabla} ORDER BY orden")
+                datos = [json.loads(d) for (d,) in filas]
+        finally:
+            conn.execute("COMMIT")
+        return version, datos
+
+    def consultar(self, tabla, igualdades=None, rango=None):
+        """Registros que cumplen campo = valor (y desde <= campo <= hasta)"""
+        return list(self.iterar(tabla, igualdades, rango))
+
+    def iterar(self, tabla, igualdades=None, rango=None):
+        """Como consultar, pero decodifica las filas a medida que se recorren"""
+        condiciones, parametros = [], []
+        for campo, valor in (igualdades or {}).items():
+            condiciones.append(f"{campo} = ?")
+            parametros.append(valor)
+        if rango:
+            campo, desde, hasta = rango
+            condiciones.append(f"{campo} BETWEEN ? AND ?")
+            parametros.extend([desde, hasta])
+        where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        filas = self._conexion().execute(
+            f"SELECT datos FROM {tabla}{where} ORDER BY orden", parametros)
+        for (d,) in filas:
+            yield json.loads(d)
+
+    def consultable(self, tabla, campos):
+        return tabla not in DICCIONARIOS and all(c in TABLAS[tabla] for c in campos)
+
+    def aplicar(self, tabla, version_esperada, operaciones):
+        """Aplica operaciones posicionales (ver almacenamiento._diferencias).
+
+        Devuelve la nueva versión, o None si la tabla cambió desde
+        version_esperada y hay que recalcular las operaciones.
+        """
+        conn = self._conexion()
+        campos = TABLAS[tabla]
+        asignaciones = ", ".join(f"{c} = ?" for c in ("datos",) + campos)
+        marcas = ", ".join("?" * (2 + len(campos)))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._version(conn, tabla) != version_esperada:
+                conn.execute("ROLLBACK")
+                return None
+            for op in operaciones:
+                i = op["i"]
+                if op["op"] == "set":
+                    fila = _fila(tabla, i, op["r"])
+                    conn.execute(f"UPDATE {tabla} SET {asignaciones} WHERE orden = ?",
+                                 fila[1:] + (i,))
+                elif op["op"] == "ins":
+                    conn.execute(f"UPDATE {tabla} SET orden = orden + 1 WHERE orden >= ?", (i,))
+                    conn.execute(f"INSERT INTO {tabla} (orden, datos, {', '.join(campos)}) "
+                                 f"VALUES ({marcas})", _fila(tabla, i, op["r"]))
+                elif op["op"] == "del":
+                    conn.execute(f"DELETE FROM {tabla} WHERE orden = ?", (i,))
+                    conn.execute(f"UPDATE {tabla} SET orden = orden - 1 WHERE orden > ?", (i,))
+            conn.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+            version = self._version(conn, tabla)
+            conn.execute("COMMIT")
+            return version
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def agregar(self, tabla, registro):
+        """Inserta el registro al final. Devuelve (versión anterior, versión nueva, posición)"""
+        conn = self._conexion()
+        campos = TABLAS[tabla]
+        marcas = ", ".join("?" * (2 + len(campos)))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previa = self._version(conn, tabla)
+            (orden,) = conn.execute(f"SELECT COALESCE(MAX(orden) + 1, 0) FROM {tabla}").fetchone()
+            conn.execute(f"INSERT INTO {tabla} (orden, datos, {', '.join(campos)}) VALUES ({marcas})",
+                         _fila(tabla, orden, registro))
+            conn.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+            conn.execute("COMMIT")
+            return previa, previa + 1, orden
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cambiar(self, tabla, igualdades, cambios=None):
+        """Actualiza campos de la primera fila con esas igualdades, o la borra (cambios None).
+
+        Devuelve (versión anterior, versión nueva, posición, registro anterior,
+        registro nuevo o None), o None si no hay una fila así.
+        """
+        conn = self._conexion()
+        campos = TABLAS[tabla]
+        condiciones = " AND ".join(f"{campo} = ?" for campo in igualdades)
+        asignaciones = ", ".join(f"{c} = ?" for c in ("datos",) + campos)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute(f"SELECT orden, datos FROM {tabla} WHERE {condiciones} ORDER BY orden LIMIT 1",
+                                [_valor(v) for v in igualdades.values()]).fetchone()
+            if fila is None:
+                conn.execute("ROLLBACK")
+                return None
+            orden, datos = fila
+            previa = self._version(conn, tabla)
+            anterior = json.loads(datos)
+            if cambios is None:
+                nuevo = None
+                conn.execute(f"DELETE FROM {tabla} WHERE orden = ?", (orden,))
+                conn.execute(f"UPDATE {tabla} SET orden = orden - 1 WHERE orden > ?", (orden,))
+            else:
+                nuevo = dict(anterior)
+                nuevo.update(cambios)
+                conn.execute(f"UPDATE {tabla} SET {asignaciones} WHERE orden = ?",
+                             _fila(tabla, orden, nuevo)[1:] + (orden,))
+            conn.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+            conn.execute("COMMIT")
+            return previa, previa + 1, orden, anterior, nuevo
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def reemplazar(self, tabla, datos, version_esperada=None):
+        """Reescribe la tabla completa (agenda, importación desde JSON)"""
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version_esperada is not None and self._version(conn, tabla) != version_esperada:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(f"DELETE FROM {tabla}")
+            self._insertar_todo(conn, tabla, datos)
+            conn.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+            version = self._version(conn, tabla)
+            conn.execute("COMMIT")
+            return version
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -1,12 +1,25 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, make_response, send_file
+from flask import (Flask, request, jsonify, render_template, redirect, url_for, session, make_response, send_file,
+                   Response, stream_with_context)
 import json
 import os
 import csv
 import io
-import shutil
 from functools import wraps
 from datetime import datetime, date, timezone, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from almacenamiento import (cargar_json, guardar_json, compactar, exportar_json, buscar, buscar_uno,
+                            iterar_json, cargar_rango, buscar_completo, cargar_prefijo, transaccion, indice, obtener,
+                            modificar, eliminar, derivado, derivados, agregar, siguiente_id, version,
+                            archivado, ConflictoDeVersion)
+from config import (DATA_FILE, USUARIOS_FILE, PACIENTES_FILE, TURNOS_FILE, AGENDA_FILE, PAGOS_FILE,
+                    RESPALDOS_DIR, DATASETS, RESPALDO_MINUTOS, RESPALDOS_CONSERVAR, configurar_almacenamiento)
+from respaldos import iniciar_respaldos
+from cache_reportes import CacheReportes
+from reportes import Pasada
+from columnas import TablaTurnos
+from busqueda import IndiceTexto
+from resumenes import UltimoPorClave, TotalesPorDia, Conteos, pesos
+from franjas import AgendaCompilada, dia_agenda, franja
 
 
 app = Flask(__name__)
@@ -16,68 +29,187 @@ app.secret_key = os.environ.get("SECRET_KEY", "clave_insegura_dev")
 import pytz
 timezone_ar = pytz.timezone('America/Argentina/Buenos_Aires')
 
-# Rutas de archivo usando el disco persistente
-# En producción (Render) usa /data/, en desarrollo local usa la raíz
-import os
-if os.path.exists("/data"):
-    # Producción en Render
-    DATA_FILE = "/data/historias_clinicas.json"
-    USUARIOS_FILE = "/data/usuarios.json"
-    PACIENTES_FILE = "/data/pacientes.json"
-    TURNOS_FILE = "/data/turnos.json"
-    AGENDA_FILE = "/data/agenda.json"
-    PAGOS_FILE = "/data/pagos.json"
-else:
-    # Desarrollo local
-    DATA_FILE = "historias_clinicas.json"
-    USUARIOS_FILE = "usuarios.json"
-    PACIENTES_FILE = "pacientes.json"
-    TURNOS_FILE = "turnos.json"
-    AGENDA_FILE = "agenda.json"
-    PAGOS_FILE = "pagos.json"
-
-# (OPCIONAL) Copiar archivos antiguos si todavía existen en la raíz
-def mover_a_persistencia(nombre_archivo):
-    origen = nombre_archivo
-    destino = f"/data/{nombre_archivo}"
-    
-    if os.path.exists(origen) and not os.path.exists(destino):
-        try:
-            shutil.copy(origen, destino)
-            print(f"Archivo '{nombre_archivo}' copiado a /data")
-        except Exception as e:
-            print(f"Error al copiar '{nombre_archivo}':", e)
-    else:
-        print(f"'{nombre_archivo}' ya existe en /data o no se encontró en el origen.")
-
-# Solo ejecutar en producción si existe el directorio /data
-if os.path.exists("/data"):
-    archivos_para_mover = [
-        "historias_clinicas.json",
-        "usuarios.json",
-        "pacientes.json",
-        "turnos.json",
-        "agenda.json",
-        "pagos.json"
-    ]
+# Rutas de los datasets y motor de almacenamiento (config.py, compartido con
+# los scripts de mantenimiento)
+configurar_almacenamiento()
 
-    for archivo in archivos_para_mover:
-        mover_a_persistencia(archivo)
 
+def indice_busqueda_pacientes(pacientes):
+    """Búsqueda por DNI, apellido o nombre (sin distinguir acentos), por apellido"""
+    return IndiceTexto(pacientes, ("dni", "apellido", "nombre"), clave="dni", orden="apellido",
+                       solo_digitos=("dni",))
 
-# ===================== Funciones auxiliares ======================
 
-def cargar_json(path):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as file:
-            return json.load(file)
-    return []
+def resumen_historias(historias):
+    """Por DNI: cantidad de consultas y la última (listado de historias clínicas)"""
+    return UltimoPorClave(historias, clave="dni", fecha="fecha_consulta")
 
 
-def guardar_json(path, data):
-    with open(path, "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
+def totales_pagos(desde, hasta):
+    """{fecha: {tipo_pago: [cantidad, centavos, obra social]}} de desde a hasta.
 
+    Suma los totales por día que se mantienen junto a cada mes de pagos
+    (resumenes.TotalesPorDia): recorre días, no pagos.
+    """
+    totales = {}
+    for mes in derivados(PAGOS_FILE, "totales", TotalesPorDia, desde, hasta):
+        for (fecha, tipo), valores in mes.entre(desde, hasta):
+            acumulado = totales.setdefault(fecha, {}).setdefault(tipo, [0, 0, 0])
+            for i, valor in enumerate(valores):
+                acumulado[i] += valor
+    return dict(sorted(totales.items()))
+
+
+def detalle_pagos_por_dia(totales, pagos, describir):
+    """{fecha: {"cantidad", "monto", "pacientes"}} de un resultado de totales_pagos.
+
+    Los montos salen de los totales; "pacientes" es describir(pago) de cada
+    pago de ese día, tomado de pagos (los pagos del mismo período).
+    """
+    por_dia = {}
+    for pago in pagos:
+        por_dia.setdefault(pago.get("fecha"), []).append(describir(pago))
+    detalle = {}
+    for dia, por_tipo in totales.items():
+        cantidad, monto, _ = sumar_totales({dia: por_tipo})
+        detalle[dia] = {"cantidad": cantidad, "monto": monto, "pacientes": por_dia.get(dia, [])}
+    return detalle
+
+
+def sumar_totales(totales, tipo=None):
+    """(cantidad, monto en pesos, obra social) de un resultado de totales_pagos, de un tipo o de todos"""
+    suma = [0, 0, 0]
+    for por_tipo in totales.values():
+        for t, valores in por_tipo.items():
+            if tipo is None or t == tipo:
+                for i, valor in enumerate(valores):
+                    suma[i] += valor
+    cantidad, centavos, obra_social = suma
+    return cantidad, pesos(centavos), obra_social
+
+
+# Estados de un turno que todavía no se atendió; pasadas 24 horas cuenta como ausente
+ESTADOS_PENDIENTES = ("sin atender", "recepcionado", "sala de espera")
+
+
+def conteo_turnos(desde, hasta):
+    """{(medico, fecha, estado): cantidad} de los turnos de desde a hasta.
+
+    Suma los conteos que se mantienen junto a cada mes de turnos
+    (resumenes.Conteos): al dar un turno, cambiarle el estado o borrarlo se
+    actualiza solo el conteo de su mes.
+    """
+    conteo = {}
+    for mes in derivados(TURNOS_FILE, "conteo", lambda turnos: Conteos(turnos, ("medico", "fecha", "estado")),
+                         desde, hasta):
+        for clave, cantidad in mes.entre(desde, hasta):
+            conteo[clave] = conteo.get(clave, 0) + cantidad
+    return conteo
+
+
+def tablas_turnos(desde=None, hasta=None, archivados=True):
+    """Turnos en columnas (columnas.TablaTurnos) de cada mes de desde a hasta"""
+    return derivados(TURNOS_FILE, "columnas", TablaTurnos, desde, hasta, archivados=archivados)
+
+
+def estadisticas_turnos(desde, hasta, medico=None):
+    """Atendidos, ausentes y pendientes de desde a hasta, en total, por médico y por día.
+
+    Sale de conteo_turnos, con una Pasada sobre sus conteos. Un turno
+    pendiente de hace más de 24 horas es ausente ("vencido"): los días
+    anteriores al límite vencen enteros y solo del día del límite se leen los
+    turnos para mirar la hora.
+    """
+    limite = datetime.now() - timedelta(hours=24)
+    dia_limite = limite.date().isoformat()
+    vencidos_dia_limite = {}
+    if desde <= dia_limite <= hasta:
+        # Turnos pendientes de ese día con hora anterior al límite (minuto del día)
+        antes_del_minuto = limite.hour * 60 + limite.minute + bool(limite.second or limite.microsecond)
+        for tabla in tablas_turnos(dia_limite, dia_limite):
+            for clave, cantidad in tabla.contar(("medico", "estado"), dia_limite, dia_limite, antes_del_minuto,
+                                                estado=ESTADOS_PENDIENTES).items():
+                vencidos_dia_limite[clave] = vencidos_dia_limite.get(clave, 0) + cantidad
+
+    filas = []
+    for (medico_turno, fecha, estado), cantidad in sorted(conteo_turnos(desde, hasta).items(), key=str):
+        if medico and medico_turno != medico:
+            continue
+        vencidos = 0
+        if estado in ESTADOS_PENDIENTES:
+            if fecha < dia_limite:
+                vencidos = cantidad
+            elif fecha == dia_limite:
+                vencidos = vencidos_dia_limite.get((medico_turno, estado), 0)
+        filas.append({"medico": medico_turno if medico_turno is not None else "Sin médico", "fecha": fecha,
+                      "estado": estado, "cantidad": cantidad, "vencidos": vencidos})
+
+    pasada = Pasada({
+        "total": lambda f: f["cantidad"],
+        "atendidos": lambda f: f["cantidad"] if f["estado"] == "atendido" else 0,
+        "ausentes_reales": lambda f: f["cantidad"] if f["estado"] == "ausente" else 0,
+        "vencidos": lambda f: f["vencidos"],
+        "pendientes": lambda f: f["cantidad"] - f["vencidos"] if f["estado"] in ESTADOS_PENDIENTES else 0,
+        "ausentes": lambda f: (f["cantidad"] if f["estado"] == "ausente" else 0) + f["vencidos"],
+    }, {"por_medico": lambda f: f["medico"], "por_dia": lambda f: f["fecha"]}).recorrer(filas)
+
+    stats = dict(pasada.totales)
+    stats["por_medico"] = pasada.grupo("por_medico", "total", "atendidos", "ausentes")
+    stats["por_dia"] = pasada.grupo("por_dia", "total", "atendidos", "ausentes")
+    return stats
+
+
+RANGOS_EDAD = (("0-18", 18), ("19-30", 30), ("31-50", 50), ("51-65", 65), ("65+", None))
+
+
+def rango_edad(edad):
+    for rango, hasta in RANGOS_EDAD:
+        if hasta is None or edad <= hasta:
+            return rango
+
+
+def obra_social_reporte(paciente):
+    """Obra social como se agrupa en los reportes: "Particular" o capitalizada"""
+    obra_social = paciente.get("obra_social", "Sin obra social")
+    if obra_social == "0" or not obra_social:
+        return "Particular"
+    return obra_social.capitalize()
+
+
+def pasada_pacientes():
+    """Pasada sobre los pacientes: cantidad, edades y grupos por obra social y rango de edad.
+
+    La edad se calcula una vez por paciente; las que no son positivas (sin
+    fecha o fecha inválida) no entran en el promedio ni en los rangos.
+    """
+    filas = ((p, calcular_edad(p["fecha_nacimiento"]) if p.get("fecha_nacimiento") else None)
+             for p in iterar_json(PACIENTES_FILE))
+    return Pasada({
+        "pacientes": lambda f: 1,
+        "con_edad": lambda f: bool(f[1] and f[1] > 0),
+        "suma_edades": lambda f: f[1] if f[1] and f[1] > 0 else 0,
+    }, {
+        "obra_social": lambda f: obra_social_reporte(f[0]),
+        "rango_edad": lambda f: rango_edad(f[1]) if f[1] and f[1] > 0 else None,
+    }).recorrer(filas)
+
+
+def turnos_por_dni():
+    """{dni: cantidad de turnos} de los meses activos, con bincount sobre las columnas de turnos"""
+    cantidades = {}
+    for tabla in tablas_turnos(archivados=False):
+        for dni, cantidad in tabla.contar("dni_paciente").items():
+            if dni:
+                cantidades[dni] = cantidades.get(dni, 0) + cantidad
+    return cantidades
+
+
+def agenda_compilada():
+    """Agenda en mapas de bits (franjas.py); se rearma cuando cambia agenda.json"""
+    return derivado(AGENDA_FILE, "franjas", AgendaCompilada)
+
+
+# ===================== Funciones auxiliares ======================
 
 def calcular_edad(fecha_nacimiento):
     """Calcula la edad a partir de la fecha de nacimiento"""
@@ -89,6 +221,69 @@ def calcular_edad(fecha_nacimiento):
     except:
         return None
 
+def json_en_bloques(registros, ndjson=False, tam_bloque=64 * 1024):
+    """Serializa los registros de a uno y los entrega en bloques de ~64 KB.
+
+    Forma una lista JSON ("[...]") o, con ndjson, un registro por línea.
+    """
+    partes, tam = ([] if ndjson else ["["]), 0
+    primero = True
+    for registro in registros:
+        texto = app.json.dumps(registro)
+        if ndjson:
+            texto += "\n"
+        elif not primero:
+            texto = "," + texto
+        primero = False
+        partes.append(texto)
+        tam += len(texto)
+        if tam >= tam_bloque:
+            yield "".join(partes)
+            partes, tam = [], 0
+    if not ndjson:
+        partes.append("]")
+    if partes:
+        yield "".join(partes)
+
+
+def horario_ocupado(medico, fecha, hora, excepto=None):
+    """True si el médico ya tiene un turno en esa fecha y hora.
+
+    excepto=(dni, fecha, hora) deja afuera al turno que se está moviendo. Va
+    por el índice (medico, fecha, hora): no recorre los turnos.
+    """
+    for t in buscar(TURNOS_FILE, medico=medico, fecha=fecha, hora=hora):
+        if excepto is None or (t["dni_paciente"], t["fecha"], t["hora"]) != excepto:
+            return True
+    return False
+
+
+def horarios_libres(desde, hasta, medico=None):
+    """{fecha: {médico: horarios libres}} de los días desde..hasta (date).
+
+    Agenda compilada del día de la semana menos los horarios con turno
+    (AgendaCompilada.libres); los fines de semana no se dan turnos.
+    """
+    agenda = agenda_compilada()
+    medicos = [medico] if medico is not None else list(agenda.mapas)
+    filtro = {"medico": medico} if medico is not None else {}
+    ocupadas = {}
+    for t in cargar_rango(TURNOS_FILE, desde.isoformat(), hasta.isoformat(), **filtro):
+        ocupadas.setdefault((t.get("fecha"), t.get("medico")), []).append(t.get("hora"))
+
+    libres = {}
+    dia = desde
+    while dia <= hasta:
+        fecha = dia.isoformat()
+        if dia.weekday() < 5:
+            libres[fecha] = {m: agenda.libres(m, dia_agenda(dia), ocupadas.get((fecha, m), ()))
+                             for m in medicos}
+        else:
+            libres[fecha] = {m: [] for m in medicos}
+        dia += timedelta(days=1)
+    return libres
+
+
 def validar_historia(data):
     campos_obligatorios = ["dni", "consulta_medica", "medico"]
     for campo in campos_obligatorios:
@@ -148,22 +343,83 @@ def rol_permitido(varios_roles):
     return wrapper
 
 
+def bloquea(*archivos):
+    """Bloqueo exclusivo de los archivos que la ruta lee, modifica y guarda.
+
+    Con varios workers de gunicorn evita que dos requests carguen la misma
+    versión y el último guardar_json pise los cambios del otro. Los GET no
+    bloquean.
+    """
+    def wrapper(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method == "GET":
+                return f(*args, **kwargs)
+            with transaccion(*archivos):
+                return f(*args, **kwargs)
+        return decorated
+    return wrapper
+
+
+@app.errorhandler(ConflictoDeVersion)
+def conflicto_de_version(error):
+    # La escritura no se hizo: el cliente puede reintentar sobre los datos nuevos
+    return jsonify({"error": "Los datos cambiaron mientras se guardaban, intentá de nuevo"}), 409
+
+
+# Respuestas de los reportes del administrador, mientras no cambien los datos
+# que leen (REPORTES_CACHE=0 las desactiva)
+reportes_cacheados = CacheReportes(int(os.environ.get("REPORTES_CACHE_MAXIMO", "64")))
+REPORTES_CACHE = os.environ.get("REPORTES_CACHE", "1") != "0"
+
+
+def reporte_cacheado(*archivos, vigencia=None):
+    """Guarda la respuesta de un reporte bajo (ruta, parámetros, versión de archivos).
+
+    archivos son los datasets que lee el reporte: una escritura en cualquiera
+    cambia su versión y el reporte se vuelve a calcular. La fecha del día
+    también es parte de la clave; los reportes que dependen de la hora (los
+    turnos vencidos) indican además una vigencia en segundos.
+    """
+    def wrapper(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not REPORTES_CACHE:
+                return f(*args, **kwargs)
+            # Versiones antes de leer: lo que se escriba durante el cálculo cambia la clave
+            clave = (request.endpoint, tuple(sorted(request.args.items(multi=True))),
+                     tuple(version(archivo) for archivo in archivos), date.today().isoformat(),
+                     int(datetime.now().timestamp() // vigencia) if vigencia else None)
+            guardada = reportes_cacheados.obtener(clave)
+            if guardada is not None:
+                return app.response_class(guardada[0], status=200, mimetype=guardada[1])
+            respuesta = make_response(f(*args, **kwargs))
+            if respuesta.status_code == 200:
+                reportes_cacheados.guardar(clave, (respuesta.get_data(), respuesta.mimetype))
+            return respuesta
+        return decorated
+    return wrapper
+
+
 # ========================== RUTAS GENERALES ============================
 
 @app.route('/descargar/<archivo>')
 @login_requerido
 @rol_requerido("administrador")
 def descargar_archivo(archivo):
-    # En producción usa /data/, en desarrollo local usa la raíz
-    if os.path.exists("/data"):
-        ruta = f"/data/{archivo}"
-    else:
-        ruta = archivo
+    # Solo los datasets: otro nombre no llega al almacenamiento (ni crea su .lock)
+    ruta = DATASETS.get(archivo)
+    if ruta is None:
+        return f"Archivo '{archivo}' no encontrado", 404
     
-    if os.path.exists(ruta):
-        return send_file(ruta, as_attachment=True)
-    else:
+    # Volcar el journal pendiente para descargar el archivo completo
+    compactar(ruta)
+
+    if not os.path.exists(ruta):
         return f"Archivo '{archivo}' no encontrado", 404
+    # En disco está compacto: se descarga la versión indentada, legible
+    return send_file(io.BytesIO(exportar_json(ruta)), as_attachment=True,
+                     download_name=os.path.basename(ruta), mimetype="application/json")
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -171,11 +427,8 @@ def login():
     if request.method == "POST":
         usuario = request.form.get("usuario")
         contrasena = request.form.get("contrasena")
-        usuarios = cargar_json(USUARIOS_FILE)
-
-
-        for u in usuarios:
-            if u["usuario"] == usuario and check_password_hash(u["contrasena"], contrasena):
+        for u in buscar(USUARIOS_FILE, usuario=usuario):
+            if check_password_hash(u["contrasena"], contrasena):
                 session["usuario"] = usuario
                 session["rol"] = u.get("rol", "")
                 # Redirigir según el rol
@@ -230,15 +483,23 @@ def ver_historia_clinica():
 @login_requerido
 @rol_requerido("medico")
 def obtener_todas_las_historias():
-    historias = cargar_json(DATA_FILE)
-    return jsonify(historias)
+    """Historias en streaming: lista JSON o, con ?formato=ndjson, una por línea.
+
+    Se serializan a medida que se recorren, sin armar la respuesta completa en
+    memoria. ?dni= filtra durante el recorrido.
+    """
+    dni = request.args.get("dni")
+    historias = iterar_json(DATA_FILE, dni=dni) if dni else iterar_json(DATA_FILE)
+    ndjson = request.args.get("formato") == "ndjson"
+    return Response(stream_with_context(json_en_bloques(historias, ndjson)),
+                    mimetype="application/x-ndjson" if ndjson else "application/json")
 
 
 @app.route("/historias", methods=["POST"])
 @login_requerido
 @rol_requerido("medico")
+@bloquea(DATA_FILE)
 def crear_historia():
-    historias = cargar_json(DATA_FILE)
     nueva = request.json
 
 
@@ -248,29 +509,29 @@ def crear_historia():
 
 
     # Agregar ID único para la consulta
-    nueva["id"] = len(historias) + 1
+    nueva["id"] = siguiente_id(DATA_FILE)
     nueva["fecha_creacion"] = datetime.now(timezone_ar).isoformat()
 
 
-    historias.append(nueva)
-    guardar_json(DATA_FILE, historias)
+    agregar(DATA_FILE, nueva)
     return jsonify({"mensaje": "Consulta registrada correctamente"}), 201
 
 
 @app.route("/historias/<dni>", methods=["GET", "PUT", "DELETE"])
 @login_requerido
 @rol_requerido("medico")
+@bloquea(DATA_FILE)
 def manejar_historia(dni):
-    historias = cargar_json(DATA_FILE)
-
-
     if request.method == "GET":
-        for h in historias:
-            if h["dni"] == dni:
-                return jsonify(h)
+        h = buscar_uno(DATA_FILE, dni=dni)
+        if h:
+            return jsonify(h)
         return jsonify({"error": "Historia no encontrada"}), 404
 
 
+    historias = cargar_json(DATA_FILE)
+
+
     if request.method == "PUT":
         datos = request.json
         valido, mensaje = validar_historia(datos)
@@ -340,34 +601,23 @@ def buscar_pacientes_paginado():
     pagina = int(request.args.get("pagina", 1))
     por_pagina = min(int(request.args.get("por_pagina", 10)), 50)
 
-    pacientes_raw = cargar_json(PACIENTES_FILE)
-    vistos = set()
-    pacientes = []
-    for p in pacientes_raw:
-        if p.get("dni") and p["dni"] not in vistos:
-            vistos.add(p["dni"])
-            pacientes.append(p)
-
-    for paciente in pacientes:
+    indice_busqueda = derivado(PACIENTES_FILE, "busqueda", indice_busqueda_pacientes)
+    inicio = (max(1, pagina) - 1) * por_pagina
+    total, encontrados = indice_busqueda.buscar(busqueda, inicio, por_pagina)
+    total_paginas = max(1, (total + por_pagina - 1) // por_pagina)
+    if pagina < 1 or pagina > total_paginas:
+        # Página fuera de rango: se devuelve la más cercana
+        pagina = max(1, min(pagina, total_paginas))
+        inicio = (pagina - 1) * por_pagina
+        total, encontrados = indice_busqueda.buscar(busqueda, inicio, por_pagina)
+
+    # La edad se calcula solo para la página, sobre copias (los del índice son de la cache)
+    pacientes_pagina = []
+    for p in encontrados:
+        paciente = dict(p)
         if paciente.get("fecha_nacimiento"):
             paciente["edad"] = calcular_edad(paciente["fecha_nacimiento"])
-
-    pacientes.sort(key=lambda p: p.get("apellido", "").lower())
-
-    if busqueda:
-        pacientes = [
-            p for p in pacientes
-            if (p.get("dni", "") and busqueda in p["dni"]) or
-               (p.get("apellido", "").lower() and busqueda in p["apellido"].lower()) or
-               (p.get("nombre", "").lower() and busqueda in p["nombre"].lower())
-        ]
-
-    total = len(pacientes)
-    total_paginas = max(1, (total + por_pagina - 1) // por_pagina)
-    pagina = max(1, min(pagina, total_paginas))
-    inicio = (pagina - 1) * por_pagina
-    fin = min(inicio + por_pagina, total)
-    pacientes_pagina = pacientes[inicio:fin]
+        pacientes_pagina.append(paciente)
 
     return jsonify({
         "pacientes": pacientes_pagina,
@@ -415,6 +665,7 @@ def estadisticas_pacientes():
 @app.route("/api/pacientes", methods=["POST"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(PACIENTES_FILE)
 def registrar_paciente():
     data = request.json
     campos = ["nombre", "apellido", "dni", "obra_social", "numero_obra_social", "celular", "fecha_nacimiento"]
@@ -424,18 +675,31 @@ def registrar_paciente():
     
     # La edad se calculará dinámicamente cuando se consulte
 
-    pacientes = cargar_json(PACIENTES_FILE)
-    if any(p["dni"] == data["dni"] for p in pacientes):
+    if buscar_uno(PACIENTES_FILE, dni=data["dni"]):
         return jsonify({"error": "Ya existe un paciente con ese DNI"}), 400
 
+    pacientes = cargar_json(PACIENTES_FILE)
     data["fecha_registro"] = datetime.now(timezone_ar).isoformat()
     pacientes.append(data)
     guardar_json(PACIENTES_FILE, pacientes)
     return jsonify({"mensaje": "Paciente registrado correctamente"})
 
+@app.route("/api/pacientes/<dni>", methods=["GET"])
+@login_requerido
+@rol_permitido(["secretaria", "medico"])
+def obtener_paciente(dni):
+    """Un paciente por DNI (la agenda pide solo el del turno, no la lista entera)"""
+    paciente = buscar_uno(PACIENTES_FILE, dni=dni)
+    if not paciente:
+        return jsonify({"error": "Paciente no encontrado"}), 404
+    if paciente.get("fecha_nacimiento"):
+        paciente["edad"] = calcular_edad(paciente["fecha_nacimiento"])
+    return jsonify(paciente)
+
 @app.route("/api/pacientes/<dni>", methods=["PUT"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(PACIENTES_FILE)
 def actualizar_paciente(dni):
     data = request.json
     campos = ["nombre", "apellido", "dni", "obra_social", "numero_obra_social", "celular"]
@@ -449,12 +713,12 @@ def actualizar_paciente(dni):
 
     # La edad se calculará dinámicamente cuando se consulte
 
-    pacientes = cargar_json(PACIENTES_FILE)
-
     # Si el DNI cambió, verificar que el nuevo DNI no esté en uso
     if data["dni"] != dni:
-        if any(p["dni"] == data["dni"] for p in pacientes):
+        if buscar_uno(PACIENTES_FILE, dni=data["dni"]):
             return jsonify({"error": "Ya existe un paciente con ese DNI"}), 400
+
+    pacientes = cargar_json(PACIENTES_FILE)
     
     
     for i, paciente in enumerate(pacientes):
@@ -471,16 +735,21 @@ def actualizar_paciente(dni):
 @app.route("/api/pacientes/<dni>", methods=["DELETE"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(PACIENTES_FILE, TURNOS_FILE, DATA_FILE)
 def eliminar_paciente(dni):
     pacientes = cargar_json(PACIENTES_FILE)
     
-    # Verificar si el paciente tiene turnos asociados
-    turnos = cargar_json(TURNOS_FILE)
-    turnos_del_paciente = [t for t in turnos if t.get("dni_paciente") == dni]
+    # Verificar si el paciente tiene turnos asociados, también en los meses archivados
+    turnos_del_paciente = buscar_completo(TURNOS_FILE, dni_paciente=dni)
+    activos = buscar(TURNOS_FILE, dni_paciente=dni)
     
+    if activos:
+        return jsonify({
+            "error": f"No se puede eliminar el paciente. Tiene {len(activos)} turno(s) asociado(s). Primero cancele todos sus turnos."
+        }), 400
     if turnos_del_paciente:
         return jsonify({
-            "error": f"No se puede eliminar el paciente. Tiene {len(turnos_del_paciente)} turno(s) asociado(s). Primero cancele todos sus turnos."
+            "error": f"No se puede eliminar el paciente. Tiene {len(turnos_del_paciente)} turno(s) en meses archivados."
         }), 400
     
     # Buscar y eliminar el paciente
@@ -505,12 +774,17 @@ def eliminar_paciente(dni):
 @login_requerido
 @rol_permitido(["secretaria", "medico"])
 def obtener_turnos():
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
+    # ?fecha= devuelve solo los turnos de ese día (la agenda pide el día que muestra),
+    # con el nombre del paciente y no su ficha: la ficha se pide con /api/pacientes/<dni>
+    fecha = request.args.get("fecha")
+    turnos = buscar(TURNOS_FILE, fecha=fecha) if fecha else cargar_json(TURNOS_FILE)
+    pacientes = indice(PACIENTES_FILE, "dni")
 
 
     for t in turnos:
-        paciente = next((p for p in pacientes if p["dni"] == t["dni_paciente"]), None)
+        paciente = pacientes.get(t["dni_paciente"])
+        if fecha and paciente:
+            paciente = {"nombre": paciente.get("nombre", ""), "apellido": paciente.get("apellido", "")}
         t["paciente"] = paciente
         t["estado"] = t.get("estado", "sin atender")
         # Formatear fecha DD/M/YYYY en servidor (evita desfase por zona horaria en frontend)
@@ -528,6 +802,7 @@ def obtener_turnos():
 @app.route("/api/turnos", methods=["POST"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(TURNOS_FILE)
 def asignar_turno():
     data = request.json
     campos = ["medico", "hora", "fecha", "dni_paciente"]
@@ -553,24 +828,21 @@ def asignar_turno():
     }[dia_semana]
 
 
-    agenda = cargar_json(AGENDA_FILE)
+    agenda = agenda_compilada()
     medico = data["medico"]
     if medico not in agenda:
         return jsonify({"error": "Médico no encontrado"}), 404
 
 
-    horarios_disponibles = agenda[medico].get(dia_es, [])
-    if data["hora"] not in horarios_disponibles:
+    if not agenda.atiende(medico, dia_es, data["hora"]):
         return jsonify({"error": f"La hora '{data['hora']}' no está disponible para el médico {medico} el día {dia_es}"}), 400
 
 
-    turnos = cargar_json(TURNOS_FILE)
-    if any(t["medico"] == medico and t.get("fecha") == data["fecha"] and t["hora"] == data["hora"] for t in turnos):
+    if horario_ocupado(medico, data["fecha"], data["hora"]):
         return jsonify({"error": "Ya existe un turno asignado para ese horario y fecha"}), 400
 
 
-    pacientes = cargar_json(PACIENTES_FILE)
-    if not any(p["dni"] == data["dni_paciente"] for p in pacientes):
+    if not buscar_uno(PACIENTES_FILE, dni=data["dni_paciente"]):
         return jsonify({"error": "Paciente no encontrado"}), 404
 
 
@@ -583,6 +855,7 @@ def asignar_turno():
     }
 
 
+    turnos = cargar_json(TURNOS_FILE)
     turnos.append(turno_nuevo)
     guardar_json(TURNOS_FILE, turnos)
     return jsonify({"mensaje": "Turno asignado correctamente"})
@@ -591,6 +864,7 @@ def asignar_turno():
 @app.route("/api/turnos/estado", methods=["PUT"])
 @login_requerido
 @rol_permitido(["medico"])
+@bloquea(TURNOS_FILE)
 def actualizar_estado_turno():
     data = request.json
     dni_paciente = data.get("dni_paciente")
@@ -603,22 +877,10 @@ def actualizar_estado_turno():
         return jsonify({"error": "Estado inválido"}), 400
 
 
-    turnos = cargar_json(TURNOS_FILE)
-    encontrado = False
-
-
-    for turno in turnos:
-        if turno["dni_paciente"] == dni_paciente and turno["fecha"] == fecha and turno["hora"] == hora:
-            turno["estado"] = nuevo_estado
-            encontrado = True
-            break
-
-
-    if not encontrado:
+    if not modificar(TURNOS_FILE, (dni_paciente, fecha, hora), {"estado": nuevo_estado}):
         return jsonify({"error": "Turno no encontrado"}), 404
 
 
-    guardar_json(TURNOS_FILE, turnos)
     return jsonify({"mensaje": "Estado actualizado correctamente"})
 
 
@@ -643,17 +905,13 @@ def gestion_turnos():
 @rol_requerido("medico")
 def obtener_turnos_medico():
     usuario_medico = session.get("usuario")
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-
-
-    turnos_medico = [t for t in turnos if t.get("medico") == usuario_medico]
+    turnos_medico = buscar(TURNOS_FILE, medico=usuario_medico)
+    pacientes = indice(PACIENTES_FILE, "dni")
 
 
     # Enriquecer con datos del paciente
     for t in turnos_medico:
-        paciente = next((p for p in pacientes if p["dni"] == t["dni_paciente"]), {})
-        t["paciente"] = paciente
+        t["paciente"] = pacientes.get(t["dni_paciente"]) or {}
         t["estado"] = t.get("estado", "sin atender")
 
 
@@ -684,9 +942,64 @@ def obtener_agenda():
         return jsonify({"error": "Error al cargar la agenda"}), 500
 
 
+# Días como máximo que abarca /api/agenda/disponibles/rango
+DIAS_MAXIMOS_DISPONIBLES = 62
+
+
+@app.route("/api/agenda/disponibles", methods=["GET"])
+@login_requerido
+@rol_permitido(["secretaria", "medico"])
+def obtener_horarios_disponibles():
+    """Horarios libres de un día (?fecha=, por defecto hoy), de todos los médicos o de ?medico=.
+
+    Solo los horarios: ni los turnos ni datos de pacientes.
+    """
+    medico = request.args.get("medico") or None
+    try:
+        fecha = datetime.strptime(request.args.get("fecha", date.today().isoformat()), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
+    if medico is not None and medico not in agenda_compilada():
+        return jsonify({"error": "Médico no encontrado"}), 404
+
+    libres = horarios_libres(fecha, fecha, medico)
+    return jsonify({
+        "fecha": fecha.isoformat(),
+        "dia": dia_agenda(fecha),
+        "medicos": libres[fecha.isoformat()],
+    })
+
+
+@app.route("/api/agenda/disponibles/rango", methods=["GET"])
+@login_requerido
+@rol_permitido(["secretaria", "medico"])
+def obtener_horarios_disponibles_rango():
+    """Horarios libres día por día entre ?desde= y ?hasta= (hasta DIAS_MAXIMOS_DISPONIBLES días)"""
+    medico = request.args.get("medico") or None
+    try:
+        desde = datetime.strptime(request.args.get("desde", ""), "%Y-%m-%d").date()
+        hasta = datetime.strptime(request.args.get("hasta", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Parámetros desde y hasta requeridos (YYYY-MM-DD)"}), 400
+    if hasta < desde:
+        return jsonify({"error": "La fecha hasta es anterior a desde"}), 400
+    if (hasta - desde).days >= DIAS_MAXIMOS_DISPONIBLES:
+        return jsonify({"error": f"El rango no puede superar {DIAS_MAXIMOS_DISPONIBLES} días"}), 400
+    if medico is not None and medico not in agenda_compilada():
+        return jsonify({"error": "Médico no encontrado"}), 404
+
+    libres = horarios_libres(desde, hasta, medico)
+    return jsonify({
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "dias": {fecha: {"dia": dia_agenda(fecha), "medicos": medicos} for fecha, medicos in libres.items()},
+    })
+
+
 @app.route("/api/agenda/<medico>/<dia>", methods=["PUT"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(AGENDA_FILE)
 def actualizar_agenda_dia(medico, dia):
     nuevos_horarios = request.json
     if dia.upper() not in ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES"]:
@@ -694,6 +1007,9 @@ def actualizar_agenda_dia(medico, dia):
     if not isinstance(nuevos_horarios, dict) or "horarios" not in nuevos_horarios or not isinstance(nuevos_horarios["horarios"], list):
         return jsonify({"error": "Formato inválido, se espera un objeto con clave 'horarios' que sea una lista"}), 400
     nuevos_horarios = nuevos_horarios["horarios"]
+    # Cada horario tiene que ser un HH:MM (ver franjas.py)
+    if not all(franja(h) is not None for h in nuevos_horarios):
+        return jsonify({"error": "Horario inválido, se espera HH:MM"}), 400
 
     agenda = cargar_json(AGENDA_FILE)
     if medico not in agenda:
@@ -707,16 +1023,12 @@ def actualizar_agenda_dia(medico, dia):
 @app.route("/api/turnos/<dni>/<fecha>/<hora>", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria", "medico"])
+@bloquea(TURNOS_FILE)
 def editar_turno(dni, fecha, hora):
     data = request.json
-    turnos = cargar_json(TURNOS_FILE)
     
     # Encontrar el turno específico
-    turno_encontrado = None
-    for turno in turnos:
-        if turno["dni_paciente"] == dni and turno["fecha"] == fecha and turno["hora"] == hora:
-            turno_encontrado = turno
-            break
+    turno_encontrado = obtener(TURNOS_FILE, dni, fecha, hora)
     
     if not turno_encontrado:
         return jsonify({"error": "Turno no encontrado"}), 404
@@ -726,8 +1038,7 @@ def editar_turno(dni, fecha, hora):
         nueva_hora = data["nueva_hora"]
         nueva_fecha = data.get("nueva_fecha", fecha)
         # Verificar que la nueva hora no esté ocupada en la fecha correspondiente
-        if any(t["medico"] == turno_encontrado["medico"] and t["fecha"] == nueva_fecha and t["hora"] == nueva_hora and 
-               not (t["dni_paciente"] == dni and t["fecha"] == fecha and t["hora"] == hora) for t in turnos):
+        if horario_ocupado(turno_encontrado["medico"], nueva_fecha, nueva_hora, excepto=(dni, fecha, hora)):
             return jsonify({"error": "La nueva hora ya está ocupada"}), 400
         turno_encontrado["hora"] = nueva_hora
     
@@ -735,8 +1046,7 @@ def editar_turno(dni, fecha, hora):
         nueva_fecha = data["nueva_fecha"]
         nueva_hora = data.get("nueva_hora", turno_encontrado["hora"])
         # Verificar que la nueva fecha/hora no esté ocupada
-        if any(t["medico"] == turno_encontrado["medico"] and t["fecha"] == nueva_fecha and t["hora"] == nueva_hora and 
-               not (t["dni_paciente"] == dni and t["fecha"] == fecha and t["hora"] == hora) for t in turnos):
+        if horario_ocupado(turno_encontrado["medico"], nueva_fecha, nueva_hora, excepto=(dni, fecha, hora)):
             return jsonify({"error": "La nueva fecha/hora ya está ocupada"}), 400
         turno_encontrado["fecha"] = nueva_fecha
     
@@ -748,25 +1058,17 @@ def editar_turno(dni, fecha, hora):
         if data["nuevo_estado"] in estados_validos:
             turno_encontrado["estado"] = data["nuevo_estado"]
 
-    guardar_json(TURNOS_FILE, turnos)
+    modificar(TURNOS_FILE, (dni, fecha, hora), turno_encontrado)
     return jsonify({"mensaje": "Turno actualizado correctamente"})
 
 @app.route("/api/turnos/<dni>/<fecha>/<hora>", methods=["DELETE"])
 @login_requerido
 @rol_permitido(["secretaria", "medico"])
+@bloquea(TURNOS_FILE)
 def eliminar_turno(dni, fecha, hora):
-    turnos = cargar_json(TURNOS_FILE)
-    
-    # Filtrar el turno a eliminar
-    turnos_filtrados = [
-        t for t in turnos 
-        if not (t["dni_paciente"] == dni and t["fecha"] == fecha and t["hora"] == hora)
-    ]
-    
-    if len(turnos_filtrados) == len(turnos):
+    if not eliminar(TURNOS_FILE, dni, fecha, hora):
         return jsonify({"error": "Turno no encontrado"}), 404
     
-    guardar_json(TURNOS_FILE, turnos_filtrados)
     return jsonify({"mensaje": "Turno eliminado correctamente"})
 
 # ======================= SISTEMA DE PAGOS =======================
@@ -781,6 +1083,7 @@ def obtener_pagos():
 @app.route("/api/pagos", methods=["POST"])
 @login_requerido
 @rol_requerido("secretaria")
+@bloquea(PAGOS_FILE)
 def registrar_pago():
     data = request.json
     campos_requeridos = ["dni_paciente", "fecha"]
@@ -807,25 +1110,21 @@ def registrar_pago():
         tipo_pago = "obra_social"
     
     # Verificar que el paciente existe
-    pacientes = cargar_json(PACIENTES_FILE)
-    paciente = next((p for p in pacientes if p["dni"] == data["dni_paciente"]), None)
+    paciente = buscar_uno(PACIENTES_FILE, dni=data["dni_paciente"])
     
     if not paciente:
         return jsonify({"error": "Paciente no encontrado"}), 404
     
     # Verificar si ya existe un pago para este paciente en esta fecha y hora
-    pagos = cargar_json(PAGOS_FILE)
     hora = data.get("hora", "")
-    pago_existente = next((p for p in pagos if 
-                          p["dni_paciente"] == data["dni_paciente"] and 
-                          p["fecha"] == data["fecha"] and 
-                          p.get("hora", "") == hora), None)
+    pago_existente = next((p for p in buscar(PAGOS_FILE, dni_paciente=data["dni_paciente"], fecha=data["fecha"])
+                          if p.get("hora", "") == hora), None)
      
     if pago_existente and hora:
         return jsonify({"error": "Ya existe un pago registrado para este paciente en esta fecha y hora"}), 400
      
     nuevo_pago = {
-        "id": len(pagos) + 1,
+        "id": siguiente_id(PAGOS_FILE),
         "dni_paciente": data["dni_paciente"],
         "nombre_paciente": f"{paciente.get('nombre', '')} {paciente.get('apellido', '')}".strip(),
         "monto": monto,
@@ -837,24 +1136,20 @@ def registrar_pago():
         "tipo_pago": tipo_pago
     }
     
-    pagos.append(nuevo_pago)
-    guardar_json(PAGOS_FILE, pagos)
+    agregar(PAGOS_FILE, nuevo_pago)
     
     return jsonify({"mensaje": "Pago registrado correctamente", "pago": nuevo_pago}), 201
 
 @app.route("/api/pagos/<int:pago_id>", methods=["DELETE"])
 @login_requerido
 @rol_permitido(["secretaria", "medico"])
+@bloquea(PAGOS_FILE)
 def eliminar_pago(pago_id):
-    pagos = cargar_json(PAGOS_FILE)
-     
-    # Filtrar el pago a eliminar
-    pagos_filtrados = [p for p in pagos if p.get("id") != pago_id]
-     
-    if len(pagos_filtrados) == len(pagos):
+    if not eliminar(PAGOS_FILE, pago_id):
+        mes = archivado(PAGOS_FILE, pago_id)
+        if mes is not None:
+            return jsonify({"error": f"El pago es de un mes archivado ({mes}) y no se puede eliminar"}), 409
         return jsonify({"error": "Pago no encontrado"}), 404
-     
-    guardar_json(PAGOS_FILE, pagos_filtrados)
     return jsonify({"mensaje": "Pago eliminado correctamente"})
  
 
@@ -862,7 +1157,6 @@ def eliminar_pago(pago_id):
 @login_requerido
 @rol_requerido("secretaria")
 def obtener_estadisticas_pagos():
-    pagos = cargar_json(PAGOS_FILE)
     hoy = date.today()
     # Permitir filtrar por fecha específica
     fecha_param = request.args.get("fecha")
@@ -875,76 +1169,48 @@ def obtener_estadisticas_pagos():
         fecha_dia = hoy
     mes_param = request.args.get("mes", fecha_dia.strftime("%Y-%m"))
     
-    # Filtrar pagos del día
-    pagos_hoy = [p for p in pagos if p["fecha"] == fecha_dia.isoformat()]
-    total_dia = sum(p["monto"] for p in pagos_hoy)
-    
-    # Filtrar pagos del mes especificado
-    pagos_mes = [p for p in pagos if p["fecha"].startswith(mes_param)]
-    total_mes = sum(p["monto"] for p in pagos_mes)
+    # Totales del día y del mes (por día y tipo de pago, ver totales_pagos)
+    totales_dia = totales_pagos(fecha_dia.isoformat(), fecha_dia.isoformat())
+    cantidad_dia, total_dia, _ = sumar_totales(totales_dia)
+    totales_mes = totales_pagos(mes_param, mes_param + "\uffff")
+    cantidad_mes, total_mes, pagos_obra_social = sumar_totales(totales_mes)
+    pagos_particulares = cantidad_mes - pagos_obra_social
     
     # Estadísticas por tipo de pago del día
-    pagos_efectivo_hoy = [p for p in pagos_hoy if p.get("tipo_pago") == "efectivo"]
-    pagos_transferencia_hoy = [p for p in pagos_hoy if p.get("tipo_pago") == "transferencia"]
-    pagos_obra_social_hoy = [p for p in pagos_hoy if p.get("tipo_pago") == "obra_social"]
-    
-    total_efectivo_hoy = sum(p["monto"] for p in pagos_efectivo_hoy)
-    total_transferencia_hoy = sum(p["monto"] for p in pagos_transferencia_hoy)
-    total_obra_social_hoy = sum(p["monto"] for p in pagos_obra_social_hoy)
-
+    efectivo_hoy = sumar_totales(totales_dia, "efectivo")
+    transferencia_hoy = sumar_totales(totales_dia, "transferencia")
+    obra_social_hoy = sumar_totales(totales_dia, "obra_social")
 
     # Estadísticas por día del mes
-    pagos_por_dia = {}
-    pagos_obra_social = 0
-    pagos_particulares = 0
-     
-    for pago in pagos_mes:
-        dia = pago["fecha"]
-        if dia not in pagos_por_dia:
-            pagos_por_dia[dia] = {"cantidad": 0, "monto": 0, "pacientes": []}
-         
-        pagos_por_dia[dia]["cantidad"] += 1
-        pagos_por_dia[dia]["monto"] += pago["monto"]
-        pagos_por_dia[dia]["pacientes"].append({
-            "nombre": pago["nombre_paciente"],
-            "monto": pago["monto"],
-            "obra_social": pago.get("obra_social", ""),
-            "tipo_pago": pago.get("tipo_pago", "efectivo")
-        })
-         
-        if pago["monto"] == 0:
-            pagos_obra_social += 1
-        else:
-             pagos_particulares += 1
-     
-    # Ordenar días por fecha
-    pagos_por_dia_ordenados = dict(sorted(pagos_por_dia.items()))
+    pagos_por_dia_ordenados = detalle_pagos_por_dia(totales_mes, cargar_prefijo(PAGOS_FILE, mes_param), lambda pago: {
+        "nombre": pago["nombre_paciente"],
+        "monto": pago["monto"],
+        "obra_social": pago.get("obra_social", ""),
+        "tipo_pago": pago.get("tipo_pago", "efectivo")
+    })
     
     return jsonify({
         "total_dia": total_dia,
         "total_mes": total_mes,
-        "cantidad_pagos_dia": len(pagos_hoy),
-        "cantidad_pagos_mes": len(pagos_mes),
+        "cantidad_pagos_dia": cantidad_dia,
+        "cantidad_pagos_mes": cantidad_mes,
         "pagos_obra_social": pagos_obra_social,
         "pagos_particulares": pagos_particulares,
         "fecha": fecha_dia.isoformat(),
         "mes_consultado": mes_param,
         "detalle_por_dia": pagos_por_dia_ordenados,
         # Nuevas estadísticas por tipo de pago
-        "pagos_efectivo_hoy": len(pagos_efectivo_hoy),
-        "pagos_transferencia_hoy": len(pagos_transferencia_hoy),
-        "pagos_obra_social_hoy": len(pagos_obra_social_hoy),
-        "total_efectivo_hoy": total_efectivo_hoy,
-        "total_transferencia_hoy": total_transferencia_hoy,
-        "total_obra_social_hoy": total_obra_social_hoy
+        "pagos_efectivo_hoy": efectivo_hoy[0],
+        "pagos_transferencia_hoy": transferencia_hoy[0],
+        "pagos_obra_social_hoy": obra_social_hoy[0],
+        "total_efectivo_hoy": efectivo_hoy[1],
+        "total_transferencia_hoy": transferencia_hoy[1],
+        "total_obra_social_hoy": obra_social_hoy[1]
     })
 @app.route("/api/pagos/exportar", methods=["GET"])
 @login_requerido
 @rol_requerido("secretaria")
 def exportar_pagos_csv():
-    pagos = cargar_json(PAGOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-
     # Obtener la fecha seleccionada (o hoy por defecto)
     
     fecha_param = request.args.get("fecha")
@@ -957,7 +1223,7 @@ def exportar_pagos_csv():
         fecha_dia = date.today()
     
     # Filtrar pagos de la fecha seleccionada
-    pagos_dia = [p for p in pagos if p["fecha"] == fecha_dia.isoformat()]
+    pagos_dia = buscar(PAGOS_FILE, fecha=fecha_dia.isoformat())
     
     # Calcular subtotales
     subtotal_efectivo = sum(p["monto"] for p in pagos_dia if p.get("tipo_pago") == "efectivo")
@@ -972,8 +1238,9 @@ def exportar_pagos_csv():
     writer.writerow(['Fecha', 'Apellido', 'Nombre', 'DNI', 'Monto', 'Tipo de Pago', 'Observaciones'])
     
     # Datos
+    pacientes = indice(PACIENTES_FILE, "dni")
     for pago in pagos_dia:
-        paciente = next((p for p in pacientes if p["dni"] == pago["dni_paciente"]), {})
+        paciente = pacientes.get(pago["dni_paciente"]) or {}
         writer.writerow([
             pago["fecha"],
             paciente.get("apellido", ""),
@@ -1005,21 +1272,18 @@ def obtener_pacientes_atendidos():
     """Obtiene pacientes que fueron atendidos y aún no tienen pago registrado para una fecha específica"""
     fecha = request.args.get("fecha", date.today().isoformat())
     
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    pagos = cargar_json(PAGOS_FILE)
-    
     # Filtrar turnos atendidos en la fecha especificada
-    turnos_atendidos = [t for t in turnos if t["fecha"] == fecha and t["estado"] == "atendido"]
+    turnos_atendidos = buscar(TURNOS_FILE, fecha=fecha, estado="atendido")
     
     # Obtener DNIs que ya tienen pago registrado en esa fecha
-    dnis_con_pago = {p["dni_paciente"] for p in pagos if p["fecha"] == fecha}
+    dnis_con_pago = {p["dni_paciente"] for p in buscar(PAGOS_FILE, fecha=fecha)}
     
     # Filtrar pacientes atendidos sin pago
+    pacientes = indice(PACIENTES_FILE, "dni")
     pacientes_sin_pago = []
     for turno in turnos_atendidos:
         if turno["dni_paciente"] not in dnis_con_pago:
-            paciente = next((p for p in pacientes if p["dni"] == turno["dni_paciente"]), None)
+            paciente = pacientes.get(turno["dni_paciente"])
             if paciente:
                 pacientes_sin_pago.append({
                     "dni": paciente["dni"],
@@ -1039,21 +1303,18 @@ def obtener_pacientes_recepcionados():
     """Obtiene pacientes que están recepcionados y pendientes de pago"""
     fecha = request.args.get("fecha", date.today().isoformat())
     
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    pagos = cargar_json(PAGOS_FILE)
-    
     # Filtrar turnos recepcionados en la fecha especificada
-    turnos_recepcionados = [t for t in turnos if t.get("fecha") == fecha and t.get("estado") == "recepcionado"]
+    turnos_recepcionados = buscar(TURNOS_FILE, fecha=fecha, estado="recepcionado")
     
     # Obtener DNIs que ya tienen pago registrado en esa fecha
-    dnis_con_pago = {p["dni_paciente"] for p in pagos if p["fecha"] == fecha}
+    dnis_con_pago = {p["dni_paciente"] for p in buscar(PAGOS_FILE, fecha=fecha)}
     
     # Filtrar pacientes recepcionados sin pago
+    pacientes = indice(PACIENTES_FILE, "dni")
     pacientes_recepcionados = []
     for turno in turnos_recepcionados:
         if turno["dni_paciente"] not in dnis_con_pago:
-            paciente = next((p for p in pacientes if p["dni"] == turno["dni_paciente"]), None)
+            paciente = pacientes.get(turno["dni_paciente"])
             if paciente:
                 pacientes_recepcionados.append({
                     "dni": paciente["dni"],
@@ -1079,18 +1340,15 @@ def obtener_pacientes_sala_espera():
     """Obtiene pacientes que están en sala de espera (ya cobrados)"""
     fecha = request.args.get("fecha", date.today().isoformat())
     
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    pagos = cargar_json(PAGOS_FILE)
-    
     # Filtrar turnos en sala de espera en la fecha especificada
-    turnos_sala_espera = [t for t in turnos if t.get("fecha") == fecha and t.get("estado") == "sala de espera"]
+    turnos_sala_espera = buscar(TURNOS_FILE, fecha=fecha, estado="sala de espera")
     
     # Obtener información de pagos para estos pacientes
+    pacientes = indice(PACIENTES_FILE, "dni")
     pacientes_sala_espera = []
     for turno in turnos_sala_espera:
-        paciente = next((p for p in pacientes if p["dni"] == turno["dni_paciente"]), None)
-        pago = next((p for p in pagos if p["dni_paciente"] == turno["dni_paciente"] and p["fecha"] == fecha), None)
+        paciente = pacientes.get(turno["dni_paciente"])
+        pago = buscar_uno(PAGOS_FILE, dni_paciente=turno["dni_paciente"], fecha=fecha)
         
         if paciente:
             pacientes_sala_espera.append({
@@ -1119,6 +1377,7 @@ def obtener_pacientes_sala_espera():
 @app.route("/api/turnos/recepcionar", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria"])
+@bloquea(TURNOS_FILE)
 def recepcionar_paciente():
     """Cambiar el estado de un turno a 'recepcionado' cuando llega el paciente"""
     data = request.json
@@ -1129,24 +1388,19 @@ def recepcionar_paciente():
     if not all([dni_paciente, fecha, hora]):
         return jsonify({"error": "DNI, fecha y hora son requeridos"}), 400
     
-    turnos = cargar_json(TURNOS_FILE)
-    
-    for turno in turnos:
-        if (turno["dni_paciente"] == dni_paciente and 
-            turno["fecha"] == fecha and 
-            turno["hora"] == hora):
-            
-            turno["estado"] = "recepcionado"
-            turno["hora_recepcion"] = datetime.now(timezone_ar).strftime("%H:%M")
-            
-            guardar_json(TURNOS_FILE, turnos)
-            return jsonify({"mensaje": "Paciente recepcionado correctamente"})
+    turno = modificar(TURNOS_FILE, (dni_paciente, fecha, hora), {
+        "estado": "recepcionado",
+        "hora_recepcion": datetime.now(timezone_ar).strftime("%H:%M"),
+    })
+    if turno:
+        return jsonify({"mensaje": "Paciente recepcionado correctamente"})
     
     return jsonify({"error": "Turno no encontrado"}), 404
 
 @app.route("/api/turnos/sala-espera", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria", "administrador"])
+@bloquea(TURNOS_FILE, PAGOS_FILE)
 def mover_a_sala_espera():
     """Mover paciente recepcionado a sala de espera y registrar pago"""
     data = request.json
@@ -1174,18 +1428,8 @@ def mover_a_sala_espera():
     elif tipo_pago not in ["efectivo", "transferencia"]:
         return jsonify({"error": "Tipo de pago inválido. Debe ser 'efectivo' o 'transferencia'"}), 400
 
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-     
     # Buscar el turno
-    turno_encontrado = None
-
-    for turno in turnos:
-        if (turno["dni_paciente"] == dni_paciente and 
-            turno["fecha"] == fecha and 
-            turno["hora"] == hora):
-            turno_encontrado = turno
-            break
+    turno_encontrado = obtener(TURNOS_FILE, dni_paciente, fecha, hora)
      
     if not turno_encontrado:
         return jsonify({"error": "Turno no encontrado"}), 404
@@ -1195,21 +1439,20 @@ def mover_a_sala_espera():
         
     # Verificar que el paciente existe
 
-    paciente = next((p for p in pacientes if p["dni"] == dni_paciente), None)
+    paciente = buscar_uno(PACIENTES_FILE, dni=dni_paciente)
     if not paciente:
         return jsonify({"error": "Paciente no encontrado"}), 404
      
     # Verificar si ya existe un pago para este paciente en esta fecha y hora
-    pagos = cargar_json(PAGOS_FILE)
-    pago_existente = next((p for p in pagos if p["dni_paciente"] == dni_paciente and p["fecha"] == fecha and p.get("hora") == hora), None)
+    pago_existente = next((p for p in buscar(PAGOS_FILE, dni_paciente=dni_paciente, fecha=fecha)
+                           if p.get("hora") == hora), None)
     
     if pago_existente:
         return jsonify({"error": "Ya existe un pago registrado para este paciente en este turno"}), 400
     
-    
     # Registrar el pago
     nuevo_pago = {
-        "id": len(pagos) + 1,
+        "id": siguiente_id(PAGOS_FILE),
         "dni_paciente": dni_paciente,
         "nombre_paciente": f"{paciente.get('nombre', '')} {paciente.get('apellido', '')}".strip(),
         "monto": monto,
@@ -1221,15 +1464,14 @@ def mover_a_sala_espera():
         "tipo_pago": tipo_pago  # Agregar tipo de pago
     }
      
-    pagos.append(nuevo_pago)
-    guardar_json(PAGOS_FILE, pagos)
+    agregar(PAGOS_FILE, nuevo_pago)
     # Mover a sala de espera
-    turno_encontrado["estado"] = "sala de espera"
-    turno_encontrado["hora_sala_espera"] = datetime.now(timezone_ar).strftime("%H:%M")
-    turno_encontrado["pago_registrado"] = True
-    turno_encontrado["monto_pagado"] = monto
-     
-    guardar_json(TURNOS_FILE, turnos)
+    modificar(TURNOS_FILE, (dni_paciente, fecha, hora), {
+        "estado": "sala de espera",
+        "hora_sala_espera": datetime.now(timezone_ar).strftime("%H:%M"),
+        "pago_registrado": True,
+        "monto_pagado": monto,
+    })
 
     return jsonify({
         "mensaje": "Paciente movido a sala de espera y pago registrado",
@@ -1239,6 +1481,7 @@ def mover_a_sala_espera():
 @app.route("/api/pagos/cobrar-y-sala", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria"])
+@bloquea(TURNOS_FILE, PAGOS_FILE)
 def cobrar_y_mover_a_sala():
     """Cobrar a un paciente recepcionado y moverlo a sala de espera desde gestión de pagos"""
     data = request.json
@@ -1258,29 +1501,19 @@ def cobrar_y_mover_a_sala():
     except (ValueError, TypeError):
         return jsonify({"error": "Monto inválido"}), 400
     
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    
     # Buscar el turno recepcionado
-    turno_encontrado = None
-    for turno in turnos:
-        if (turno["dni_paciente"] == dni_paciente and 
-            turno["fecha"] == fecha and 
-            turno.get("estado") == "recepcionado"):
-            turno_encontrado = turno
-            break
+    turno_encontrado = buscar_uno(TURNOS_FILE, dni_paciente=dni_paciente, fecha=fecha, estado="recepcionado")
 
     if not turno_encontrado:
         return jsonify({"error": "No se encontró un turno recepcionado para este paciente en esta fecha"}), 404
     
     # Verificar que el paciente existe
-    paciente = next((p for p in pacientes if p["dni"] == dni_paciente), None)
+    paciente = buscar_uno(PACIENTES_FILE, dni=dni_paciente)
     if not paciente:
         return jsonify({"error": "Paciente no encontrado"}), 404
     
     # Verificar si ya existe un pago para este paciente en esta fecha
-    pagos = cargar_json(PAGOS_FILE)
-    pago_existente = next((p for p in pagos if p["dni_paciente"] == dni_paciente and p["fecha"] == fecha), None)
+    pago_existente = buscar_uno(PAGOS_FILE, dni_paciente=dni_paciente, fecha=fecha)
     
     if pago_existente:
         return jsonify({"error": "Ya existe un pago registrado para este paciente en esta fecha"}), 400
@@ -1293,7 +1526,7 @@ def cobrar_y_mover_a_sala():
     
     # Registrar el pago
     nuevo_pago = {
-        "id": len(pagos) + 1,
+        "id": siguiente_id(PAGOS_FILE),
         "dni_paciente": dni_paciente,
         "nombre_paciente": f"{paciente.get('nombre', '')} {paciente.get('apellido', '')}".strip(),
         "monto": monto,
@@ -1304,16 +1537,15 @@ def cobrar_y_mover_a_sala():
         "tipo_pago": tipo_pago
     }
     
-    pagos.append(nuevo_pago)
-    guardar_json(PAGOS_FILE, pagos)
+    agregar(PAGOS_FILE, nuevo_pago)
     
     # Mover a sala de espera
-    turno_encontrado["estado"] = "sala de espera"
-    turno_encontrado["hora_sala_espera"] = datetime.now(timezone_ar).strftime("%H:%M")
-    turno_encontrado["pago_registrado"] = True
-    turno_encontrado["monto_pagado"] = monto
-    
-    guardar_json(TURNOS_FILE, turnos)
+    modificar(TURNOS_FILE, (dni_paciente, fecha, turno_encontrado["hora"]), {
+        "estado": "sala de espera",
+        "hora_sala_espera": datetime.now(timezone_ar).strftime("%H:%M"),
+        "pago_registrado": True,
+        "monto_pagado": monto,
+    })
     return jsonify({
         "mensaje": "Pago registrado y paciente movido a sala de espera",
         "pago": nuevo_pago
@@ -1326,15 +1558,12 @@ def obtener_turnos_dia():
     """Obtener todos los turnos de una fecha específica (por defecto hoy)"""
     fecha = request.args.get("fecha", date.today().isoformat())
     
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    
-    turnos_dia = [t for t in turnos if t.get("fecha") == fecha]
+    turnos_dia = buscar(TURNOS_FILE, fecha=fecha)
     
     # Enriquecer con datos del paciente
+    pacientes = indice(PACIENTES_FILE, "dni")
     for turno in turnos_dia:
-        paciente = next((p for p in pacientes if p["dni"] == turno["dni_paciente"]), {})
-        turno["paciente"] = paciente
+        turno["paciente"] = pacientes.get(turno["dni_paciente"]) or {}
         if "estado" not in turno:
             turno["estado"] = "sin atender"
     
@@ -1346,6 +1575,7 @@ def obtener_turnos_dia():
 @app.route('/api/turnos/limpiar-vencidos', methods=['POST'])
 @login_requerido
 @rol_requerido('secretaria')
+@bloquea(TURNOS_FILE)
 def limpiar_turnos_vencidos():
     
     turnos = cargar_json(TURNOS_FILE)
@@ -1379,8 +1609,13 @@ def ver_historias_gestion():
 @login_requerido
 @rol_requerido("medico")
 def buscar_historias():
-    historias = cargar_json(DATA_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
+    """Pacientes con historia clínica: última consulta y cantidad, paginado.
+
+    Sale del resumen por DNI que se mantiene al escribir las historias
+    (resumen_historias), sin recorrer ni filtrar el texto de las consultas.
+    """
+    resumen = derivado(DATA_FILE, "resumen", resumen_historias).resumen()
+    pacientes = indice(PACIENTES_FILE, "dni")
     
     # Parámetros de búsqueda
     busqueda = request.args.get("busqueda", "").strip().lower()
@@ -1389,65 +1624,32 @@ def buscar_historias():
     ordenar_por = request.args.get("ordenar_por", "apellido")
     orden = request.args.get("orden", "asc")
     
-    # Enriquecer historias con datos del paciente
-    historias_enriquecidas = []
-    for historia in historias:
-        paciente = next((p for p in pacientes if p["dni"] == historia["dni"]), None)
-        if paciente:
-            historia_completa = historia.copy()
-            historia_completa["paciente"] = paciente
-            historias_enriquecidas.append(historia_completa)
-    
-    # Filtrar por búsqueda (apellido, nombre o DNI)
+    # Filtrar por búsqueda (apellido, nombre o DNI) con el índice de pacientes
     if busqueda:
-        historias_filtradas = []
-        for h in historias_enriquecidas:
-            paciente = h["paciente"]
-            apellido = paciente.get("apellido", "").lower()
-            nombre = paciente.get("nombre", "").lower()
-            dni = paciente.get("dni", "").lower()
-            
-            if (busqueda in apellido or 
-                busqueda in nombre or 
-                busqueda in dni):
-                historias_filtradas.append(h)
-        historias_enriquecidas = historias_filtradas
-    
-    # Agrupar por paciente y obtener la última consulta de cada uno
-    pacientes_unicos = {}
-    for h in historias_enriquecidas:
-        dni = h["dni"]
-        if dni not in pacientes_unicos:
-            pacientes_unicos[dni] = {
-                "paciente": h["paciente"],
-                "ultima_consulta": h["fecha_consulta"],
-                "total_consultas": 1,
-                "ultima_historia": h
-            }
-        else:
-            pacientes_unicos[dni]["total_consultas"] += 1
-            # Comparar fechas para encontrar la más reciente
-            if h["fecha_consulta"] > pacientes_unicos[dni]["ultima_consulta"]:
-                pacientes_unicos[dni]["ultima_consulta"] = h["fecha_consulta"]
-                pacientes_unicos[dni]["ultima_historia"] = h
-    
-    # Convertir a lista para ordenamiento
-    lista_pacientes = list(pacientes_unicos.values())
+        coinciden = derivado(PACIENTES_FILE, "busqueda", indice_busqueda_pacientes).claves(busqueda)
+        resumen = [r for r in resumen if r[0] in coinciden]
+    
+    # Solo los que siguen registrados como pacientes
+    lista_pacientes = [
+        {"paciente": pacientes[dni], "ultima_consulta": ultima.get("fecha_consulta", ""),
+         "total_consultas": cantidad, "ultima_historia": ultima}
+        for dni, cantidad, ultima in resumen if dni in pacientes
+    ]
     
-    # Ordenar
+    # Ordenar (a igual valor, por DNI)
     if ordenar_por == "apellido":
         lista_pacientes.sort(
-            key=lambda x: x["paciente"].get("apellido", "").lower(),
+            key=lambda x: (x["paciente"].get("apellido", "").lower(), x["paciente"]["dni"]),
             reverse=(orden == "desc")
         )
     elif ordenar_por == "nombre":
         lista_pacientes.sort(
-            key=lambda x: x["paciente"].get("nombre", "").lower(),
+            key=lambda x: (x["paciente"].get("nombre", "").lower(), x["paciente"]["dni"]),
             reverse=(orden == "desc")
         )
     elif ordenar_por == "fecha":
         lista_pacientes.sort(
-            key=lambda x: x["ultima_consulta"],
+            key=lambda x: (x["ultima_consulta"], x["paciente"]["dni"]),
             reverse=(orden == "desc")
         )
     elif ordenar_por == "dni":
@@ -1461,6 +1663,9 @@ def buscar_historias():
     inicio = (pagina - 1) * por_pagina
     fin = inicio + por_pagina
     pacientes_pagina = lista_pacientes[inicio:fin]
+    # La última historia va con los datos del paciente, como la carga el listado
+    for p in pacientes_pagina:
+        p["ultima_historia"] = dict(p["ultima_historia"], paciente=p["paciente"])
     
     total_paginas = (total + por_pagina - 1) // por_pagina
     
@@ -1485,54 +1690,38 @@ def vista_administrador():
 @app.route("/api/pagos/estadisticas-admin", methods=["GET"])
 @login_requerido
 @rol_requerido("administrador")
+@reporte_cacheado(PAGOS_FILE, PACIENTES_FILE)
 def obtener_estadisticas_pagos_admin():
     """Obtener estadísticas de pagos para administradores"""
     mes = request.args.get("mes")
     if not mes:
         mes = datetime.now().strftime("%Y-%m")
     
-    pagos = cargar_json(PAGOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    
-    # Filtrar pagos del mes
-    pagos_mes = [p for p in pagos if p.get("fecha", "").startswith(mes)]
+    # Totales del mes por día y tipo de pago (ver totales_pagos)
+    totales_mes = totales_pagos(mes, mes + "\uffff")
     
     # Calcular estadísticas generales
-    total_mes = sum(p.get("monto", 0) for p in pagos_mes)
-    pagos_particulares = len([p for p in pagos_mes if p.get("monto", 0) > 0])
-    pagos_obra_social = len([p for p in pagos_mes if p.get("monto", 0) == 0])
-    cantidad_pagos_mes = len(pagos_mes)
+    cantidad_pagos_mes, total_mes, pagos_obra_social = sumar_totales(totales_mes)
+    pagos_particulares = cantidad_pagos_mes - pagos_obra_social
     
     # Estadísticas por tipo de pago
-    pagos_efectivo = [p for p in pagos_mes if p.get("tipo_pago") == "efectivo"]
-    pagos_transferencia = [p for p in pagos_mes if p.get("tipo_pago") == "transferencia"]
-    pagos_obra_social_list = [p for p in pagos_mes if p.get("tipo_pago") == "obra_social"]
-    
-    total_efectivo = sum(p.get("monto", 0) for p in pagos_efectivo)
-    total_transferencia = sum(p.get("monto", 0) for p in pagos_transferencia)
-    total_obra_social = sum(p.get("monto", 0) for p in pagos_obra_social_list)
+    efectivo = sumar_totales(totales_mes, "efectivo")
+    transferencia = sumar_totales(totales_mes, "transferencia")
+    obra_social = sumar_totales(totales_mes, "obra_social")
     
     
     # Agrupar por día
-    detalle_por_dia = {}
-    for pago in pagos_mes:
-        fecha = pago.get("fecha")
-        if fecha not in detalle_por_dia:
-            detalle_por_dia[fecha] = {
-                "cantidad": 0,
-                "monto": 0,
-                "pacientes": []
-            }
-        detalle_por_dia[fecha]["cantidad"] += 1
-        detalle_por_dia[fecha]["monto"] += pago.get("monto", 0)
-        
-        # Buscar datos del paciente
-        paciente = next((p for p in pacientes if p["dni"] == pago.get("dni_paciente")), {})
-        detalle_por_dia[fecha]["pacientes"].append({
+    pacientes = indice(PACIENTES_FILE, "dni")
+
+    def describir(pago):
+        paciente = pacientes.get(pago.get("dni_paciente")) or {}
+        return {
             "nombre": f"{paciente.get('nombre', '')} {paciente.get('apellido', '')}".strip(),
             "monto": pago.get("monto", 0),
             "tipo_pago": pago.get("tipo_pago", "efectivo")
-        })
+        }
+
+    detalle_por_dia = detalle_pagos_por_dia(totales_mes, cargar_prefijo(PAGOS_FILE, mes), describir)
     
     return jsonify({
         "total_mes": total_mes,
@@ -1541,12 +1730,12 @@ def obtener_estadisticas_pagos_admin():
         "cantidad_pagos_mes": cantidad_pagos_mes,
         "detalle_por_dia": detalle_por_dia,
         # Nuevas estadísticas por tipo de pago
-        "pagos_efectivo": len(pagos_efectivo),
-        "pagos_transferencia": len(pagos_transferencia),
-        "pagos_obra_social_count": len(pagos_obra_social_list),
-        "total_efectivo": total_efectivo,
-        "total_transferencia": total_transferencia,
-        "total_obra_social": total_obra_social
+        "pagos_efectivo": efectivo[0],
+        "pagos_transferencia": transferencia[0],
+        "pagos_obra_social_count": obra_social[0],
+        "total_efectivo": efectivo[1],
+        "total_transferencia": transferencia[1],
+        "total_obra_social": obra_social[1]
     })
 
 @app.route("/api/pagos/exportar-admin", methods=["GET"])
@@ -1555,12 +1744,8 @@ def obtener_estadisticas_pagos_admin():
 def exportar_pagos_csv_admin():
     """Exportar pagos a CSV para administradores"""
     
-    pagos = cargar_json(PAGOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    
     fecha_param = request.args.get("fecha")
     mes = request.args.get("mes")
-    pagos_filtrados = pagos
     nombre_archivo = "pagos"
     
     if fecha_param:
@@ -1568,14 +1753,14 @@ def exportar_pagos_csv_admin():
             fecha_dia = datetime.strptime(fecha_param, "%Y-%m-%d").date()
         except ValueError:
             fecha_dia = date.today()
-        pagos_filtrados = [p for p in pagos if p.get("fecha", "") == fecha_dia.isoformat()]
+        pagos_filtrados = buscar(PAGOS_FILE, fecha=fecha_dia.isoformat())
         nombre_archivo += f"_{fecha_dia.isoformat()}"
     elif mes:
-        pagos_filtrados = [p for p in pagos if p.get("fecha", "").startswith(mes)]
+        pagos_filtrados = cargar_prefijo(PAGOS_FILE, mes)
         nombre_archivo += f"_{mes}"
     else:
         mes_actual = datetime.now().strftime("%Y-%m")
-        pagos_filtrados = [p for p in pagos if p.get("fecha", "").startswith(mes_actual)]
+        pagos_filtrados = cargar_prefijo(PAGOS_FILE, mes_actual)
         nombre_archivo += f"_{mes_actual}"
     
     # Calcular subtotales si es por día
@@ -1590,8 +1775,9 @@ def exportar_pagos_csv_admin():
     writer = csv.writer(output)
     writer.writerow(['Fecha', 'DNI', 'Nombre', 'Apellido', 'Monto', 'Tipo de Pago', 'Obra Social', 'Observaciones'])
     
+    pacientes = indice(PACIENTES_FILE, "dni")
     for pago in pagos_filtrados:
-        paciente = next((p for p in pacientes if p["dni"] == pago.get("dni_paciente")), {})
+        paciente = pacientes.get(pago.get("dni_paciente")) or {}
         writer.writerow([
             pago.get("fecha", ""),
             pago.get("dni_paciente", ""),
@@ -1647,34 +1833,26 @@ def generar_reporte_personalizado():
     if fecha_inicio_dt > fecha_fin_dt:
         return jsonify({"error": "La fecha de inicio no puede ser mayor que la fecha de fin"}), 400
     
-    # Cargar datos
-    turnos = cargar_json(TURNOS_FILE)
-    pacientes = cargar_json(PACIENTES_FILE)
-    pagos = cargar_json(PAGOS_FILE)
+    # Turnos atendidos del período (y del médico, si se filtra), con máscaras
+    # sobre las columnas de cada mes
+    desde, hasta = fecha_inicio_dt.isoformat(), fecha_fin_dt.isoformat()
+    filtros = {"medico": medico} if medico else {}
+    turnos = [turno for tabla in tablas_turnos(desde, hasta)
+              for turno in tabla.filas(desde, hasta, estado="atendido", **filtros)]
     
-    # Filtrar turnos por fecha
-    turnos_filtrados = []
-    for turno in turnos:
-        try:
-            fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-            if fecha_inicio_dt <= fecha_turno <= fecha_fin_dt:
-                turnos_filtrados.append(turno)
-        except (ValueError, TypeError):
-            continue
+    # Índice de pacientes por DNI para búsqueda rápida
+    pacientes_dict = indice(PACIENTES_FILE, "dni")
     
-    # Aplicar filtros adicionales
-    if medico:
-        turnos_filtrados = [t for t in turnos_filtrados if t.get("medico") == medico]
-    
-    # Crear diccionario de pacientes para búsqueda rápida
-    pacientes_dict = {p["dni"]: p for p in pacientes}
+    # Primer pago de cada paciente y fecha del período, leídos de una vez
+    pagos = {}
+    for pago in cargar_rango(PAGOS_FILE, desde, hasta):
+        pagos.setdefault((pago.get("dni_paciente"), pago.get("fecha")), pago)
     
     # Procesar datos del reporte
     reporte_data = []
-    pacientes_unicos = set()
-    pacientes_atendidos = set()
+    pasada = Pasada({"consultas": lambda fila: 1}, {"dni": lambda fila: fila["dni"]})
     
-    for turno in turnos_filtrados:
+    for turno in turnos:
         dni_paciente = turno.get("dni_paciente")
         paciente = pacientes_dict.get(dni_paciente)
         
@@ -1685,22 +1863,9 @@ def generar_reporte_personalizado():
         if obra_social and paciente.get("obra_social", "").lower().strip() != obra_social.lower().strip():
             continue
         
-        # Solo incluir pacientes que fueron atendidos
-        if turno.get("estado") != "atendido":
-            continue
-        
-        # Agregar a pacientes únicos (solo atendidos)
-        pacientes_unicos.add(dni_paciente)
-        
-        # Agregar a pacientes atendidos
-        pacientes_atendidos.add(dni_paciente)
-        
-        # Buscar pago correspondiente
-        pago = next((p for p in pagos if 
-                    p.get("dni_paciente") == dni_paciente and 
-                    p.get("fecha") == turno.get("fecha")), None)
+        pago = pagos.get((dni_paciente, turno.get("fecha")))
         
-        reporte_data.append({
+        fila = {
             "dni": dni_paciente,
             "nombre": paciente.get("nombre", ""),
             "apellido": paciente.get("apellido", ""),
@@ -1712,11 +1877,13 @@ def generar_reporte_personalizado():
             "estado": turno.get("estado", "sin atender"),
             "monto_pagado": pago.get("monto", 0) if pago else 0,
             "tipo_pago": pago.get("tipo_pago", "obra_social") if pago else "obra_social"
-        })
+        }
+        reporte_data.append(fila)
+        pasada.agregar(fila)
     
-    # Estadísticas
-    total_pacientes = len(pacientes_unicos)
-    total_atendidos = len(pacientes_atendidos)
+    # Estadísticas (todos los turnos del reporte son atendidos)
+    total_pacientes = len(pasada.por["dni"])
+    total_atendidos = total_pacientes
     
     # Ordenar por fecha y hora
     reporte_data.sort(key=lambda x: (x["fecha_turno"], x["hora_turno"]))
@@ -1860,95 +2027,16 @@ def obtener_reporte_turnos():
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
     
-    # Cargar datos
-    turnos = cargar_json(TURNOS_FILE)
-    
-    # Filtrar turnos por fecha
-    turnos_filtrados = []
-    for turno in turnos:
-        try:
-            fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-            if fecha_inicio_dt <= fecha_turno <= fecha_fin_dt:
-                turnos_filtrados.append(turno)
-        except (ValueError, TypeError):
-            continue
-    
-    # Aplicar filtro de médico si se especifica
-    if medico:
-        turnos_filtrados = [t for t in turnos_filtrados if t.get("medico") == medico]
-    
-    # Calcular estadísticas (considerando turnos vencidos como ausentes)
-    total_turnos = len(turnos_filtrados)
-    turnos_atendidos = len([t for t in turnos_filtrados if t.get("estado") == "atendido"])
-    
-    # Contar ausentes reales + turnos vencidos (más de 24 horas sin atender)
-    turnos_ausentes_reales = len([t for t in turnos_filtrados if t.get("estado") == "ausente"])
-    turnos_vencidos = 0
-    ahora = datetime.now()
-    
-    for turno in turnos_filtrados:
-        if turno.get("estado") in ["sin atender", "recepcionado", "sala de espera"]:
-            try:
-                fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-                hora_turno = turno.get("hora", "00:00")
-                fecha_hora_turno = datetime.combine(fecha_turno, datetime.strptime(hora_turno, "%H:%M").time())
-                
-                # Si el turno pasó hace más de 24 horas y no fue atendido, considerarlo ausente
-                if (ahora - fecha_hora_turno).total_seconds() > 24 * 3600:
-                    turnos_vencidos += 1
-            except (ValueError, TypeError):
-                continue
-    
-    turnos_ausentes = turnos_ausentes_reales + turnos_vencidos
-    turnos_pendientes = len([t for t in turnos_filtrados if t.get("estado") in ["sin atender", "recepcionado", "sala de espera"]]) - turnos_vencidos
-    
-    # Estadísticas por médico (considerando turnos vencidos)
-    stats_por_medico = {}
-    for turno in turnos_filtrados:
-        medico_nombre = turno.get("medico", "Sin médico")
-        if medico_nombre not in stats_por_medico:
-            stats_por_medico[medico_nombre] = {"total": 0, "atendidos": 0, "ausentes": 0}
-        
-        stats_por_medico[medico_nombre]["total"] += 1
-        if turno.get("estado") == "atendido":
-            stats_por_medico[medico_nombre]["atendidos"] += 1
-        elif turno.get("estado") == "ausente":
-            stats_por_medico[medico_nombre]["ausentes"] += 1
-        elif turno.get("estado") in ["sin atender", "recepcionado", "sala de espera"]:
-            # Verificar si el turno está vencido (más de 24 horas)
-            try:
-                fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-                hora_turno = turno.get("hora", "00:00")
-                fecha_hora_turno = datetime.combine(fecha_turno, datetime.strptime(hora_turno, "%H:%M").time())
-                
-                if (ahora - fecha_hora_turno).total_seconds() > 24 * 3600:
-                    stats_por_medico[medico_nombre]["ausentes"] += 1
-            except (ValueError, TypeError):
-                pass
-    
-    # Estadísticas por día (considerando turnos vencidos)
-    stats_por_dia = {}
-    for turno in turnos_filtrados:
-        fecha = turno.get("fecha", "")
-        if fecha not in stats_por_dia:
-            stats_por_dia[fecha] = {"total": 0, "atendidos": 0, "ausentes": 0}
-        
-        stats_por_dia[fecha]["total"] += 1
-        if turno.get("estado") == "atendido":
-            stats_por_dia[fecha]["atendidos"] += 1
-        elif turno.get("estado") == "ausente":
-            stats_por_dia[fecha]["ausentes"] += 1
-        elif turno.get("estado") in ["sin atender", "recepcionado", "sala de espera"]:
-            # Verificar si el turno está vencido (más de 24 horas)
-            try:
-                fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-                hora_turno = turno.get("hora", "00:00")
-                fecha_hora_turno = datetime.combine(fecha_turno, datetime.strptime(hora_turno, "%H:%M").time())
-                
-                if (ahora - fecha_hora_turno).total_seconds() > 24 * 3600:
-                    stats_por_dia[fecha]["ausentes"] += 1
-            except (ValueError, TypeError):
-                pass
+    # Conteos del período (considerando turnos vencidos como ausentes)
+    stats = estadisticas_turnos(fecha_inicio_dt.isoformat(), fecha_fin_dt.isoformat(), medico)
+    total_turnos = stats["total"]
+    turnos_atendidos = stats["atendidos"]
+    turnos_ausentes_reales = stats["ausentes_reales"]
+    turnos_vencidos = stats["vencidos"]
+    turnos_ausentes = stats["ausentes"]
+    turnos_pendientes = stats["pendientes"]
+    stats_por_medico = stats["por_medico"]
+    stats_por_dia = stats["por_dia"]
     
     # Calcular porcentajes
     porcentaje_atencion = round((turnos_atendidos / total_turnos * 100) if total_turnos > 0 else 0, 1)
@@ -1973,68 +2061,34 @@ def obtener_reporte_turnos():
 @app.route("/api/reportes/pacientes", methods=["GET"])
 @login_requerido
 @rol_requerido("administrador")
+@reporte_cacheado(PACIENTES_FILE, TURNOS_FILE)
 def obtener_reporte_pacientes():
     """Obtener reporte de pacientes"""
-    pacientes = cargar_json(PACIENTES_FILE)
-    turnos = cargar_json(TURNOS_FILE)
+    # Una pasada por los pacientes; los turnos por DNI salen de sus columnas
+    pacientes = pasada_pacientes()
+    cantidades_por_dni = turnos_por_dni()
     
     # Estadísticas básicas
-    total_pacientes = len(pacientes)
+    total_pacientes = pacientes.totales["pacientes"]
     
     # Pacientes con turnos
-    dnis_con_turnos = set(t.get("dni_paciente") for t in turnos)
-    pacientes_sin_turnos = total_pacientes - len(dnis_con_turnos)
+    pacientes_sin_turnos = total_pacientes - len(cantidades_por_dni)
     
     # Estadísticas por obra social (normalizadas)
-    obras_sociales = {}
-    for paciente in pacientes:
-        obra_social = paciente.get("obra_social", "Sin obra social")
-        if obra_social == "0" or not obra_social:
-            obra_social = "Particular"
-        else:
-            # Normalizar: primera letra mayúscula, resto minúsculas
-            obra_social = obra_social.capitalize()
-        obras_sociales[obra_social] = obras_sociales.get(obra_social, 0) + 1
+    obras_sociales = {obra_social: sumas["pacientes"] for obra_social, sumas in pacientes.por["obra_social"].items()}
     
     # Estadísticas por edad
-    edades = []
-    rangos_edad = {
-        "0-18": 0,
-        "19-30": 0,
-        "31-50": 0,
-        "51-65": 0,
-        "65+": 0
-    }
-    
-    for paciente in pacientes:
-        # Calcular edad dinámicamente
-        if paciente.get("fecha_nacimiento"):
-            edad = calcular_edad(paciente["fecha_nacimiento"])
-            if edad:
-                edades.append(edad)
-                if edad <= 18:
-                    rangos_edad["0-18"] += 1
-                elif edad <= 30:
-                    rangos_edad["19-30"] += 1
-                elif edad <= 50:
-                    rangos_edad["31-50"] += 1
-                elif edad <= 65:
-                    rangos_edad["51-65"] += 1
-                else:
-                    rangos_edad["65+"] += 1
-    
-    edad_promedio = round(sum(edades) / len(edades), 1) if edades else 0
+    rangos_edad = {rango: 0 for rango, _ in RANGOS_EDAD}
+    for rango, sumas in pacientes.por["rango_edad"].items():
+        rangos_edad[rango] = sumas["pacientes"]
+    con_edad = pacientes.totales["con_edad"]
+    edad_promedio = round(pacientes.totales["suma_edades"] / con_edad, 1) if con_edad else 0
     
     # Pacientes más activos (por número de turnos)
-    turnos_por_paciente = {}
-    for turno in turnos:
-        dni = turno.get("dni_paciente")
-        if dni:
-            turnos_por_paciente[dni] = turnos_por_paciente.get(dni, 0) + 1
-    
+    pacientes_por_dni = indice(PACIENTES_FILE, "dni")
     pacientes_activos = []
-    for dni, cantidad_turnos in sorted(turnos_por_paciente.items(), key=lambda x: x[1], reverse=True)[:10]:
-        paciente = next((p for p in pacientes if p.get("dni") == dni), None)
+    for dni, cantidad_turnos in sorted(cantidades_por_dni.items(), key=lambda x: x[1], reverse=True)[:10]:
+        paciente = pacientes_por_dni.get(dni)
         if paciente:
             pacientes_activos.append({
                 "nombre": f"{paciente.get('nombre', '')} {paciente.get('apellido', '')}".strip(),
@@ -2055,6 +2109,7 @@ def obtener_reporte_pacientes():
 @app.route("/api/reportes/ocupacion", methods=["GET"])
 @login_requerido
 @rol_requerido("administrador")
+@reporte_cacheado(TURNOS_FILE, AGENDA_FILE)
 def obtener_reporte_ocupacion():
     """Obtener reporte de ocupación de agenda"""
     fecha_inicio = request.args.get("fecha_inicio")
@@ -2071,37 +2126,20 @@ def obtener_reporte_ocupacion():
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
     
-    # Cargar datos
-    turnos = cargar_json(TURNOS_FILE)
-    agenda = cargar_json(AGENDA_FILE)
-    
-    # Filtrar turnos por fecha
-    turnos_filtrados = []
-    for turno in turnos:
-        try:
-            fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-            if fecha_inicio_dt <= fecha_turno <= fecha_fin_dt:
-                turnos_filtrados.append(turno)
-        except (ValueError, TypeError):
-            continue
+    # Turnos del período por médico y por día, de los conteos de turnos
+    agenda = agenda_compilada()
+    pasada = Pasada({"turnos": lambda f: f[1]}, {"medico": lambda f: f[0][0], "fecha": lambda f: f[0][1]}).recorrer(
+        conteo_turnos(fecha_inicio_dt.isoformat(), fecha_fin_dt.isoformat()).items())
     
     # Calcular ocupación por médico
     ocupacion_por_medico = {}
     total_slots_disponibles = 0
     total_slots_ocupados = 0
     
-    for medico, horarios_medico in agenda.items():
-        slots_disponibles = 0
-        slots_ocupados = 0
-        
-        # Contar slots disponibles en la agenda
-        for dia, horarios in horarios_medico.items():
-            if isinstance(horarios, list):
-                slots_disponibles += len(horarios)
-        
-        # Contar slots ocupados por turnos
-        turnos_medico = [t for t in turnos_filtrados if t.get("medico") == medico]
-        slots_ocupados = len(turnos_medico)
+    for medico in agenda.mapas:
+        # Slots disponibles en la agenda y ocupados por turnos
+        slots_disponibles = agenda.cantidad(medico=medico)
+        slots_ocupados = pasada.por["medico"].get(medico, {}).get("turnos", 0)
         
         porcentaje_ocupacion = round((slots_ocupados / slots_disponibles * 100) if slots_disponibles > 0 else 0, 1)
         
@@ -2115,39 +2153,14 @@ def obtener_reporte_ocupacion():
         total_slots_ocupados += slots_ocupados
     
     # Calcular ocupación por día
-    ocupacion_por_dia = {}
-    for turno in turnos_filtrados:
-        fecha = turno.get("fecha", "")
-        if fecha not in ocupacion_por_dia:
-            ocupacion_por_dia[fecha] = {"slots_disponibles": 0, "slots_ocupados": 0}
-        ocupacion_por_dia[fecha]["slots_ocupados"] += 1
-    
-    # Calcular slots disponibles por día (aproximado)
-    dias_semana = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES"]
+    ocupacion_por_dia = {fecha: {"slots_disponibles": 0, "slots_ocupados": sumas["turnos"]}
+                         for fecha, sumas in sorted(pasada.por["fecha"].items())}
+    
+    # Calcular slots disponibles por día (los de la agenda de ese día de la semana)
     for fecha_str in ocupacion_por_dia.keys():
         try:
-            fecha_obj = datetime.strptime(fecha_str, "%Y-%m-%d").date()
-            dia_semana = fecha_obj.strftime("%A").upper()
-            if dia_semana == "MONDAY":
-                dia_es = "LUNES"
-            elif dia_semana == "TUESDAY":
-                dia_es = "MARTES"
-            elif dia_semana == "WEDNESDAY":
-                dia_es = "MIERCOLES"
-            elif dia_semana == "THURSDAY":
-                dia_es = "JUEVES"
-            elif dia_semana == "FRIDAY":
-                dia_es = "VIERNES"
-            else:
-                dia_es = None
-            
-            if dia_es:
-                slots_dia = 0
-                for medico, horarios_medico in agenda.items():
-                    if dia_es in horarios_medico and isinstance(horarios_medico[dia_es], list):
-                        slots_dia += len(horarios_medico[dia_es])
-                ocupacion_por_dia[fecha_str]["slots_disponibles"] = slots_dia
-        except:
+            ocupacion_por_dia[fecha_str]["slots_disponibles"] = agenda.cantidad(dia=dia_agenda(fecha_str))
+        except ValueError:
             pass
     
     # Calcular porcentajes de ocupación por día
@@ -2171,58 +2184,38 @@ def obtener_reporte_ocupacion():
 @app.route("/api/reportes/dashboard-ejecutivo", methods=["GET"])
 @login_requerido
 @rol_requerido("administrador")
+@reporte_cacheado(PACIENTES_FILE, TURNOS_FILE, AGENDA_FILE, PAGOS_FILE, vigencia=60)
 def obtener_dashboard_ejecutivo():
     """Obtener dashboard ejecutivo con métricas clave"""
-    # Obtener datos de múltiples fuentes
-    pacientes = cargar_json(PACIENTES_FILE)
-    turnos = cargar_json(TURNOS_FILE)
-    pagos = cargar_json(PAGOS_FILE)
-    agenda = cargar_json(AGENDA_FILE)
+    # Una pasada por los pacientes; los turnos por DNI salen de sus columnas
+    pacientes = pasada_pacientes()
+    cantidades_por_dni = turnos_por_dni()
     
     # Fecha actual para cálculos
     hoy = date.today()
     mes_actual = hoy.strftime("%Y-%m")
     
     # === MÉTRICAS DE PACIENTES ===
-    total_pacientes = len(pacientes)
+    total_pacientes = pacientes.totales["pacientes"]
     
     # Pacientes con turnos
-    dnis_con_turnos = set(t.get("dni_paciente") for t in turnos)
-    pacientes_activos = len(dnis_con_turnos)
+    pacientes_activos = len(cantidades_por_dni)
     pacientes_sin_turnos = total_pacientes - pacientes_activos
     
     # Edad promedio (calculada dinámicamente)
-    edades = []
-    for p in pacientes:
-        if p.get("fecha_nacimiento"):
-            edad = calcular_edad(p["fecha_nacimiento"])
-            if edad and edad > 0:
-                edades.append(edad)
-    edad_promedio = round(sum(edades) / len(edades), 1) if edades else 0
+    con_edad = pacientes.totales["con_edad"]
+    edad_promedio = round(pacientes.totales["suma_edades"] / con_edad, 1) if con_edad else 0
     
     # === MÉTRICAS DE TURNOS DEL MES ===
-    turnos_mes = [t for t in turnos if t.get("fecha", "").startswith(mes_actual)]
-    total_turnos_mes = len(turnos_mes)
-    turnos_atendidos_mes = len([t for t in turnos_mes if t.get("estado") == "atendido"])
+    stats_mes = estadisticas_turnos(mes_actual, mes_actual + "\uffff")
+    total_turnos_mes = stats_mes["total"]
+    turnos_atendidos_mes = stats_mes["atendidos"]
     
-    # Calcular turnos vencidos como ausentes
-    turnos_ausentes_reales = len([t for t in turnos_mes if t.get("estado") == "ausente"])
-    turnos_vencidos = 0
-    ahora = datetime.now()
+    # Turnos vencidos cuentan como ausentes
+    turnos_ausentes_reales = stats_mes["ausentes_reales"]
+    turnos_vencidos = stats_mes["vencidos"]
     
-    for turno in turnos_mes:
-        if turno.get("estado") in ["sin atender", "recepcionado", "sala de espera"]:
-            try:
-                fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-                hora_turno = turno.get("hora", "00:00")
-                fecha_hora_turno = datetime.combine(fecha_turno, datetime.strptime(hora_turno, "%H:%M").time())
-                
-                if (ahora - fecha_hora_turno).total_seconds() > 24 * 3600:
-                    turnos_vencidos += 1
-            except (ValueError, TypeError):
-                continue
-    
-    turnos_ausentes_mes = turnos_ausentes_reales + turnos_vencidos
+    turnos_ausentes_mes = stats_mes["ausentes"]
     porcentaje_atencion = round((turnos_atendidos_mes / total_turnos_mes * 100) if total_turnos_mes > 0 else 0, 1)
     
     # === MÉTRICAS DE OCUPACIÓN ===
@@ -2230,46 +2223,18 @@ def obtener_dashboard_ejecutivo():
     fecha_fin_ocupacion = hoy.isoformat()
     fecha_inicio_ocupacion = (hoy - timedelta(days=7)).isoformat()
     
-    turnos_ocupacion = [t for t in turnos if fecha_inicio_ocupacion <= t.get("fecha", "") <= fecha_fin_ocupacion]
-    
-    total_slots_disponibles = 0
-    total_slots_ocupados = len(turnos_ocupacion)
-    
-    for medico, horarios_medico in agenda.items():
-        for dia, horarios in horarios_medico.items():
-            if isinstance(horarios, list):
-                total_slots_disponibles += len(horarios)
+    total_slots_disponibles = agenda_compilada().cantidad()
+    total_slots_ocupados = sum(conteo_turnos(fecha_inicio_ocupacion, fecha_fin_ocupacion).values())
     
     ocupacion_promedio = round((total_slots_ocupados / total_slots_disponibles * 100) if total_slots_disponibles > 0 else 0, 1)
     
     # === MÉTRICAS DE INGRESOS ===
-    pagos_mes = [p for p in pagos if p.get("fecha", "").startswith(mes_actual)]
+    pagos_mes = cargar_prefijo(PAGOS_FILE, mes_actual)
     total_ingresos_mes = sum(p.get("monto", 0) for p in pagos_mes)
     cantidad_pagos_mes = len(pagos_mes)
     
     # === ESTADÍSTICAS POR MÉDICO ===
-    stats_por_medico = {}
-    for turno in turnos_mes:
-        medico_nombre = turno.get("medico", "Sin médico")
-        if medico_nombre not in stats_por_medico:
-            stats_por_medico[medico_nombre] = {"total": 0, "atendidos": 0, "ausentes": 0}
-        
-        stats_por_medico[medico_nombre]["total"] += 1
-        if turno.get("estado") == "atendido":
-            stats_por_medico[medico_nombre]["atendidos"] += 1
-        elif turno.get("estado") == "ausente":
-            stats_por_medico[medico_nombre]["ausentes"] += 1
-        elif turno.get("estado") in ["sin atender", "recepcionado", "sala de espera"]:
-            # Verificar si el turno está vencido
-            try:
-                fecha_turno = datetime.strptime(turno.get("fecha", ""), "%Y-%m-%d").date()
-                hora_turno = turno.get("hora", "00:00")
-                fecha_hora_turno = datetime.combine(fecha_turno, datetime.strptime(hora_turno, "%H:%M").time())
-                
-                if (ahora - fecha_hora_turno).total_seconds() > 24 * 3600:
-                    stats_por_medico[medico_nombre]["ausentes"] += 1
-            except (ValueError, TypeError):
-                pass
+    stats_por_medico = stats_mes["por_medico"]
     
     # Calcular eficiencia por médico
     medicos_eficiencia = {}
@@ -2282,14 +2247,7 @@ def obtener_dashboard_ejecutivo():
         }
     
     # === DISTRIBUCIÓN POR OBRA SOCIAL ===
-    obras_sociales = {}
-    for paciente in pacientes:
-        obra_social = paciente.get("obra_social", "Sin obra social")
-        if obra_social == "0" or not obra_social:
-            obra_social = "Particular"
-        else:
-            obra_social = obra_social.capitalize()
-        obras_sociales[obra_social] = obras_sociales.get(obra_social, 0) + 1
+    obras_sociales = {obra_social: sumas["pacientes"] for obra_social, sumas in pacientes.por["obra_social"].items()}
     
     return jsonify({
         "fecha_consulta": hoy.isoformat(),
@@ -2339,8 +2297,8 @@ def generar_reporte_ingresos_anual():
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
     
-    # Cargar datos
-    pagos = cargar_json(PAGOS_FILE)
+    # Cargar datos del período
+    pagos = cargar_rango(PAGOS_FILE, fecha_inicio_dt.isoformat(), fecha_fin_dt.isoformat())
     pacientes = cargar_json(PACIENTES_FILE)
     
     # Filtrar pagos por fecha
@@ -2455,11 +2413,9 @@ def obtener_ingresos_anual_data():
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido"}), 400
     
-    try:
-        with open(PAGOS_FILE, 'r', encoding='utf-8') as f:
-            pagos = json.load(f)
-    except FileNotFoundError:
+    if not os.path.exists(PAGOS_FILE):
         return jsonify({"error": "Archivo de pagos no encontrado"}), 404
+    pagos = cargar_rango(PAGOS_FILE, fecha_inicio_dt.isoformat(), fecha_fin_dt.isoformat())
     
     # Filtrar pagos por rango de fechas
     pagos_filtrados = []
@@ -2497,4 +2453,7 @@ def obtener_ingresos_anual_data():
 
 
 if __name__ == "__main__":
+    # Con gunicorn los respaldos los arranca gunicorn.conf.py, en un solo proceso
+    if RESPALDO_MINUTOS > 0:
+        iniciar_respaldos(RESPALDOS_DIR, DATASETS, RESPALDO_MINUTOS * 60, conservar=RESPALDOS_CONSERVAR)
     app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
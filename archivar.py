@@ -0,0 +1,46 @@
+"""Pasa los turnos y pagos de meses viejos al archivo comprimido.
+
+Los meses anteriores al horizonte salen de las particiones activas (y de
+cargar_json) y quedan en "turnos/archivo/AAAA-MM.json.gz"; los reportes por
+rango de fechas los siguen leyendo. Con ALMACENAMIENTO=sqlite no hace nada.
+
+Lo archivado ya no se modifica, así que un mes de turnos se archiva solo si
+todos sus turnos están cerrados (atendido o ausente); si queda alguno sin
+cerrar, el mes sigue activo y se avisa cuántos. Los pagos no tienen estado.
+
+    python archivar.py [meses]   (por defecto ARCHIVO_MESES o 24)
+
+ARCHIVO_COMPRESION=lzma comprime con lzma (.xz) en lugar de gzip.
+"""
+import os
+import sys
+from datetime import date
+
+from almacenamiento import archivar
+from config import TURNOS_FILE, PAGOS_FILE, configurar_almacenamiento
+
+configurar_almacenamiento()
+
+# Estados finales de un turno: después de estos ya no cambia
+ESTADOS_CERRADOS = ("atendido", "ausente")
+
+meses = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get("ARCHIVO_MESES", "24"))
+compresion = os.environ.get("ARCHIVO_COMPRESION", "gzip")
+
+hoy = date.today()
+total = hoy.year * 12 + hoy.month - 1 - meses
+hasta = f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+print(f"Archivando meses anteriores a {hasta} ({compresion})")
+cerrados = {
+    TURNOS_FILE: lambda turno: turno.get("estado") in ESTADOS_CERRADOS,
+    PAGOS_FILE: None,
+}
+for archivo, cerrado in cerrados.items():
+    archivados, abiertos = archivar(archivo, hasta, compresion, cerrado)
+    for mes, cantidad in archivados.items():
+        print(f"- {archivo} {mes}: {cantidad} registros")
+    for mes, cantidad in abiertos.items():
+        print(f"- {archivo} {mes}: queda activo, {cantidad} sin cerrar")
+    if not archivados and not abiertos:
+        print(f"- {archivo}: nada para archivar")
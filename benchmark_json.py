@@ -0,0 +1,80 @@
+"""Compara el JSON indentado (formato anterior) con el compacto que escribe
+almacenamiento.py, sobre un turnos.json sintético. Mide guardar_json y una
+lectura en frío con leer_json, sin snapshots.
+
+    python benchmark_json.py [cantidad_de_turnos]   (por defecto 200000)
+"""
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import almacenamiento
+
+CANTIDAD = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+REPETICIONES = 5
+
+MEDICOS = ["Dra. Colom", "Dr. Bobbiesi", "Dra. Pérez", "Dr. Gómez"]
+ESTADOS = ["sin atender", "recepcionado", "sala de espera", "atendido"]
+
+
+def generar_turnos(cantidad):
+    random.seed(1)
+    inicio = date(2024, 1, 1)
+    turnos = []
+    for _ in range(cantidad):
+        fecha = inicio + timedelta(days=random.randint(0, 1000))
+        turnos.append({
+            "dni_paciente": str(random.randint(10000000, 45000000)),
+            "medico": random.choice(MEDICOS),
+            "fecha": fecha.isoformat(),
+            "hora": f"{random.randint(8, 19):02d}:{random.choice(['00', '15', '30', '45'])}",
+            "estado": random.choice(ESTADOS),
+            "fecha_creacion": f"{fecha.isoformat()}T08:00:00",
+        })
+    return turnos
+
+
+def medir(funcion, preparar=None):
+    """Mejor tiempo de REPETICIONES corridas, en milisegundos"""
+    mejor = None
+    for _ in range(REPETICIONES):
+        if preparar:
+            preparar()
+        # Que no entre en la medición la basura de la corrida anterior
+        gc.collect()
+        t0 = time.perf_counter()
+        funcion()
+        transcurrido = (time.perf_counter() - t0) * 1000
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor
+
+
+formatos = {
+    "indentado (indent=4)": False,
+    "compacto": True,
+}
+
+turnos = generar_turnos(CANTIDAD)
+resultados = {}
+with tempfile.TemporaryDirectory() as directorio:
+    for nombre, compacto in formatos.items():
+        almacenamiento.usar_json_compacto(compacto)
+        ruta = os.path.join(directorio, "turnos.json")
+        ms_escritura = medir(lambda: almacenamiento.guardar_json(ruta, turnos))
+        # Lectura en frío: sin los datos en la cache
+        ms_lectura = medir(lambda: almacenamiento.leer_json(ruta),
+                           preparar=lambda: almacenamiento.invalidar_cache(ruta))
+        resultados[nombre] = (os.path.getsize(ruta), ms_escritura, ms_lectura)
+
+print(f"{CANTIDAD} turnos sintéticos\n")
+print(f"{'formato':<22}{'bytes':>14}{'escritura ms':>15}{'lectura ms':>13}")
+for nombre, (tam, ms_escritura, ms_lectura) in resultados.items():
+    print(f"{nombre:<22}{tam:>14,}{ms_escritura:>15.0f}{ms_lectura:>13.0f}")
+
+(tam_i, esc_i, lec_i), (tam_c, esc_c, lec_c) = resultados.values()
+print(f"\nAhorro: {tam_i - tam_c:,} bytes ({100 * (tam_i - tam_c) / tam_i:.0f}%), "
+      f"{esc_i - esc_c:.0f} ms por escritura, {lec_i - lec_c:.0f} ms por lectura")
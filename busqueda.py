@@ -0,0 +1,179 @@
+"""Búsqueda por subcadena sobre campos de texto (la búsqueda de pacientes).
+
+IndiceTexto guarda, por cada registro visible (uno por clave, el primero), el
+texto de sus campos en minúsculas y sin acentos, y un índice n-grama -> claves
+con todas las subcadenas de 1 a 3 caracteres. Una búsqueda de hasta 3
+caracteres es directamente el conjunto de su n-grama; una más larga es la
+intersección de los conjuntos de sus trigramas, verificando después que la
+búsqueda completa esté en el texto. Los resultados salen de una lista ya
+ordenada, así que una página se arma sin recorrer ni ordenar todos los
+registros.
+
+Se usa como derivado de la cache (almacenamiento.derivado): al registrar,
+modificar o borrar un paciente solo se actualizan los registros que cambiaron.
+"""
+import bisect
+import re
+import threading
+import unicodedata
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos ("Pérez" -> "perez")"""
+    texto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _ngramas(texto, largo):
+    return {texto[i:i + largo] for i in range(len(texto) - largo + 1)}
+
+
+class IndiceTexto:
+    """Índice de n-gramas sobre campos de texto de una lista de registros.
+
+    campos: campos en los que se busca (cada uno por separado).
+    clave: campo que identifica al registro; con claves repetidas se ve el primero.
+    orden: campo por el que salen ordenados los resultados (desempate por clave).
+    solo_digitos: campos de los que se indexan solo los dígitos (DNI).
+    """
+
+    def __init__(self, registros, campos, clave, orden, solo_digitos=()):
+        self.campos = campos
+        self.clave = clave
+        self.orden = orden
+        self.solo_digitos = set(solo_digitos)
+        self._lock = threading.Lock()
+        # clave -> registros con esa clave, en orden de llegada
+        self._registros = {}
+        # clave -> textos normalizados de los campos
+        self._textos = {}
+        # n-grama (1 a 3 caracteres) -> claves
+        self._ngramas = {}
+        # (orden, clave) de los registros visibles, ordenado
+        self._ordenados = []
+
+        for registro in registros:
+            if self._valida(registro):
+                self._registros.setdefault(registro[self.clave], []).append(registro)
+        for clave, iguales in self._registros.items():
+            self._indexar(clave, iguales[0])
+        self._ordenados.sort()
+
+    def _valida(self, registro):
+        return isinstance(registro, dict) and bool(registro.get(self.clave))
+
+    def _textos_de(self, registro):
+        textos = []
+        for campo in self.campos:
+            texto = normalizar(registro.get(campo, ""))
+            if campo in self.solo_digitos:
+                texto = re.sub(r"\D", "", texto)
+            textos.append(texto)
+        return textos
+
+    def _orden_de(self, clave, registro):
+        return (str(registro.get(self.orden, "")).lower(), clave)
+
+    def _indexar(self, clave, registro, ordenar=False):
+        textos = self._textos_de(registro)
+        self._textos[clave] = textos
+        for texto in textos:
+            for largo in (1, 2, 3):
+                for ngrama in _ngramas(texto, largo):
+                    self._ngramas.setdefault(ngrama, set()).add(clave)
+        if ordenar:
+            bisect.insort(self._ordenados, self._orden_de(clave, registro))
+        else:
+            self._ordenados.append(self._orden_de(clave, registro))
+
+    def _desindexar(self, clave, registro):
+        for texto in self._textos.pop(clave, ()):
+            for largo in (1, 2, 3):
+                for ngrama in _ngramas(texto, largo):
+                    claves = self._ngramas.get(ngrama)
+                    if claves is not None:
+                        claves.discard(clave)
+                        if not claves:
+                            del self._ngramas[ngrama]
+        item = self._orden_de(clave, registro)
+        i = bisect.bisect_left(self._ordenados, item)
+        if i < len(self._ordenados) and self._ordenados[i] == item:
+            del self._ordenados[i]
+
+    def actualizar(self, quitados, agregados):
+        """Aplica un cambio de los datos: registros que salieron y que entraron"""
+        with self._lock:
+            for registro in quitados:
+                if not self._valida(registro):
+                    continue
+                clave = registro[self.clave]
+                iguales = self._registros.get(clave, [])
+                # El registro que salió (o uno igual): se compara por contenido
+                posicion = next((i for i, r in enumerate(iguales) if r == registro), None)
+                if posicion is None:
+                    continue
+                visible = iguales[0]
+                del iguales[posicion]
+                if posicion == 0:
+                    self._desindexar(clave, visible)
+                    if iguales:
+                        self._indexar(clave, iguales[0], ordenar=True)
+                if not iguales:
+                    del self._registros[clave]
+            for registro in agregados:
+                if not self._valida(registro):
+                    continue
+                clave = registro[self.clave]
+                iguales = self._registros.setdefault(clave, [])
+                iguales.append(registro)
+                if len(iguales) == 1:
+                    self._indexar(clave, registro, ordenar=True)
+
+    def _coinciden(self, busqueda):
+        """Claves cuyos campos contienen busqueda (ya normalizada)"""
+        if len(busqueda) <= 3:
+            return set(self._ngramas.get(busqueda, ()))
+        conjuntos = sorted((self._ngramas.get(t, set()) for t in _ngramas(busqueda, 3)), key=len)
+        candidatas = set(conjuntos[0])
+        for conjunto in conjuntos[1:]:
+            if not candidatas:
+                break
+            candidatas &= conjunto
+        return {c for c in candidatas if any(busqueda in texto for texto in self._textos[c])}
+
+    def claves(self, busqueda):
+        """Claves de los registros que contienen busqueda, sin orden"""
+        busqueda = normalizar(busqueda.strip())
+        with self._lock:
+            return self._coinciden(busqueda) if busqueda else set(self._textos)
+
+    def buscar(self, busqueda, inicio, cantidad):
+        """(total, registros de la página) de los que contienen busqueda.
+
+        Los registros son los de la cache: no modificarlos.
+        """
+        busqueda = normalizar(busqueda.strip())
+        with self._lock:
+            if not busqueda:
+                pagina = self._ordenados[inicio:inicio + cantidad]
+                total = len(self._ordenados)
+            else:
+                claves = self._coinciden(busqueda)
+                total = len(claves)
+                if total * 8 < len(self._ordenados):
+                    # Pocos resultados: se ordenan solo ellos
+                    orden = sorted(self._orden_de(c, self._registros[c][0]) for c in claves)
+                    pagina = orden[inicio:inicio + cantidad]
+                else:
+                    # Muchos: se recorre la lista ordenada hasta llenar la página
+                    pagina, salteados = [], 0
+                    for item in self._ordenados:
+                        if item[1] not in claves:
+                            continue
+                        if salteados < inicio:
+                            salteados += 1
+                            continue
+                        pagina.append(item)
+                        if len(pagina) == cantidad:
+                            break
+            return total, [self._registros[clave][0] for _, clave in pagina]
@@ -0,0 +1,42 @@
+"""Resultados de reportes ya calculados.
+
+Los reportes del administrador recorren varios datasets y se piden cada vez
+que se abre la pantalla. CacheReportes guarda la respuesta de cada uno bajo
+una clave que incluye la versión de los datasets que lee
+(almacenamiento.version): mientras ninguno cambie se devuelve lo guardado, y
+después de una escritura la clave es otra y se vuelve a calcular. Las
+entradas viejas se descartan de a una, la menos usada primero.
+"""
+import threading
+from collections import OrderedDict
+
+
+class CacheReportes:
+    """Diccionario acotado a maximo entradas, con descarte LRU"""
+
+    def __init__(self, maximo=64):
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+
+    def obtener(self, clave):
+        """Resultado guardado bajo clave, o None"""
+        with self._lock:
+            resultado = self._entradas.get(clave)
+            if resultado is not None:
+                self._entradas.move_to_end(clave)
+            return resultado
+
+    def guardar(self, clave, resultado):
+        with self._lock:
+            self._entradas[clave] = resultado
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
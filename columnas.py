@@ -0,0 +1,239 @@
+"""Turnos en columnas para los reportes.
+
+TablaTurnos guarda los turnos de un mes como columnas de enteros: la fecha
+como ordinal, la hora como minuto del día y médico, estado y DNI como códigos.
+Filtrar es armar una máscara sobre las columnas y contar por médico, estado o
+DNI es un bincount de los códigos. Con NumPy instalado esas operaciones son
+vectorizadas; sin NumPy las columnas son array del módulo estándar y se
+filtran con map/compress y Counter.
+
+Es un derivado de cada mes de turnos (almacenamiento.derivados): una
+escritura agrega al final las filas que entraron y marca como borradas las
+que salieron, sin rearmar la tabla.
+"""
+import threading
+from array import array
+from collections import Counter
+from datetime import date
+from itertools import compress, repeat
+from operator import and_
+
+try:
+    import numpy
+except ImportError:
+    # Sin NumPy: mismas columnas, filtros y conteos recorriéndolas en Python
+    numpy = None
+
+# Fecha u hora que no se pudo leer
+SIN_VALOR = -1
+
+CATEGORICAS = ("medico", "estado", "dni_paciente")
+
+
+def ordinal(fecha):
+    """date.toordinal() de una fecha "AAAA-MM-DD", o SIN_VALOR"""
+    if not isinstance(fecha, str) or len(fecha) != 10:
+        return SIN_VALOR
+    try:
+        return date.fromisoformat(fecha).toordinal()
+    except ValueError:
+        return SIN_VALOR
+
+
+def minuto(hora):
+    """Minuto del día de una hora "HH:MM", o SIN_VALOR"""
+    try:
+        horas, minutos = hora.split(":")
+        horas, minutos = int(horas), int(minutos)
+    except (AttributeError, ValueError):
+        return SIN_VALOR
+    if not (0 <= horas < 24 and 0 <= minutos < 60):
+        return SIN_VALOR
+    return horas * 60 + minutos
+
+
+class _Codigos:
+    """Valores de una columna categórica y su código (posición en valores)"""
+
+    def __init__(self):
+        self.codigos = {}
+        self.valores = []
+
+    def codigo(self, valor):
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            codigo = self.codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return codigo
+
+
+class TablaTurnos:
+    """Columnas de los turnos de un mes.
+
+    contar() y filas() reciben los mismos filtros: desde/hasta ("AAAA-MM-DD",
+    inclusive), antes_del_minuto (la hora es anterior a ese minuto del día) e
+    igualdades sobre médico, estado o DNI (un valor o una tupla de valores).
+    """
+
+    def __init__(self, turnos):
+        self._lock = threading.Lock()
+        self._armar(turnos)
+
+    def _armar(self, turnos):
+        self.registros = []
+        self._fecha = array("i")
+        self._minuto = array("i")
+        self._vivo = array("b")
+        self._categoricas = {campo: array("i") for campo in CATEGORICAS}
+        self._codigos = {campo: _Codigos() for campo in CATEGORICAS}
+        # (dni, fecha, hora) -> posiciones, para encontrar las filas que salen
+        self._posiciones = {}
+        self._borrados = 0
+        for turno in turnos:
+            self._agregar(turno)
+
+    @staticmethod
+    def _clave(turno):
+        return (turno.get("dni_paciente"), turno.get("fecha"), turno.get("hora"))
+
+    def _agregar(self, turno):
+        if not isinstance(turno, dict):
+            return
+        self._posiciones.setdefault(self._clave(turno), []).append(len(self.registros))
+        self.registros.append(turno)
+        self._fecha.append(ordinal(turno.get("fecha")))
+        self._minuto.append(minuto(turno.get("hora")))
+        self._vivo.append(1)
+        for campo in CATEGORICAS:
+            self._categoricas[campo].append(self._codigos[campo].codigo(turno.get(campo)))
+
+    def _quitar(self, turno):
+        if not isinstance(turno, dict):
+            return
+        posiciones = self._posiciones.get(self._clave(turno), [])
+        for n, posicion in enumerate(posiciones):
+            if self.registros[posicion] == turno:
+                del posiciones[n]
+                self._vivo[posicion] = 0
+                self._borrados += 1
+                return
+
+    def actualizar(self, quitados, agregados):
+        """Aplica un cambio de los datos: registros que salieron y que entraron"""
+        with self._lock:
+            for turno in quitados:
+                self._quitar(turno)
+            for turno in agregados:
+                self._agregar(turno)
+            if self._borrados > len(self.registros) // 2:
+                # Más borradas que vivas: se rearma solo con las vivas
+                self._armar([r for r, vivo in zip(self.registros, self._vivo) if vivo])
+
+    def __len__(self):
+        return len(self.registros) - self._borrados
+
+    def _codigos_de(self, campo, valores):
+        if not isinstance(valores, (tuple, list, set, frozenset)):
+            valores = (valores,)
+        codigos = self._codigos[campo].codigos
+        return [codigos[v] for v in valores if v in codigos]
+
+    # ----- con NumPy -----
+
+    def _mascara(self, desde, hasta, antes_del_minuto, valores):
+        mascara = numpy.frombuffer(self._vivo, dtype=numpy.int8) == 1
+        fecha = numpy.frombuffer(self._fecha, dtype=numpy.int32)
+        if desde is not None:
+            mascara &= fecha >= ordinal(desde)
+        if hasta is not None:
+            mascara &= (fecha <= ordinal(hasta)) & (fecha != SIN_VALOR)
+        if antes_del_minuto is not None:
+            columna = numpy.frombuffer(self._minuto, dtype=numpy.int32)
+            mascara &= (columna != SIN_VALOR) & (columna < antes_del_minuto)
+        for campo, valor in valores.items():
+            columna = numpy.frombuffer(self._categoricas[campo], dtype=numpy.int32)
+            mascara &= numpy.isin(columna, self._codigos_de(campo, valor))
+        return mascara
+
+    def _contar_numpy(self, campos, tamanos, mascara):
+        combinado = numpy.zeros(int(mascara.sum()), dtype=numpy.int64)
+        for campo, tamano in zip(campos, tamanos):
+            columna = numpy.frombuffer(self._categoricas[campo], dtype=numpy.int32)[mascara]
+            combinado = combinado * tamano + columna
+        cuentas = numpy.bincount(combinado)
+        codigos = numpy.flatnonzero(cuentas)
+        return zip(codigos.tolist(), cuentas[codigos].tolist())
+
+    # ----- sin NumPy: cada filtro achica las posiciones que revisa el siguiente -----
+
+    def _posiciones_lista(self, desde, hasta, antes_del_minuto, valores):
+        """Posiciones de las filas que pasan los filtros (None si no hay filtros: todas las vivas)"""
+        # (columna, valores admitidos), los categóricos primero: suelen dejar menos filas
+        filtros = [(self._categoricas[campo], set(self._codigos_de(campo, valor)))
+                   for campo, valor in valores.items()]
+        if desde is not None or hasta is not None:
+            filtros.append((self._fecha, range(ordinal(desde) if desde is not None else 0,
+                                               ordinal(hasta) + 1 if hasta is not None else date.max.toordinal() + 1)))
+        if antes_del_minuto is not None:
+            filtros.append((self._minuto, range(0, antes_del_minuto)))
+
+        if not filtros:
+            return None
+        columna, admitidos = filtros[0]
+        vivas_admitidas = map(and_, self._vivo, map(admitidos.__contains__, columna))
+        posiciones = list(compress(range(len(self._vivo)), vivas_admitidas))
+        for columna, admitidos in filtros[1:]:
+            posiciones = [posicion for posicion in posiciones if columna[posicion] in admitidos]
+        return posiciones
+
+    def _columna_lista(self, campo, posiciones):
+        columna = self._categoricas[campo]
+        if posiciones is None:
+            return compress(columna, self._vivo)
+        return map(columna.__getitem__, posiciones)
+
+    def _contar_lista(self, campos, tamanos, posiciones):
+        combinado = self._columna_lista(campos[0], posiciones)
+        for campo, tamano in zip(campos[1:], tamanos[1:]):
+            combinado = map(lambda codigo, propio, tamano=tamano: codigo * tamano + propio,
+                            combinado, self._columna_lista(campo, posiciones))
+        # En orden de código, como bincount
+        return sorted(Counter(combinado).items())
+
+    def contar(self, por, desde=None, hasta=None, antes_del_minuto=None, **valores):
+        """Cantidad de turnos filtrados por valor de una columna categórica.
+
+        por es un campo ("medico") o una tupla de campos (("medico", "estado"));
+        devuelve {valor: cantidad} o {(valor, valor): cantidad}.
+        """
+        campos = (por,) if isinstance(por, str) else tuple(por)
+        with self._lock:
+            tamanos = [len(self._codigos[campo].valores) for campo in campos]
+            if numpy is not None:
+                encontrados = self._contar_numpy(campos, tamanos, self._mascara(desde, hasta, antes_del_minuto, valores))
+            else:
+                encontrados = self._contar_lista(campos, tamanos,
+                                                 self._posiciones_lista(desde, hasta, antes_del_minuto, valores))
+
+            if isinstance(por, str):
+                valores_campo = self._codigos[por].valores
+                return {valores_campo[codigo]: cantidad for codigo, cantidad in encontrados}
+            resultado = {}
+            for codigo, cantidad in encontrados:
+                fila = []
+                for campo, tamano in zip(reversed(campos), reversed(tamanos)):
+                    codigo, propio = divmod(codigo, tamano)
+                    fila.append(self._codigos[campo].valores[propio])
+                resultado[tuple(reversed(fila))] = cantidad
+            return resultado
+
+    def filas(self, desde=None, hasta=None, antes_del_minuto=None, **valores):
+        """Turnos filtrados, en el orden en que entraron a la tabla (compartidos con la cache: no modificarlos)"""
+        with self._lock:
+            if numpy is not None:
+                posiciones = numpy.flatnonzero(self._mascara(desde, hasta, antes_del_minuto, valores)).tolist()
+                return [self.registros[posicion] for posicion in posiciones]
+            posiciones = self._posiciones_lista(desde, hasta, antes_del_minuto, valores)
+            if posiciones is None:
+                return list(compress(self.registros, self._vivo))
+            return [self.registros[posicion] for posicion in posiciones]
@@ -0,0 +1,134 @@
+"""Rutas de los datasets y configuración del almacenamiento.
+
+La importan app.py y los scripts de mantenimiento (archivar.py, respaldar.py,
+migrar_a_sqlite.py, ...). Importarla no toca el disco: solo define rutas y
+lee variables de entorno. configurar_almacenamiento() registra en
+almacenamiento.py el motor y el journal, las particiones, índices, claves y
+secuencias de cada dataset; la llaman app.py al arrancar y cada script antes
+de leer o escribir.
+"""
+import os
+import shutil
+from almacenamiento import (usar_journal, usar_particiones, usar_sqlite, usar_commit_agrupado,
+                            usar_snapshots, usar_json_compacto, usar_indices, usar_clave, usar_secuencia,
+                            usar_cache_archivo)
+
+# Rutas de archivo usando el disco persistente
+# En producción (Render) usa /data/, en desarrollo local usa la raíz
+if os.path.exists("/data"):
+    # Producción en Render
+    DATA_FILE = "/data/historias_clinicas.json"
+    USUARIOS_FILE = "/data/usuarios.json"
+    PACIENTES_FILE = "/data/pacientes.json"
+    TURNOS_FILE = "/data/turnos.json"
+    AGENDA_FILE = "/data/agenda.json"
+    PAGOS_FILE = "/data/pagos.json"
+else:
+    # Desarrollo local
+    DATA_FILE = "historias_clinicas.json"
+    USUARIOS_FILE = "usuarios.json"
+    PACIENTES_FILE = "pacientes.json"
+    TURNOS_FILE = "turnos.json"
+    AGENDA_FILE = "agenda.json"
+    PAGOS_FILE = "pagos.json"
+
+# Motor de almacenamiento: "json" (archivos, por defecto) o "sqlite".
+# Con sqlite los seis datasets viven en una sola base con índices; si la base
+# no existe se crea importando los JSON (ver también migrar_a_sqlite.py).
+ALMACENAMIENTO = os.environ.get("ALMACENAMIENTO", "json")
+SQLITE_FILE = os.environ.get("SQLITE_FILE", os.path.join(os.path.dirname(DATA_FILE), "consultorio.db"))
+TABLAS_SQLITE = {
+    DATA_FILE: "historias",
+    USUARIOS_FILE: "usuarios",
+    PACIENTES_FILE: "pacientes",
+    TURNOS_FILE: "turnos",
+    AGENDA_FILE: "agenda",
+    PAGOS_FILE: "pagos",
+}
+
+# Respaldos incrementales de los seis datasets (ver respaldos.py y respaldar.py).
+# Los arranca un solo proceso (gunicorn.conf.py, o python app.py en desarrollo);
+# RESPALDO_MINUTOS=0 los apaga, por ejemplo para respaldar con cron y respaldar.py
+RESPALDOS_DIR = os.environ.get("RESPALDOS_DIR", os.path.join(os.path.dirname(DATA_FILE), "respaldos"))
+DATASETS = {os.path.basename(path): path for path in TABLAS_SQLITE}
+RESPALDO_MINUTOS = float(os.environ.get("RESPALDO_MINUTOS", "1440"))
+RESPALDOS_CONSERVAR = int(os.environ.get("RESPALDOS_CONSERVAR", "30"))
+
+
+# (OPCIONAL) Copiar archivos antiguos si todavía existen en la raíz
+def mover_a_persistencia(nombre_archivo):
+    origen = nombre_archivo
+    destino = f"/data/{nombre_archivo}"
+
+    if os.path.exists(origen) and not os.path.exists(destino):
+        try:
+            shutil.copy(origen, destino)
+            print(f"Archivo '{nombre_archivo}' copiado a /data")
+        except Exception as e:
+            print(f"Error al copiar '{nombre_archivo}':", e)
+
+
+_configurado = False
+
+
+def configurar_almacenamiento():
+    """Registra en almacenamiento.py cómo se guarda cada dataset (una vez por proceso).
+
+    Puede escribir en disco: copia a /data los archivos que quedaron en la
+    raíz y, con el motor JSON, parte por mes turnos y pagos si todavía no lo
+    están.
+    """
+    global _configurado
+    if _configurado:
+        return
+    _configurado = True
+
+    # Solo ejecutar en producción si existe el directorio /data
+    if os.path.exists("/data"):
+        for archivo in ("historias_clinicas.json", "usuarios.json", "pacientes.json",
+                        "turnos.json", "agenda.json", "pagos.json"):
+            mover_a_persistencia(archivo)
+
+    # Turnos y pagos cambian en cada click de recepción/cobro: se escriben en journal.
+    # Las historias también: una consulta nueva es una línea, sin reescribir las demás
+    usar_journal(TURNOS_FILE, PAGOS_FILE, DATA_FILE)
+    # Los cambios que llegan juntos (recepción de las 8 de la mañana) comparten
+    # un solo fsync: cada request espera a lo sumo esta ventana antes de confirmar
+    usar_commit_agrupado(float(os.environ.get("VENTANA_COMMIT_MS", "20")))
+
+    # JSON compactos en disco; /descargar entrega igual la versión indentada
+    # (JSON_COMPACTO=0 vuelve a escribirlos indentados)
+    usar_json_compacto(os.environ.get("JSON_COMPACTO", "1") != "0")
+
+    # Copia binaria junto a cada JSON para que los workers arranquen sin
+    # re-parsear el JSON indentado (SNAPSHOTS=0 la desactiva)
+    if os.environ.get("SNAPSHOTS", "1") != "0":
+        usar_snapshots(DATA_FILE, USUARIOS_FILE, PACIENTES_FILE, TURNOS_FILE, AGENDA_FILE, PAGOS_FILE)
+
+    if ALMACENAMIENTO == "sqlite":
+        usar_sqlite(SQLITE_FILE, TABLAS_SQLITE)
+
+    # Casi todas las consultas de turnos y pagos son por día o por mes: se guardan
+    # partidos por mes (turnos/2026-10.json) y solo se leen los meses consultados.
+    # Va después de elegir el motor: con SQLite no se arman las particiones
+    usar_particiones(TURNOS_FILE, PAGOS_FILE)
+    # De los meses archivados (archivar.py) solo quedan en memoria los últimos
+    # que se consultaron: un reporte de un rango viejo no los deja residentes
+    usar_cache_archivo(int(os.environ.get("ARCHIVO_CACHE_MESES", "2")))
+
+    # buscar_uno(PACIENTES_FILE, dni=...) va por un índice en memoria en lugar de
+    # recorrer todos los pacientes; los cruces turno -> paciente usan indice()
+    usar_indices(PACIENTES_FILE, "dni")
+    # Ocupación de la agenda: si un médico ya tiene turno en una fecha y hora
+    usar_indices(TURNOS_FILE, ("medico", "fecha", "hora"))
+    # Cada turno se identifica por paciente, fecha y hora: recepción, cambios de
+    # estado y bajas lo modifican solo a él (obtener/modificar/eliminar)
+    usar_clave(TURNOS_FILE, "dni_paciente", "fecha", "hora")
+    # Pagos de un día y pago de un paciente en un día (recepción y reportes)
+    usar_indices(PAGOS_FILE, "fecha", ("dni_paciente", "fecha"))
+    # Pagos e historias se dan de alta sin cargar el dataset (agregar) con ids de
+    # una secuencia que no se reutiliza; los pagos se borran por id (eliminar)
+    usar_secuencia(PAGOS_FILE)
+    usar_secuencia(DATA_FILE)
+    usar_clave(PAGOS_FILE, "id")
+    usar_clave(DATA_FILE, "id")
@@ -1,21 +1,17 @@
-import json
-import os
 from werkzeug.security import generate_password_hash
 
-USUARIOS_FILE = "usuarios.json"
+from almacenamiento import cargar_json, guardar_json, transaccion
+# Mismo archivo (y mismo motor JSON/SQLite) que usa la aplicación
+from config import USUARIOS_FILE, configurar_almacenamiento
 
 
 # ---------- utilidades de archivo ----------
 def cargar_usuarios():
-    if os.path.exists(USUARIOS_FILE):
-        with open(USUARIOS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+    return cargar_json(USUARIOS_FILE)
 
 
 def guardar_usuarios(usuarios):
-    with open(USUARIOS_FILE, "w", encoding="utf-8") as f:
-        json.dump(usuarios, f, indent=4, ensure_ascii=False)
+    guardar_json(USUARIOS_FILE, usuarios)
 
 
 # ---------- validaciones ----------
@@ -51,19 +47,20 @@ def crear_usuario():
             break
         print("❌ Rol inválido. Debe ser 'medico', 'secretaria' o 'administrador'.")
 
-    usuarios = cargar_usuarios()
-    if any(u["usuario"] == usuario for u in usuarios):
-        print("❌ Ese usuario ya existe.")
-        return
-
-    usuarios.append(
-        {
-            "usuario": usuario,
-            "contrasena": generate_password_hash(contrasena),
-            "rol": rol,
-        }
-    )
-    guardar_usuarios(usuarios)
+    with transaccion(USUARIOS_FILE):
+        usuarios = cargar_usuarios()
+        if any(u["usuario"] == usuario for u in usuarios):
+            print("❌ Ese usuario ya existe.")
+            return
+
+        usuarios.append(
+            {
+                "usuario": usuario,
+                "contrasena": generate_password_hash(contrasena),
+                "rol": rol,
+            }
+        )
+        guardar_usuarios(usuarios)
     print(f"✅ Usuario '{usuario}' creado con rol '{rol}'.")
 
 
@@ -124,4 +121,5 @@ def menu():
 
 
 if __name__ == "__main__":
+    configurar_almacenamiento()
     menu()
@@ -0,0 +1,101 @@
+"""Agenda compilada en mapas de bits.
+
+agenda.json es médico -> día ("LUNES" ... "VIERNES") -> lista de horarios
+"HH:MM". AgendaCompilada pasa cada lista a un entero con un bit por minuto
+del día (bit 0 = 00:00, bit 1 = 00:01, ... 1440 franjas), así saber si un
+horario está en la agenda es un AND, los horarios libres de un día son
+agenda & ~ocupados y contar horarios es contar bits. Cualquier horario HH:MM
+tiene su bit: la agenda no obliga a una grilla (14:07 es un horario válido).
+
+Se arma sobre la agenda de la cache (almacenamiento.derivado) y se vuelve a
+armar cuando la agenda cambia.
+"""
+from datetime import date
+
+MINUTOS_FRANJA = 1
+FRANJAS_POR_DIA = 24 * 60 // MINUTOS_FRANJA
+
+# date.weekday() -> clave del día en agenda.json
+DIAS = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES", "SABADO", "DOMINGO"]
+
+
+def dia_agenda(fecha):
+    """Clave del día en la agenda para una fecha (date o "AAAA-MM-DD")"""
+    if isinstance(fecha, str):
+        fecha = date.fromisoformat(fecha)
+    return DIAS[fecha.weekday()]
+
+
+def franja(hora):
+    """Número de franja de un horario "HH:MM", o None si no cae en una"""
+    try:
+        horas, minutos = hora.split(":")
+        minutos = int(horas) * 60 + int(minutos)
+    except (AttributeError, ValueError):
+        return None
+    if len(hora) != 5 or minutos % MINUTOS_FRANJA or not 0 <= minutos < 24 * 60:
+        return None
+    return minutos // MINUTOS_FRANJA
+
+
+def hora_de(numero):
+    """Horario "HH:MM" de una franja"""
+    minutos = numero * MINUTOS_FRANJA
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+def mapa_de(horas):
+    """Mapa de bits de una lista de horarios (los que no caen en una franja se ignoran)"""
+    mapa = 0
+    for hora in horas:
+        numero = franja(hora)
+        if numero is not None:
+            mapa |= 1 << numero
+    return mapa
+
+
+def horas_de(mapa):
+    """Horarios de un mapa de bits, en orden"""
+    horas = []
+    while mapa:
+        bajo = mapa & -mapa
+        horas.append(hora_de(bajo.bit_length() - 1))
+        mapa ^= bajo
+    return horas
+
+
+def contar(mapa):
+    return bin(mapa).count("1")
+
+
+class AgendaCompilada:
+    """Mapa de bits por médico y día de la agenda"""
+
+    def __init__(self, agenda):
+        # médico -> día -> mapa de bits
+        self.mapas = {}
+        for medico, dias in (agenda.items() if isinstance(agenda, dict) else ()):
+            if isinstance(dias, dict):
+                self.mapas[medico] = {dia: mapa_de(horas) for dia, horas in dias.items()
+                                      if isinstance(horas, list)}
+
+    def __contains__(self, medico):
+        return medico in self.mapas
+
+    def mapa(self, medico, dia):
+        return self.mapas.get(medico, {}).get(dia, 0)
+
+    def atiende(self, medico, dia, hora):
+        """Si hora está en la agenda del médico ese día"""
+        numero = franja(hora)
+        return numero is not None and bool(self.mapa(medico, dia) >> numero & 1)
+
+    def libres(self, medico, dia, ocupadas):
+        """Horarios de la agenda del médico ese día que no están en ocupadas"""
+        return horas_de(self.mapa(medico, dia) & ~mapa_de(ocupadas))
+
+    def cantidad(self, medico=None, dia=None):
+        """Horarios en la agenda, de un médico y/o un día (por defecto, de todos)"""
+        medicos = [medico] if medico is not None else self.mapas
+        return sum(contar(mapa) for m in medicos for d, mapa in self.mapas.get(m, {}).items()
+                   if dia is None or d == dia)
@@ -0,0 +1,27 @@
+"""Configuración de gunicorn (ver Procfile).
+
+Los respaldos automáticos (respaldos.py) no corren en los workers: el
+proceso maestro arranca un solo proceso "python respaldar.py continuo" cuando
+el servidor está listo y lo termina al salir. RESPALDO_MINUTOS=0 lo apaga.
+"""
+import os
+import subprocess
+import sys
+
+from config import RESPALDO_MINUTOS
+
+_respaldos = None
+
+
+def when_ready(server):
+    global _respaldos
+    if RESPALDO_MINUTOS > 0:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "respaldar.py")
+        _respaldos = subprocess.Popen([sys.executable, script, "continuo"])
+        server.log.info("Respaldos automáticos cada %s minutos (pid %s)", RESPALDO_MINUTOS, _respaldos.pid)
+
+
+def on_exit(server):
+    if _respaldos is not None and _respaldos.poll() is None:
+        _respaldos.terminate()
+        _respaldos.wait()
@@ -1,36 +1,37 @@
-import json
-import shutil
 from datetime import datetime, timedelta
-
-ARCHIVO_TURNOS = "turnos.json"
-BACKUP = "turnos_backup.json"
-
-# Hacer backup
-shutil.copy2(ARCHIVO_TURNOS, BACKUP)
-print(f"Backup creado: {BACKUP}")
-
-with open(ARCHIVO_TURNOS, "r", encoding="utf-8") as f:
-    turnos = json.load(f)
-
-ahora = datetime.now()
-turnos_filtrados = []
-eliminados = []
-
-for t in turnos:
-    fecha_hora_str = f"{t.get('fecha', '')} {t.get('hora', '00:00')}"
-    try:
-        fecha_hora = datetime.strptime(fecha_hora_str, "%Y-%m-%d %H:%M")
-    except Exception:
-        turnos_filtrados.append(t)
-        continue
-    # Si está vencido hace más de 24hs y es 'sin atender', eliminar
-    if t.get('estado', '').lower() == 'sin atender' and fecha_hora < ahora - timedelta(hours=24):
-        eliminados.append(t)
-    else:
-        turnos_filtrados.append(t)
-
-with open(ARCHIVO_TURNOS, "w", encoding="utf-8") as f:
-    json.dump(turnos_filtrados, f, indent=2, ensure_ascii=False)
+from almacenamiento import cargar_json, guardar_json, transaccion
+from respaldos import respaldar
+# Mismo archivo (y mismo motor JSON/SQLite) que usa la aplicación
+from config import TURNOS_FILE as ARCHIVO_TURNOS, RESPALDOS_DIR, configurar_almacenamiento
+
+configurar_almacenamiento()
+
+# Bloqueo exclusivo: la app no puede tocar turnos mientras se limpian
+with transaccion(ARCHIVO_TURNOS):
+    # Respaldo incremental de los turnos (se vuelve con respaldar.py restaurar)
+    manifiesto = respaldar(RESPALDOS_DIR, {"turnos.json": ARCHIVO_TURNOS})
+    print(f"Respaldo creado: {manifiesto['momento']} en {RESPALDOS_DIR}")
+
+    turnos = cargar_json(ARCHIVO_TURNOS)
+
+    ahora = datetime.now()
+    turnos_filtrados = []
+    eliminados = []
+
+    for t in turnos:
+        fecha_hora_str = f"{t.get('fecha', '')} {t.get('hora', '00:00')}"
+        try:
+            fecha_hora = datetime.strptime(fecha_hora_str, "%Y-%m-%d %H:%M")
+        except Exception:
+            turnos_filtrados.append(t)
+            continue
+        # Si está vencido hace más de 24hs y es 'sin atender', eliminar
+        if t.get('estado', '').lower() == 'sin atender' and fecha_hora < ahora - timedelta(hours=24):
+            eliminados.append(t)
+        else:
+            turnos_filtrados.append(t)
+
+    guardar_json(ARCHIVO_TURNOS, turnos_filtrados)
 
 print(f"Turnos eliminados: {len(eliminados)}")
 if eliminados:
@@ -0,0 +1,25 @@
+"""Copia los archivos JSON a la base SQLite (ALMACENAMIENTO=sqlite).
+
+La aplicación importa los JSON sola la primera vez que crea la base; este
+script sirve para volver a importarlos, por ejemplo después de restaurar un
+backup de los JSON. Reemplaza el contenido de las tablas.
+
+    python migrar_a_sqlite.py
+"""
+from almacenamiento import leer_archivos, invalidar_cache
+from almacenamiento_sqlite import MotorSQLite
+from config import SQLITE_FILE, TABLAS_SQLITE, configurar_almacenamiento
+
+configurar_almacenamiento()
+
+motor = MotorSQLite(SQLITE_FILE)
+
+for archivo, tabla in TABLAS_SQLITE.items():
+    datos = leer_archivos(archivo)
+    if tabla == "agenda" and not datos:
+        datos = {}
+    motor.reemplazar(tabla, datos)
+    print(f"{tabla}: {len(datos)} registros importados desde {archivo}")
+
+invalidar_cache()
+print(f"Base actualizada: {SQLITE_FILE}")
@@ -0,0 +1,50 @@
+"""Totales y agrupaciones de los reportes en una sola pasada.
+
+Un reporte pide varias cuentas sobre las mismas filas: cuántos turnos hay,
+cuántos atendidos, cuántos ausentes, y lo mismo por médico y por día. Pasada
+recorre las filas una vez y va sumando cada medida en el total y en el grupo
+de cada agrupación, en lugar de filtrar la lista una vez por cuenta.
+
+Las filas pueden ser registros o ya conteos (los de resumenes.Conteos): una
+medida devuelve cuánto suma la fila, no solo si cuenta.
+"""
+
+
+class Pasada:
+    """Medidas sumadas en total y por grupo.
+
+    medidas: nombre -> función(fila) -> número que suma la fila (True suma 1).
+    grupos: nombre -> función(fila) -> valor del grupo de la fila, o None si
+    la fila no entra en esa agrupación.
+    """
+
+    def __init__(self, medidas, grupos=None):
+        self.medidas = medidas
+        self.grupos = grupos or {}
+        self.totales = dict.fromkeys(medidas, 0)
+        # agrupación -> valor -> medida -> suma
+        self.por = {nombre: {} for nombre in self.grupos}
+
+    def agregar(self, fila):
+        valores = [(medida, funcion(fila)) for medida, funcion in self.medidas.items()]
+        for medida, valor in valores:
+            self.totales[medida] += valor
+        for nombre, grupo_de in self.grupos.items():
+            grupo = grupo_de(fila)
+            if grupo is None:
+                continue
+            sumas = self.por[nombre].get(grupo)
+            if sumas is None:
+                sumas = self.por[nombre][grupo] = dict.fromkeys(self.medidas, 0)
+            for medida, valor in valores:
+                sumas[medida] += valor
+
+    def recorrer(self, filas):
+        for fila in filas:
+            self.agregar(fila)
+        return self
+
+    def grupo(self, nombre, *medidas):
+        """valor -> {medida: suma} de una agrupación, solo con las medidas indicadas"""
+        return {valor: {medida: sumas[medida] for medida in medidas}
+                for valor, sumas in self.por[nombre].items()}
@@ -0,0 +1,62 @@
+"""Respaldos incrementales de los seis datasets (ver respaldos.py).
+
+    python respaldar.py                      nuevo respaldo (para cron, por la noche)
+    python respaldar.py listar               respaldos existentes
+    python respaldar.py verificar            revisa que los bloques estén completos
+    python respaldar.py restaurar [momento] [dataset ...]
+                                             vuelve al último respaldo hasta momento
+                                             (AAAA-MM-DDTHH:MM:SS; por defecto el último)
+    python respaldar.py podar [cantidad]     deja los últimos (RESPALDOS_CONSERVAR o 30)
+    python respaldar.py continuo             respalda cada RESPALDO_MINUTOS, sin terminar
+                                             (lo arranca gunicorn.conf.py)
+
+Usa el directorio RESPALDOS_DIR (por defecto "respaldos/" junto a los datos).
+"""
+import sys
+from datetime import datetime
+
+from respaldos import respaldar, restaurar, instantaneas, leer_manifiesto, verificar, podar, respaldar_cada
+from config import RESPALDOS_DIR, DATASETS, RESPALDO_MINUTOS, RESPALDOS_CONSERVAR, configurar_almacenamiento
+
+configurar_almacenamiento()
+
+accion = sys.argv[1] if len(sys.argv) > 1 else "respaldar"
+
+if accion == "respaldar":
+    manifiesto = respaldar(RESPALDOS_DIR, DATASETS)
+    r = manifiesto["resumen"]
+    print(f"Respaldo {manifiesto['momento']} en {RESPALDOS_DIR}")
+    print(f"- {r['fuentes']} archivos, {r['sin_cambios']} sin cambios desde el anterior")
+    print(f"- {r['nuevos']} bloques nuevos ({r['bytes']:,} bytes), {r['reutilizados']} reutilizados")
+
+elif accion == "listar":
+    for momento in instantaneas(RESPALDOS_DIR):
+        datasets = leer_manifiesto(RESPALDOS_DIR, momento)["datasets"]
+        registros = ", ".join(f"{nombre}: {sum(f['registros'] for f in d['fuentes'])}"
+                              for nombre, d in datasets.items())
+        print(f"{momento.isoformat()}  {registros}")
+
+elif accion == "verificar":
+    problemas = verificar(RESPALDOS_DIR)
+    for momento, digest in problemas:
+        print(f"- {momento.isoformat()}: bloque {digest} faltante o dañado")
+    print("Respaldos completos" if not problemas else f"{len(problemas)} bloques con problemas")
+    sys.exit(1 if problemas else 0)
+
+elif accion == "restaurar":
+    momento = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    nombres = sys.argv[3:] or None
+    for nombre, usado in restaurar(RESPALDOS_DIR, DATASETS, momento, nombres).items():
+        print(f"- {nombre}: restaurado el respaldo {usado.isoformat()}")
+
+elif accion == "podar":
+    conservar = int(sys.argv[2]) if len(sys.argv) > 2 else RESPALDOS_CONSERVAR
+    instantaneas_borradas, bloques_borrados = podar(RESPALDOS_DIR, conservar)
+    print(f"Borrados {instantaneas_borradas} respaldos y {bloques_borrados} bloques sin usar")
+
+elif accion == "continuo":
+    respaldar_cada(RESPALDOS_DIR, DATASETS, RESPALDO_MINUTOS * 60, conservar=RESPALDOS_CONSERVAR)
+
+else:
+    print(__doc__)
+    sys.exit(2)
@@ -0,0 +1,366 @@
+"""Respaldos incrementales de los datasets del consultorio.
+
+Cada respaldo es una instantánea de todos los datasets: un manifiesto
+("respaldos/instantaneas/20261016T030000.json") que lista, por dataset y por
+archivo (cada mes en los particionados), los bloques que forman sus registros.
+Los bloques se guardan una sola vez en "respaldos/objetos/ab/<sha256>",
+comprimidos con zlib y nombrados por el hash de su contenido, así lo que no
+cambió entre un respaldo y el siguiente no se vuelve a escribir.
+
+Los registros se agrupan en bloques con cortes que dependen del contenido: un
+bloque termina después de un registro cuyo CRC32 es múltiplo de
+REGISTROS_POR_BLOQUE (o al llegar a BLOQUE_MAX_BYTES). Un alta o una baja solo
+cambian el bloque donde caen y los demás siguen teniendo el mismo hash. Los
+archivos cuya firma no cambió desde el respaldo anterior ni se leen.
+
+Se respalda sin bloquear a los workers: el bloqueo compartido de cada dataset
+se toma solo para tomar sus datos de la cache, y la serialización, la
+compresión y la escritura de bloques van fuera de él. restaurar() vuelve todos
+los datasets (o algunos) al último respaldo anterior a un momento dado.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from almacenamiento import fuentes_completas, leer_fuente, reemplazar_completo, transaccion
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin flock, cada worker decide solo por la fecha del último respaldo
+    fcntl = None
+
+
+# Registros promedio por bloque y tope de tamaño de un bloque sin comprimir
+REGISTROS_POR_BLOQUE = 64
+BLOQUE_MAX_BYTES = 1024 * 1024
+
+_FORMATO_MOMENTO = "%Y%m%dT%H%M%S"
+
+
+def _dir_objetos(directorio):
+    return os.path.join(directorio, "objetos")
+
+
+def _dir_instantaneas(directorio):
+    return os.path.join(directorio, "instantaneas")
+
+
+def _ruta_objeto(directorio, digest):
+    return os.path.join(_dir_objetos(directorio), digest[:2], digest)
+
+
+def _escribir_seguro(ruta, contenido):
+    # Temporal + fsync + rename: un corte deja el archivo anterior o ninguno
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as file:
+            file.write(contenido)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ===================== Bloques ======================
+
+def _lineas(datos):
+    """Un registro por línea; un dict (agenda) se guarda como pares [clave, valor]"""
+    registros = datos.items() if isinstance(datos, dict) else datos
+    for registro in registros:
+        if isinstance(datos, dict):
+            registro = list(registro)
+        yield json.dumps(registro, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _bloques(datos):
+    """Contenido de cada bloque, con cortes definidos por los registros"""
+    actual, tam = [], 0
+    for linea in _lineas(datos):
+        actual.append(linea)
+        tam += len(linea) + 1
+        if zlib.crc32(linea) % REGISTROS_POR_BLOQUE == 0 or tam >= BLOQUE_MAX_BYTES:
+            yield b"\n".join(actual)
+            actual, tam = [], 0
+    if actual:
+        yield b"\n".join(actual)
+
+
+def _guardar_bloque(directorio, contenido, estadisticas):
+    digest = hashlib.sha256(contenido).hexdigest()
+    ruta = _ruta_objeto(directorio, digest)
+    if os.path.exists(ruta):
+        estadisticas["reutilizados"] += 1
+    else:
+        _escribir_seguro(ruta, zlib.compress(contenido, 6))
+        estadisticas["nuevos"] += 1
+        estadisticas["bytes"] += os.path.getsize(ruta)
+    return digest
+
+
+def _leer_bloque(directorio, digest):
+    """Contenido de un bloque, verificado contra su hash"""
+    try:
+        with open(_ruta_objeto(directorio, digest), "rb") as file:
+            contenido = zlib.decompress(file.read())
+    except FileNotFoundError:
+        raise ValueError(f"Falta el bloque {digest}")
+    except zlib.error:
+        raise ValueError(f"Bloque dañado: {digest}")
+    if hashlib.sha256(contenido).hexdigest() != digest:
+        raise ValueError(f"Bloque dañado: {digest}")
+    return contenido
+
+
+def _leer_fuente(directorio, fuente):
+    registros = [json.loads(linea) for digest in fuente["bloques"]
+                 for linea in _leer_bloque(directorio, digest).split(b"\n")]
+    if fuente["tipo"] == "dict":
+        return dict(registros)
+    return registros
+
+
+# ===================== Instantáneas ======================
+
+def _normalizar(firma):
+    # La firma guardada en el manifiesto vuelve de JSON con listas en lugar de tuplas
+    return json.loads(json.dumps(firma))
+
+
+def instantaneas(directorio):
+    """Momentos de los respaldos existentes, del más viejo al más nuevo"""
+    try:
+        nombres = os.listdir(_dir_instantaneas(directorio))
+    except FileNotFoundError:
+        return []
+    momentos = []
+    for nombre in nombres:
+        try:
+            momentos.append(datetime.strptime(nombre[:-len(".json")], _FORMATO_MOMENTO))
+        except ValueError:
+            continue
+    return sorted(momentos)
+
+
+def leer_manifiesto(directorio, momento):
+    ruta = os.path.join(_dir_instantaneas(directorio), momento.strftime(_FORMATO_MOMENTO) + ".json")
+    with open(ruta, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+@contextmanager
+def _exclusivo(directorio, esperar=True):
+    """flock de "respaldos/respaldo.lock": un solo respaldo o poda a la vez.
+
+    Da False si esperar es False y otro proceso lo tiene.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    fd = os.open(os.path.join(directorio, "respaldo.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _ultimos(directorio, momentos, nombres):
+    """Último respaldo de cada dataset entre momentos: {nombre: (momento, dataset)}"""
+    ultimos = {}
+    for momento in reversed(momentos):
+        if len(ultimos) == len(nombres):
+            break
+        for nombre, dataset in leer_manifiesto(directorio, momento)["datasets"].items():
+            if nombre in nombres:
+                ultimos.setdefault(nombre, (momento, dataset))
+    return ultimos
+
+
+def respaldar(directorio, archivos):
+    """Nueva instantánea de los datasets ({nombre: path}).
+
+    Devuelve el manifiesto, con las estadísticas del respaldo en "resumen".
+    """
+    with _exclusivo(directorio):
+        return _respaldar(directorio, archivos)
+
+
+def _respaldar(directorio, archivos):
+    momentos = instantaneas(directorio)
+    anterior = _ultimos(directorio, momentos, archivos)
+    ahora = datetime.now().replace(microsecond=0)
+    if momentos and ahora <= momentos[-1]:
+        # Dos respaldos en el mismo segundo: el nombre tiene que ser nuevo
+        ahora = momentos[-1] + timedelta(seconds=1)
+
+    estadisticas = {"fuentes": 0, "sin_cambios": 0, "nuevos": 0, "reutilizados": 0, "bytes": 0}
+    datasets = {}
+    for nombre, path in archivos.items():
+        previas = {f["nombre"]: f for f in anterior[nombre][1]["fuentes"]} if nombre in anterior else {}
+        fuentes = []
+        for nombre_fuente, firma, ruta in fuentes_completas(path):
+            firma = _normalizar(firma)
+            estadisticas["fuentes"] += 1
+            previa = previas.get(nombre_fuente)
+            if previa is not None and firma is not None and previa["firma"] == firma:
+                fuentes.append(previa)
+                estadisticas["sin_cambios"] += 1
+                continue
+            # Sin pasar a la cache: no se copian ni se modifican
+            datos = leer_fuente(ruta)
+            fuentes.append({
+                "nombre": nombre_fuente,
+                "firma": firma,
+                "tipo": "dict" if isinstance(datos, dict) else "lista",
+                "registros": len(datos),
+                "bloques": [_guardar_bloque(directorio, contenido, estadisticas)
+                            for contenido in _bloques(datos)],
+            })
+        datasets[nombre] = {"fuentes": fuentes}
+
+    manifiesto = {"momento": ahora.isoformat(), "datasets": datasets, "resumen": estadisticas}
+    ruta = os.path.join(_dir_instantaneas(directorio), ahora.strftime(_FORMATO_MOMENTO) + ".json")
+    # El manifiesto va último: si el respaldo se corta, solo quedan bloques sueltos
+    _escribir_seguro(ruta, json.dumps(manifiesto, ensure_ascii=False).encode("utf-8"))
+    return manifiesto
+
+
+def restaurar(directorio, archivos, momento=None, nombres=None):
+    """Vuelve los datasets al último respaldo hecho hasta momento (o al último).
+
+    Cada dataset vuelve a su último respaldo (limpiar_turnos.py respalda solo
+    los turnos). Con nombres se restauran solo esos datasets. Todos los bloques
+    se leen y verifican antes de tocar los datos. Devuelve {dataset: momento
+    del respaldo usado}.
+    """
+    # Que una poda no borre bloques mientras se leen
+    with _exclusivo(directorio):
+        momentos = [m for m in instantaneas(directorio) if momento is None or m <= momento]
+        pedidos = {n: p for n, p in archivos.items() if nombres is None or n in nombres}
+        ultimos = _ultimos(directorio, momentos, pedidos)
+        faltan = [n for n in pedidos if n not in ultimos]
+        if faltan:
+            raise ValueError(f"No hay respaldos de {', '.join(faltan)} hasta ese momento")
+
+        restaurados = {}
+        for nombre, path in pedidos.items():
+            fuentes = ultimos[nombre][1]["fuentes"]
+            partes = [_leer_fuente(directorio, f) for f in fuentes]
+            if fuentes and fuentes[0]["tipo"] == "dict":
+                restaurados[path] = partes[0]
+            else:
+                restaurados[path] = [r for parte in partes for r in parte]
+
+    with transaccion(*restaurados):
+        for path, datos in restaurados.items():
+            reemplazar_completo(path, datos)
+    return {nombre: m for nombre, (m, _) in ultimos.items()}
+
+
+def verificar(directorio):
+    """Bloques faltantes o dañados de las instantáneas: [(momento, digest)]"""
+    problemas = []
+    revisados = {}
+    for momento in instantaneas(directorio):
+        manifiesto = leer_manifiesto(directorio, momento)
+        for dataset in manifiesto["datasets"].values():
+            for fuente in dataset["fuentes"]:
+                for digest in fuente["bloques"]:
+                    if digest not in revisados:
+                        try:
+                            _leer_bloque(directorio, digest)
+                            revisados[digest] = True
+                        except ValueError:
+                            revisados[digest] = False
+                    if not revisados[digest]:
+                        problemas.append((momento, digest))
+    return problemas
+
+
+def podar(directorio, conservar):
+    """Deja las últimas conservar instantáneas y borra los bloques que ya nadie usa.
+
+    Devuelve (instantáneas borradas, bloques borrados).
+    """
+    with _exclusivo(directorio):
+        return _podar(directorio, conservar)
+
+
+def _podar(directorio, conservar):
+    momentos = instantaneas(directorio)
+    # Se conserva también el último respaldo de cada dataset, aunque sea más viejo
+    nombres = {n for m in momentos for n in leer_manifiesto(directorio, m)["datasets"]}
+    ultimos = {m for m, _ in _ultimos(directorio, momentos, nombres).values()}
+    viejas = [m for m in (momentos[:-conservar] if conservar > 0 else []) if m not in ultimos]
+    for momento in viejas:
+        os.remove(os.path.join(_dir_instantaneas(directorio), momento.strftime(_FORMATO_MOMENTO) + ".json"))
+
+    usados = set()
+    for momento in momentos:
+        if momento in viejas:
+            continue
+        for dataset in leer_manifiesto(directorio, momento)["datasets"].values():
+            for fuente in dataset["fuentes"]:
+                usados.update(fuente["bloques"])
+
+    borrados = 0
+    for raiz, _, nombres in os.walk(_dir_objetos(directorio)):
+        for nombre in nombres:
+            if nombre not in usados and not nombre.endswith(".tmp"):
+                os.remove(os.path.join(raiz, nombre))
+                borrados += 1
+    return len(viejas), borrados
+
+
+# ===================== En segundo plano ======================
+#
+# Con gunicorn los respaldos corren en un solo proceso aparte
+# ("respaldar.py continuo", lo arranca gunicorn.conf.py), no en los workers.
+# Igual cada vuelta toma el flock de "respaldos/respaldo.lock" sin esperar:
+# si un respaldo de cron está en curso, se saltea y espera al próximo intervalo.
+
+def _respaldar_si_toca(directorio, archivos, intervalo, conservar):
+    with _exclusivo(directorio, esperar=False) as obtenido:
+        if not obtenido:
+            # Otro worker está respaldando
+            return None
+        momentos = instantaneas(directorio)
+        if momentos and time.time() - momentos[-1].timestamp() < intervalo:
+            return None
+        manifiesto = _respaldar(directorio, archivos)
+        if conservar:
+            _podar(directorio, conservar)
+        return manifiesto
+
+
+def respaldar_cada(directorio, archivos, intervalo, conservar=0):
+    """Respalda cada intervalo segundos (y poda a conservar instantáneas), sin volver"""
+    while True:
+        # Revisa seguido para que un proceso reiniciado no se salte el horario
+        time.sleep(min(intervalo, 60))
+        try:
+            _respaldar_si_toca(directorio, archivos, intervalo, conservar)
+        except Exception as e:
+            print(f"Error en el respaldo automático: {e}")
+
+
+def iniciar_respaldos(directorio, archivos, intervalo, conservar=0):
+    """Hilo con respaldar_cada (el servidor de desarrollo, python app.py)"""
+    hilo = threading.Thread(target=respaldar_cada, args=(directorio, archivos, intervalo, conservar),
+                            name="respaldos", daemon=True)
+    hilo.start()
+    return hilo
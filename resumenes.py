@@ -0,0 +1,185 @@
+"""Resúmenes de un dataset mantenidos al escribir.
+
+Son derivados de la cache (almacenamiento.derivado): se arman una vez con los
+datos y después cada escritura les pasa solo los registros que salieron y los
+que entraron (actualizar), así las pantallas que los usan no recorren el
+dataset completo en cada request.
+"""
+import threading
+
+
+class UltimoPorClave:
+    """Por cada valor de clave: cantidad de registros y el más reciente según fecha.
+
+    Lo usa el listado de historias clínicas: por DNI, cuántas consultas hay y
+    cuál es la última, sin leer el texto de las consultas. Con fechas iguales
+    queda como última la primera que se registró.
+    """
+
+    def __init__(self, registros, clave, fecha):
+        self.clave = clave
+        self.fecha = fecha
+        self._lock = threading.Lock()
+        # valor de clave -> registros con ese valor, en orden de llegada
+        self._registros = {}
+        # valor de clave -> registro más reciente
+        self._ultimos = {}
+        for registro in registros:
+            if self._valido(registro):
+                self._registros.setdefault(registro[clave], []).append(registro)
+        for valor in self._registros:
+            self._recalcular(valor)
+
+    def _valido(self, registro):
+        return isinstance(registro, dict) and bool(registro.get(self.clave))
+
+    def _recalcular(self, valor):
+        registros = self._registros.get(valor)
+        if not registros:
+            self._registros.pop(valor, None)
+            self._ultimos.pop(valor, None)
+            return
+        ultimo = registros[0]
+        for registro in registros[1:]:
+            if (registro.get(self.fecha) or "") > (ultimo.get(self.fecha) or ""):
+                ultimo = registro
+        self._ultimos[valor] = ultimo
+
+    def actualizar(self, quitados, agregados):
+        """Aplica un cambio de los datos: registros que salieron y que entraron"""
+        with self._lock:
+            cambiados = set()
+            # Posiciones de agregados que reemplazaron a un quitado en su lugar
+            reemplazos = set()
+            for n, registro in enumerate(quitados):
+                if not self._valido(registro):
+                    continue
+                valor = registro[self.clave]
+                registros = self._registros.get(valor, [])
+                posicion = next((i for i, r in enumerate(registros) if r == registro), None)
+                if posicion is None:
+                    continue
+                nuevo = agregados[n] if n < len(agregados) else None
+                if self._valido(nuevo) and nuevo[self.clave] == valor:
+                    # Un registro editado queda en su lugar, como en los datos: con
+                    # fechas iguales la última sigue siendo la misma que al armarlo
+                    registros[posicion] = nuevo
+                    reemplazos.add(n)
+                else:
+                    del registros[posicion]
+                cambiados.add(valor)
+            for n, registro in enumerate(agregados):
+                if n not in reemplazos and self._valido(registro):
+                    self._registros.setdefault(registro[self.clave], []).append(registro)
+                    cambiados.add(registro[self.clave])
+            for valor in cambiados:
+                self._recalcular(valor)
+
+    def resumen(self):
+        """[(valor, cantidad, último registro)] de todas las claves.
+
+        Los registros son los de la cache: no modificarlos.
+        """
+        with self._lock:
+            return [(valor, len(self._registros[valor]), ultimo) for valor, ultimo in self._ultimos.items()]
+
+
+def centavos(monto):
+    """Monto en pesos (float) como entero de centavos"""
+    return round(monto * 100)
+
+
+def pesos(centavos):
+    """Entero de centavos como monto en pesos, para mostrar"""
+    return centavos / 100
+
+
+class TotalesPorDia:
+    """Totales de pagos por (fecha, tipo de pago): cantidad, suma de montos y
+    cuántos son de obra social (monto 0).
+
+    Lo usan las estadísticas de pagos: un mes son a lo sumo 31 días por tipo,
+    no todos los pagos del mes. Los montos se suman en centavos enteros: con
+    altas y bajas durante todo el día un float se iría corriendo de la suma
+    de los pagos (1499.9999999999998).
+
+    No se guarda en ningún lado: es una cache de cada proceso, colgada de
+    cada mes de pagos en la cache de almacenamiento (derivados), que cada
+    worker arma al leer el mes y vuelve a armar cuando el mes cambia desde
+    otro proceso. verificar_totales.py la compara contra los pagos.
+    """
+
+    def __init__(self, registros, fecha="fecha", tipo="tipo_pago", monto="monto"):
+        self.fecha = fecha
+        self.tipo = tipo
+        self.monto = monto
+        self._lock = threading.Lock()
+        # (fecha, tipo) -> [cantidad, centavos, obra social]
+        self._totales = {}
+        self._sumar(registros, 1)
+
+    def _sumar(self, registros, signo):
+        for registro in registros:
+            if not isinstance(registro, dict) or not isinstance(registro.get(self.fecha), str):
+                continue
+            clave = (registro[self.fecha], registro.get(self.tipo))
+            monto = centavos(registro.get(self.monto) or 0)
+            totales = self._totales.setdefault(clave, [0, 0, 0])
+            totales[0] += signo
+            totales[1] += signo * monto
+            totales[2] += signo * (monto == 0)
+            if totales[0] <= 0:
+                del self._totales[clave]
+
+    def actualizar(self, quitados, agregados):
+        """Aplica un cambio de los datos: registros que salieron y que entraron"""
+        with self._lock:
+            self._sumar(quitados, -1)
+            self._sumar(agregados, 1)
+
+    def entre(self, desde, hasta):
+        """[((fecha, tipo), (cantidad, centavos, obra social))] con desde <= fecha <= hasta"""
+        with self._lock:
+            return [(clave, tuple(totales)) for clave, totales in self._totales.items()
+                    if desde <= clave[0] <= hasta]
+
+
+class Conteos:
+    """Cantidad de registros por combinación de valores de campos.
+
+    Lo usan los reportes de turnos con (medico, fecha, estado): sumar un
+    rango de fechas recorre combinaciones, no turnos.
+    """
+
+    def __init__(self, registros, campos, fecha="fecha"):
+        self.campos = campos
+        self._posicion_fecha = campos.index(fecha)
+        self._lock = threading.Lock()
+        # valores de los campos -> cantidad
+        self._conteos = {}
+        self._sumar(registros, 1)
+
+    def _sumar(self, registros, signo):
+        for registro in registros:
+            if not isinstance(registro, dict):
+                continue
+            clave = tuple(registro.get(c) for c in self.campos)
+            if not isinstance(clave[self._posicion_fecha], str):
+                continue
+            cantidad = self._conteos.get(clave, 0) + signo
+            if cantidad > 0:
+                self._conteos[clave] = cantidad
+            else:
+                self._conteos.pop(clave, None)
+
+    def actualizar(self, quitados, agregados):
+        """Aplica un cambio de los datos: registros que salieron y que entraron"""
+        with self._lock:
+            self._sumar(quitados, -1)
+            self._sumar(agregados, 1)
+
+    def entre(self, desde, hasta):
+        """[(valores, cantidad)] con desde <= fecha <= hasta"""
+        with self._lock:
+            return [(clave, cantidad) for clave, cantidad in self._conteos.items()
+                    if desde <= clave[self._posicion_fecha] <= hasta]
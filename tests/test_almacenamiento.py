@@ -0,0 +1,408 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+import almacenamiento_sqlite
+import respaldos
+
+
+class _Directorio(unittest.TestCase):
+    """Cada test con su directorio temporal y la cache vacía"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.addCleanup(almacenamiento.invalidar_cache)
+
+    def ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+
+class JournalTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.path = self.ruta("pagos.json")
+        almacenamiento.usar_journal(self.path)
+        almacenamiento.guardar_json(self.path, [{"id": 1}, {"id": 2}, {"id": 3}])
+        # Sin journal todavía: el primer guardado escribe el JSON
+        almacenamiento.agregar(self.path, {"id": 4})
+
+    def journal(self):
+        return almacenamiento._ruta_journal(self.path)
+
+    def leer(self):
+        almacenamiento.invalidar_cache()
+        return [r["id"] for r in almacenamiento.leer_json(self.path)]
+
+    def test_linea_cortada_al_final_se_descarta(self):
+        with open(self.journal(), "ab") as file:
+            file.write(b'{"op":"add","r":{"id"')
+        self.assertEqual(self.leer(), [1, 2, 3, 4])
+
+    def test_escribir_despues_de_un_corte_no_pierde_lo_nuevo(self):
+        with open(self.journal(), "ab") as file:
+            file.write(b'{"op":"add","r":{"id"')
+        almacenamiento.invalidar_cache()
+        almacenamiento.agregar(self.path, {"id": 5})
+        almacenamiento.agregar(self.path, {"id": 6})
+        self.assertEqual(self.leer(), [1, 2, 3, 4, 5, 6])
+        with open(self.journal(), "rb") as file:
+            self.assertTrue(file.read().endswith(b"\n"))
+
+    def test_linea_danada_en_el_medio_es_un_error(self):
+        almacenamiento.agregar(self.path, {"id": 5})
+        with open(self.journal(), "rb") as file:
+            lineas = file.read().split(b"\n")
+        lineas[1] = lineas[1][:-3]
+        with open(self.journal(), "wb") as file:
+            file.write(b"\n".join(lineas))
+        with self.assertRaises(ValueError):
+            self.leer()
+
+    def test_altas_cambios_y_bajas_se_reproducen_desde_el_journal(self):
+        base = almacenamiento._base_journal(self.path)
+        datos = almacenamiento.cargar_json(self.path)
+        datos[0]["monto"] = 10
+        del datos[2]
+        datos.insert(1, {"id": 7})
+        almacenamiento.guardar_json(self.path, datos)
+        almacenamiento.agregar(self.path, {"id": 8})
+
+        # El JSON no se reescribió: todo está en el journal
+        self.assertEqual(almacenamiento._base_journal(self.path), base)
+        self.assertEqual(self.leer(), [1, 7, 2, 4, 8])
+        self.assertEqual(almacenamiento.leer_json(self.path)[0]["monto"], 10)
+
+    def test_journal_de_otra_base_se_ignora(self):
+        almacenamiento.agregar(self.path, {"id": 5})
+        # El JSON se reemplazó a mano: el journal era de la versión anterior
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write('[{"id": 9}]')
+        self.assertEqual(self.leer(), [9])
+
+    def test_compactar_vuelca_el_journal_en_el_json(self):
+        almacenamiento.agregar(self.path, {"id": 5})
+        almacenamiento.compactar(self.path)
+        self.assertFalse(os.path.exists(self.journal()))
+        with open(self.path, "r", encoding="utf-8") as file:
+            self.assertEqual([r["id"] for r in json.load(file)], [1, 2, 3, 4, 5])
+        self.assertEqual(self.leer(), [1, 2, 3, 4, 5])
+
+    def test_journal_grande_se_compacta_solo(self):
+        with mock.patch.object(almacenamiento, "JOURNAL_MIN_BYTES", 200):
+            for i in range(5, 30):
+                almacenamiento.agregar(self.path, {"id": i})
+        with open(self.journal(), "rb") as file:
+            self.assertLess(len(file.read().split(b"\n")), 25)
+        self.assertEqual(self.leer(), list(range(1, 30)))
+
+
+class SnapshotTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.path = self.ruta("pacientes.json")
+        self.pacientes = [{"dni": str(30000000 + i), "apellido": f"Ape{i}"} for i in range(50)]
+        minimo = almacenamiento.SNAPSHOT_MIN_BYTES
+        self.addCleanup(setattr, almacenamiento, "SNAPSHOT_MIN_BYTES", minimo)
+        almacenamiento.SNAPSHOT_MIN_BYTES = 0
+        almacenamiento.usar_snapshots(self.path)
+        self.addCleanup(almacenamiento._snapshots.discard, almacenamiento._clave(self.path))
+        almacenamiento.guardar_json(self.path, self.pacientes)
+        self.leer()
+
+    def snapshot(self):
+        return almacenamiento._ruta_snapshot(self.path)
+
+    def leer(self):
+        almacenamiento.invalidar_cache()
+        return almacenamiento.leer_json(self.path)
+
+    def test_lectura_en_frio_usa_el_snapshot(self):
+        self.assertTrue(os.path.exists(self.snapshot()))
+        with mock.patch.object(almacenamiento.json, "load", side_effect=AssertionError("lee el JSON")):
+            self.assertEqual(self.leer(), self.pacientes)
+
+    def test_snapshot_danado_vuelve_al_json_y_se_regenera(self):
+        with open(self.snapshot(), "r+b") as file:
+            file.seek(-5, os.SEEK_END)
+            byte = file.read(1)
+            file.seek(-5, os.SEEK_END)
+            file.write(bytes([byte[0] ^ 0xFF]))
+        with mock.patch.object(almacenamiento.pickle, "loads", wraps=almacenamiento.pickle.loads) as loads:
+            self.assertEqual(self.leer(), self.pacientes)
+        # El CRC no coincide: ni se intenta decodificar
+        loads.assert_not_called()
+        # Se volvió a escribir bien: la próxima lectura ya no va al JSON
+        with mock.patch.object(almacenamiento.json, "load", side_effect=AssertionError("lee el JSON")):
+            self.assertEqual(self.leer(), self.pacientes)
+
+    def test_snapshot_de_otro_json_no_se_usa(self):
+        otros = self.pacientes[:3]
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(otros, file)
+        self.assertEqual(self.leer(), otros)
+
+
+class CommitAgrupadoTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.path = self.ruta("pagos.json")
+        almacenamiento.usar_journal(self.path)
+        almacenamiento.guardar_json(self.path, [{"id": 1}])
+        almacenamiento.agregar(self.path, {"id": 2})
+        ventana = almacenamiento.VENTANA_COMMIT
+        self.addCleanup(setattr, almacenamiento, "VENTANA_COMMIT", ventana)
+        almacenamiento.usar_commit_agrupado(0)
+        self.fsyncs = []
+        fsync = almacenamiento._fsync
+
+        def registrar(ruta):
+            # Al hacer el fsync: qué bloqueos tiene el hilo y cuánto del journal está escrito
+            self.fsyncs.append((dict(almacenamiento._tomados()), os.path.getsize(ruta)))
+            return fsync(ruta)
+
+        patcher = mock.patch.object(almacenamiento, "_fsync", side_effect=registrar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tam_journal(self):
+        return os.path.getsize(almacenamiento._ruta_journal(self.path))
+
+    def test_fsync_despues_de_soltar_el_bloqueo_y_antes_de_volver(self):
+        almacenamiento.agregar(self.path, {"id": 3})
+        self.assertEqual(self.fsyncs, [({}, self.tam_journal())])
+
+    def test_un_solo_fsync_para_varias_escrituras_del_mismo_bloqueo(self):
+        with almacenamiento.transaccion(self.path):
+            almacenamiento.agregar(self.path, {"id": 3})
+            almacenamiento.agregar(self.path, {"id": 4})
+            self.assertEqual(self.fsyncs, [])
+        self.assertEqual(self.fsyncs, [({}, self.tam_journal())])
+
+    def test_escritura_ya_cubierta_no_repite_el_fsync(self):
+        almacenamiento.agregar(self.path, {"id": 3})
+        # Otro request que escribió antes del fsync de este llega después
+        journal = almacenamiento._ruta_journal(self.path)
+        almacenamiento._hacer_durable(journal, almacenamiento._id_journal(journal), self.tam_journal() - 1)
+        self.assertEqual(len(self.fsyncs), 1)
+
+
+class ParticionesTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.path = self.ruta("turnos.json")
+        almacenamiento.guardar_json(self.path, [
+            {"dni_paciente": "30111222", "fecha": "2026-09-29", "hora": "09:00"},
+            {"dni_paciente": "27444555", "fecha": "2026-10-01", "hora": "10:00"},
+            {"dni_paciente": "27444555", "hora": "11:00"},
+        ])
+        almacenamiento.usar_journal(self.path)
+        almacenamiento.usar_particiones(self.path)
+        almacenamiento.usar_clave(self.path, "dni_paciente", "fecha", "hora")
+
+    def particion(self, mes):
+        # De disco, con su journal aplicado
+        parte = os.path.join(self.ruta("turnos"), mes + ".json")
+        return [(t["dni_paciente"], t.get("fecha")) for t in almacenamiento.leer_archivos(parte)]
+
+    def releer(self):
+        almacenamiento.invalidar_cache()
+        return [(t["dni_paciente"], t.get("fecha")) for t in almacenamiento.cargar_json(self.path)]
+
+    def test_arma_una_particion_por_mes(self):
+        self.assertEqual(sorted(os.listdir(self.ruta("turnos"))), ["2026-09.json", "2026-10.json", "sin-fecha.json"])
+        self.assertEqual(self.particion("2026-10"), [("27444555", "2026-10-01")])
+        self.assertEqual(len(self.releer()), 3)
+
+    def test_buscar_por_fecha_lee_solo_ese_mes(self):
+        self.assertEqual(almacenamiento._fuentes(self.path, {"fecha": "2026-10-01"}),
+                         [os.path.join(self.ruta("turnos"), "2026-10.json")])
+        self.assertEqual(len(almacenamiento.cargar_rango(self.path, "2026-09-01", "2026-09-30")), 1)
+
+    def test_alta_de_un_mes_nuevo_crea_su_particion(self):
+        almacenamiento.agregar(self.path, {"dni_paciente": "30111222", "fecha": "2026-11-03", "hora": "09:00"})
+        self.assertEqual(self.particion("2026-11"), [("30111222", "2026-11-03")])
+        self.assertIn(("30111222", "2026-11-03"), self.releer())
+
+    def test_mover_un_turno_a_otro_mes(self):
+        movido = almacenamiento.modificar(self.path, ("30111222", "2026-09-29", "09:00"), {"fecha": "2026-10-02"})
+        self.assertEqual(movido["fecha"], "2026-10-02")
+        self.assertFalse(os.path.exists(os.path.join(self.ruta("turnos"), "2026-09.json")))
+        self.assertEqual(sorted(self.particion("2026-10")), [("27444555", "2026-10-01"), ("30111222", "2026-10-02")])
+        self.assertEqual(almacenamiento.buscar(self.path, fecha="2026-09-29"), [])
+        self.assertEqual(len(almacenamiento.buscar(self.path, fecha="2026-10-02")), 1)
+        self.assertEqual(sorted(self.releer(), key=str),
+                         sorted([("27444555", "2026-10-01"), ("30111222", "2026-10-02"), ("27444555", None)], key=str))
+
+    def test_cambio_dentro_del_mes_va_al_journal_de_la_particion(self):
+        almacenamiento.modificar(self.path, ("27444555", "2026-10-01", "10:00"), {"hora": "10:30"})
+        self.assertTrue(os.path.exists(almacenamiento._ruta_journal(os.path.join(self.ruta("turnos"), "2026-10.json"))))
+        almacenamiento.invalidar_cache()
+        self.assertEqual(almacenamiento.buscar(self.path, fecha="2026-10-01")[0]["hora"], "10:30")
+
+
+class SQLiteTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.pagos = self.ruta("pagos.json")
+        self.turnos = self.ruta("turnos.json")
+        almacenamiento.guardar_json(self.pagos, [{"id": 1, "fecha": "2026-10-01", "monto": 1000}])
+        almacenamiento.usar_sqlite(self.ruta("consultorio.db"), {self.pagos: "pagos", self.turnos: "turnos"})
+        self.addCleanup(self._sin_sqlite)
+
+    @staticmethod
+    def _sin_sqlite():
+        almacenamiento._motor = None
+        almacenamiento._tablas.clear()
+
+    def test_importa_el_json_al_crear_la_base(self):
+        self.assertEqual(almacenamiento.leer_json(self.pagos), [{"id": 1, "fecha": "2026-10-01", "monto": 1000}])
+
+    def test_altas_cambios_y_bajas_por_clave_sin_cargar_la_tabla(self):
+        almacenamiento.usar_clave(self.pagos, "id")
+        almacenamiento.usar_indices(self.pagos, "fecha")
+        almacenamiento.leer_json(self.pagos)
+        self.assertEqual(len(almacenamiento.buscar(self.pagos, fecha="2026-10-01")), 1)
+        with mock.patch.object(almacenamiento, "_diferencias", side_effect=AssertionError("compara la tabla")), \
+                mock.patch.object(almacenamiento._motor, "leer", side_effect=AssertionError("lee la tabla")):
+            almacenamiento.agregar(self.pagos, {"id": 2, "fecha": "2026-10-01", "monto": 500})
+            almacenamiento.agregar(self.pagos, {"id": 3, "fecha": "2026-10-02", "monto": 700})
+            self.assertEqual(almacenamiento.modificar(self.pagos, (2,), {"monto": 600})["monto"], 600)
+            self.assertTrue(almacenamiento.eliminar(self.pagos, 1))
+            self.assertFalse(almacenamiento.eliminar(self.pagos, 99))
+            self.assertIsNone(almacenamiento.modificar(self.pagos, (99,), {"monto": 1}))
+            self.assertEqual(almacenamiento.obtener(self.pagos, 3)["monto"], 700)
+            # La cache siguió a la base, índices incluidos
+            self.assertEqual([p["id"] for p in almacenamiento.leer_json(self.pagos)], [2, 3])
+            self.assertEqual([p["monto"] for p in almacenamiento.buscar(self.pagos, fecha="2026-10-01")], [600])
+
+        almacenamiento.invalidar_cache()
+        self.assertEqual([(p["id"], p["monto"]) for p in almacenamiento.leer_json(self.pagos)], [(2, 600), (3, 700)])
+
+    def otro_worker(self):
+        # Otro proceso con su propia conexión a la misma base
+        return almacenamiento_sqlite.MotorSQLite(self.ruta("consultorio.db"))
+
+    def test_operaciones_con_version_vieja_no_se_aplican(self):
+        motor, otro = almacenamiento._motor, self.otro_worker()
+        version, _ = motor.leer("pagos")
+        self.assertEqual(otro.aplicar("pagos", version, [{"op": "set", "i": 0, "r": {"id": 1, "monto": 5}}]),
+                         version + 1)
+        self.assertIsNone(motor.aplicar("pagos", version, [{"op": "del", "i": 0}]))
+        self.assertIsNone(motor.reemplazar("pagos", [], version))
+        self.assertEqual(motor.leer("pagos"), (version + 1, [{"id": 1, "monto": 5}]))
+
+    def test_guardar_reintenta_si_otro_worker_escribio_en_el_medio(self):
+        datos = almacenamiento.cargar_json(self.pagos)
+        datos[0]["monto"] = 2000
+        aplicar = almacenamiento._motor.aplicar
+
+        def escribe_otro_antes(tabla, version, operaciones):
+            if not escribe_otro_antes.hecho:
+                escribe_otro_antes.hecho = True
+                self.otro_worker().agregar(tabla, {"id": 2, "fecha": "2026-10-02", "monto": 500})
+            return aplicar(tabla, version, operaciones)
+
+        escribe_otro_antes.hecho = False
+        with mock.patch.object(almacenamiento._motor, "aplicar", side_effect=escribe_otro_antes) as intentos:
+            almacenamiento.guardar_json(self.pagos, datos)
+        # El primer intento encontró otra versión; el segundo se calculó sobre la tabla nueva
+        self.assertEqual(intentos.call_count, 2)
+        self.assertEqual(almacenamiento.leer_json(self.pagos), datos)
+        almacenamiento.invalidar_cache()
+        self.assertEqual(almacenamiento.leer_json(self.pagos), datos)
+
+    def test_cache_no_pierde_lo_que_escribio_otro_worker(self):
+        almacenamiento.usar_clave(self.pagos, "id")
+        almacenamiento.leer_json(self.pagos)
+        self.otro_worker().agregar("pagos", {"id": 2, "fecha": "2026-10-02", "monto": 500})
+        almacenamiento.agregar(self.pagos, {"id": 3, "fecha": "2026-10-03", "monto": 700})
+        almacenamiento.modificar(self.pagos, (1,), {"monto": 1100})
+        self.assertEqual([(p["id"], p["monto"]) for p in almacenamiento.leer_json(self.pagos)],
+                         [(1, 1100), (2, 500), (3, 700)])
+
+    def test_conflicto_en_cada_intento_no_pisa_la_tabla(self):
+        otro = {"id": 2, "fecha": "2026-10-02", "monto": 500}
+        with mock.patch.object(almacenamiento._motor, "aplicar", return_value=None), \
+                mock.patch.object(almacenamiento._motor, "reemplazar", return_value=None) as reemplazar:
+            with self.assertRaises(almacenamiento.ConflictoDeVersion):
+                almacenamiento.guardar_json(self.pagos, [otro])
+        reemplazar.assert_not_called()
+        almacenamiento.invalidar_cache()
+        self.assertEqual([p["id"] for p in almacenamiento.leer_json(self.pagos)], [1])
+
+
+class RespaldosTest(_Directorio):
+    def setUp(self):
+        super().setUp()
+        self.pagos = self.ruta("pagos.json")
+        self.agenda = self.ruta("agenda.json")
+        almacenamiento.guardar_json(self.pagos, [
+            {"id": i, "fecha": f"2026-{9 + i % 2:02d}-{1 + i % 28:02d}", "monto": 100 * i} for i in range(1, 201)])
+        almacenamiento.guardar_json(self.agenda, {"Dr. Pérez": {"LUNES": ["09:00", "09:30"]}})
+        almacenamiento.usar_journal(self.pagos)
+        almacenamiento.usar_particiones(self.pagos)
+        self.directorio_respaldos = self.ruta("respaldos")
+        self.archivos = {"pagos.json": self.pagos, "agenda.json": self.agenda}
+
+    def respaldar(self):
+        return respaldos.respaldar(self.directorio_respaldos, self.archivos)
+
+    def estado(self):
+        almacenamiento.invalidar_cache()
+        return almacenamiento.leer_completo(self.pagos), almacenamiento.leer_json(self.agenda)
+
+    def test_restaurar_vuelve_a_lo_respaldado(self):
+        antes = self.estado()
+        self.respaldar()
+        almacenamiento.agregar(self.pagos, {"id": 201, "fecha": "2026-10-05", "monto": 1})
+        almacenamiento.guardar_json(self.pagos, almacenamiento.cargar_json(self.pagos)[5:])
+        almacenamiento.guardar_json(self.agenda, {})
+
+        respaldos.restaurar(self.directorio_respaldos, self.archivos)
+        self.assertEqual(self.estado(), antes)
+
+    def test_restaurar_hasta_un_momento(self):
+        primero = self.respaldar()
+        antes = self.estado()
+        almacenamiento.agregar(self.pagos, {"id": 201, "fecha": "2026-10-05", "monto": 1})
+        self.respaldar()
+
+        usados = respaldos.restaurar(self.directorio_respaldos, self.archivos,
+                                     datetime.fromisoformat(primero["momento"]))
+        self.assertEqual(set(usados.values()), {datetime.fromisoformat(primero["momento"])})
+        self.assertEqual(self.estado(), antes)
+
+    def test_un_alta_solo_escribe_el_bloque_donde_cae(self):
+        self.assertGreater(self.respaldar()["resumen"]["nuevos"], 2)
+        almacenamiento.agregar(self.pagos, {"id": 201, "fecha": "2026-10-05", "monto": 1})
+        resumen = self.respaldar()["resumen"]
+        # La agenda y el mes de septiembre no cambiaron: ni se leen
+        self.assertEqual(resumen["sin_cambios"], 2)
+        self.assertEqual(resumen["nuevos"], 1)
+        self.assertGreater(resumen["reutilizados"], 0)
+
+    def test_bloque_danado_se_detecta_y_no_se_restaura(self):
+        manifiesto = self.respaldar()
+        digest = manifiesto["datasets"]["pagos.json"]["fuentes"][0]["bloques"][0]
+        with open(respaldos._ruta_objeto(self.directorio_respaldos, digest), "wb") as file:
+            file.write(b"basura")
+        self.assertEqual([d for _, d in respaldos.verificar(self.directorio_respaldos)], [digest])
+
+        almacenamiento.agregar(self.pagos, {"id": 201, "fecha": "2026-10-05", "monto": 1})
+        antes = self.estado()
+        with self.assertRaises(ValueError):
+            respaldos.restaurar(self.directorio_respaldos, self.archivos)
+        self.assertEqual(self.estado(), antes)
+
+
+if __name__ == "__main__":
+    unittest.main()
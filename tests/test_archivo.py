@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+
+
+class EliminarArchivadoTest(unittest.TestCase):
+    """Pagos borrados por id (usar_clave) con meses pasados a archivo"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.addCleanup(almacenamiento.invalidar_cache)
+        self.path = os.path.join(self.directorio, "pagos.json")
+        almacenamiento.guardar_json(self.path, [
+            {"id": 1, "fecha": "2024-01-15", "monto": 1000},
+            {"id": 2, "fecha": "2024-02-03", "monto": 2500},
+            {"id": 3, "fecha": "2026-10-01", "monto": 1500},
+        ])
+        almacenamiento.usar_journal(self.path)
+        almacenamiento.usar_particiones(self.path)
+        almacenamiento.usar_clave(self.path, "id")
+        almacenamiento.archivar(self.path, "2025-01")
+
+    def test_pago_archivado_no_se_borra_pero_se_ubica(self):
+        self.assertFalse(almacenamiento.eliminar(self.path, 2))
+        self.assertEqual(almacenamiento.archivado(self.path, 2), "2024-02")
+        self.assertEqual(len(almacenamiento.leer_completo(self.path)), 3)
+
+    def test_pago_inexistente_no_esta_archivado(self):
+        self.assertFalse(almacenamiento.eliminar(self.path, 99))
+        self.assertIsNone(almacenamiento.archivado(self.path, 99))
+
+    def test_pago_activo_se_borra(self):
+        self.assertIsNone(almacenamiento.archivado(self.path, 3))
+        self.assertTrue(almacenamiento.eliminar(self.path, 3))
+        self.assertEqual([p["id"] for p in almacenamiento.leer_completo(self.path)], [1, 2])
+
+    def test_ubicar_lo_archivado_no_lo_deja_en_la_cache(self):
+        almacenamiento.archivado(self.path, 1)
+        self.assertFalse([ruta for ruta in almacenamiento._cache if ruta.endswith(".gz")])
+
+    def test_archivar_otro_mes_actualiza_las_claves(self):
+        self.assertIsNone(almacenamiento.archivado(self.path, 3))
+        almacenamiento.archivar(self.path, "2027-01")
+        self.assertEqual(almacenamiento.archivado(self.path, 3), "2026-10")
+
+
+class ArchivarTurnosTest(unittest.TestCase):
+    """Solo se archivan meses con todos los turnos cerrados"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.addCleanup(almacenamiento.invalidar_cache)
+        self.path = os.path.join(self.directorio, "turnos.json")
+        almacenamiento.guardar_json(self.path, [
+            {"dni_paciente": "30111222", "fecha": "2024-01-15", "hora": "09:00", "estado": "atendido"},
+            {"dni_paciente": "27444555", "fecha": "2024-01-16", "hora": "10:00", "estado": "ausente"},
+            {"dni_paciente": "30111222", "fecha": "2024-02-03", "hora": "09:30", "estado": "atendido"},
+            {"dni_paciente": "27444555", "fecha": "2024-02-05", "hora": "11:00", "estado": "sin atender"},
+        ])
+        almacenamiento.usar_journal(self.path)
+        almacenamiento.usar_particiones(self.path)
+        almacenamiento.usar_clave(self.path, "dni_paciente", "fecha", "hora")
+
+    def archivar(self):
+        return almacenamiento.archivar(self.path, "2025-01",
+                                       cerrado=lambda t: t.get("estado") in ("atendido", "ausente"))
+
+    def test_mes_con_turnos_abiertos_queda_activo(self):
+        self.assertEqual(self.archivar(), ({"2024-01": 2}, {"2024-02": 1}))
+        self.assertEqual([t["fecha"] for t in almacenamiento.cargar_json(self.path)], ["2024-02-03", "2024-02-05"])
+        # El turno abierto se sigue pudiendo modificar
+        self.assertIsNotNone(almacenamiento.modificar(
+            self.path, ("27444555", "2024-02-05", "11:00"), {"estado": "ausente"}))
+        self.assertEqual(self.archivar(), ({"2024-02": 2}, {}))
+        self.assertEqual(almacenamiento.cargar_json(self.path), [])
+
+    def test_buscar_completo_incluye_lo_archivado(self):
+        self.archivar()
+        self.assertEqual(almacenamiento.buscar(self.path, dni_paciente="30111222")[0]["fecha"], "2024-02-03")
+        self.assertEqual([t["fecha"] for t in almacenamiento.buscar_completo(self.path, dni_paciente="30111222")],
+                         ["2024-01-15", "2024-02-03"])
+        self.assertEqual(almacenamiento.buscar_completo(self.path, dni_paciente="99"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from franjas import AgendaCompilada, franja
+
+
+class AgendaCompiladaTest(unittest.TestCase):
+    def setUp(self):
+        self.agenda = AgendaCompilada({"Dr. Pérez": {"LUNES": ["09:00", "14:07", "14:10"]}})
+
+    def test_horarios_fuera_de_la_grilla_se_respetan(self):
+        self.assertTrue(self.agenda.atiende("Dr. Pérez", "LUNES", "14:07"))
+        self.assertFalse(self.agenda.atiende("Dr. Pérez", "LUNES", "14:05"))
+        self.assertEqual(self.agenda.libres("Dr. Pérez", "LUNES", ["14:10"]), ["09:00", "14:07"])
+        self.assertEqual(self.agenda.cantidad(), 3)
+
+    def test_solo_se_rechaza_lo_que_no_es_un_horario(self):
+        self.assertEqual(franja("23:59"), 23 * 60 + 59)
+        for hora in ("9:00", "24:00", "14:7", "", None):
+            self.assertIsNone(franja(hora), hora)
+
+
+if __name__ == "__main__":
+    unittest.main()
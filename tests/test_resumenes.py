@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+from resumenes import UltimoPorClave, TotalesPorDia, pesos
+
+
+def _resumen(ultimos):
+    return {valor: (cantidad, ultimo["id"]) for valor, cantidad, ultimo in ultimos.resumen()}
+
+
+class UltimoPorClaveTest(unittest.TestCase):
+    def setUp(self):
+        self.historias = [
+            {"id": 1, "dni": "30111222", "fecha_consulta": "2026-03-10", "consulta": "control"},
+            {"id": 2, "dni": "30111222", "fecha_consulta": "2026-03-10", "consulta": "estudios"},
+            {"id": 3, "dni": "27444555", "fecha_consulta": "2026-01-05", "consulta": "gripe"},
+        ]
+
+    def armar(self, historias):
+        return UltimoPorClave(historias, clave="dni", fecha="fecha_consulta")
+
+    def test_con_fechas_iguales_queda_la_primera(self):
+        self.assertEqual(_resumen(self.armar(self.historias)), {"30111222": (2, 1), "27444555": (1, 3)})
+
+    def test_editar_con_fechas_iguales_no_cambia_la_ultima(self):
+        ultimos = self.armar(self.historias)
+        editada = dict(self.historias[0], consulta="control anual")
+        ultimos.actualizar([self.historias[0]], [editada])
+
+        despues = [editada] + self.historias[1:]
+        self.assertEqual(_resumen(ultimos), _resumen(self.armar(despues)))
+        ultima = {valor: ultimo for valor, _, ultimo in ultimos.resumen()}["30111222"]
+        self.assertEqual(ultima, editada)
+
+    def test_cambiar_el_dni_la_pasa_a_la_otra_clave(self):
+        ultimos = self.armar(self.historias)
+        movida = dict(self.historias[0], dni="27444555")
+        ultimos.actualizar([self.historias[0]], [movida])
+
+        despues = [movida] + self.historias[1:]
+        self.assertEqual(_resumen(ultimos), _resumen(self.armar(despues)))
+
+
+class TotalesPorDiaTest(unittest.TestCase):
+    def test_altas_y_bajas_no_corren_el_monto(self):
+        pagos = [{"fecha": "2026-10-01", "tipo_pago": "efectivo", "monto": 0.1} for _ in range(10)]
+        totales = TotalesPorDia(pagos[:1])
+        totales.actualizar([], pagos[1:])
+        totales.actualizar(pagos[3:6], [])
+        totales.actualizar([], [{"fecha": "2026-10-01", "tipo_pago": "efectivo", "monto": 1499.3}])
+
+        (clave, (cantidad, centavos, obra_social)), = totales.entre("2026-10-01", "2026-10-01")
+        self.assertEqual((cantidad, centavos, obra_social), (8, 150000, 0))
+        self.assertEqual(pesos(centavos), 1500.0)
+
+
+class UltimoPorClaveDerivadoTest(unittest.TestCase):
+    """El mismo caso a través de la cache: guardar_json actualiza el derivado"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.path = os.path.join(self.directorio, "historias_clinicas.json")
+        almacenamiento.usar_journal(self.path)
+        self.addCleanup(almacenamiento.invalidar_cache)
+
+    def resumen(self):
+        return _resumen(almacenamiento.derivado(
+            self.path, "historias",
+            lambda historias: UltimoPorClave(historias, clave="dni", fecha="fecha_consulta")))
+
+    def test_editar_con_fechas_iguales_coincide_con_rearmarlo(self):
+        almacenamiento.guardar_json(self.path, [
+            {"id": 1, "dni": "30111222", "fecha_consulta": "2026-03-10", "consulta": "control"},
+            {"id": 2, "dni": "30111222", "fecha_consulta": "2026-03-10", "consulta": "estudios"},
+        ])
+        self.resumen()
+
+        historias = almacenamiento.cargar_json(self.path)
+        historias[0]["consulta"] = "control anual"
+        almacenamiento.guardar_json(self.path, historias)
+        actualizado = self.resumen()
+
+        almacenamiento.invalidar_cache()
+        self.assertEqual(actualizado, self.resumen())
+        self.assertEqual(actualizado["30111222"], (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+"""Verifica los totales de pagos por día y tipo de pago contra los pagos.
+
+    python verificar_totales.py                      todos los meses
+    python verificar_totales.py 2026-09 2026-10    solo esos meses
+
+La app mantiene los totales (resumenes.TotalesPorDia) en la memoria de cada
+worker, junto a cada mes de pagos, y los rearma sola cuando ese mes cambia
+desde otro proceso. Este script no puede tocar esos totales: arma los suyos
+desde cero, como los arma un worker al arrancar, los compara mes por mes con
+la suma directa de los pagos (en centavos) y sale con código 1 si alguno no
+coincide.
+"""
+import sys
+
+from almacenamiento import cargar_prefijo, leer_completo, invalidar_cache, derivados
+from config import PAGOS_FILE, configurar_almacenamiento
+from resumenes import TotalesPorDia, centavos, pesos
+
+configurar_almacenamiento()
+invalidar_cache()
+meses = sys.argv[1:] or sorted({p["fecha"][:7] for p in leer_completo(PAGOS_FILE)
+                                if isinstance(p.get("fecha"), str)})
+
+distintos = 0
+for mes in meses:
+    # Los mismos totales que suma la app (totales_pagos), de todos los días y tipos del mes
+    cantidad = monto = obra_social = 0
+    for totales in derivados(PAGOS_FILE, "totales", TotalesPorDia, mes, mes + "\uffff"):
+        for _, (c, m, o) in totales.entre(mes, mes + "\uffff"):
+            cantidad, monto, obra_social = cantidad + c, monto + m, obra_social + o
+    pagos = cargar_prefijo(PAGOS_FILE, mes)
+    montos = [centavos(p.get("monto") or 0) for p in pagos]
+    directo = (len(pagos), sum(montos), montos.count(0))
+    ok = (cantidad, monto, obra_social) == directo
+    distintos += not ok
+    print(f"{mes}: {cantidad} pagos, ${pesos(monto):,.2f}, {obra_social} de obra social"
+          + ("" if ok else f"  <- NO COINCIDE con los pagos: {directo[0]} pagos, "
+                           f"${pesos(directo[1]):,.2f}, {directo[2]} de obra social"))
+
+sys.exit(1 if distintos else 0)